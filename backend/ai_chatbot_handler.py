@@ -3,175 +3,286 @@ AI-Powered Chatbot Handler for Company Onboarding Assistant
 Uses OpenAI GPT for intelligent conversation and data extraction
 """
 
-import json
-import os
-from typing import Dict, Any, Optional, List
-from sqlalchemy.orm import Session
-from openai import OpenAI
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, Any, Optional, List, AsyncIterator, Tuple
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from openai import AsyncOpenAI
 from models import ChatSession, ChatMessage, CompanyOnboarding, Product, ChatSessionStatus
+from session_cache import store_session_state, restore_session_state, invalidate_session_state
+from chat_archive import restore_archived_session
 from config import get_settings
+from llm_limiter import get_llm_limiter, LLMOverloadedError
+from llm_tools import CHAT_SYSTEM_PROMPT, CHAT_TOOLS, parse_tool_call, dispatch_tool_call
+from llm_context import build_context, estimate_tools_tokens, record_usage
+from chat_router import route_turn, route_reply, record_route
 
 # Initialize settings
 settings = get_settings()
 
-# OpenAI client will be initialized lazily
-_client = None
+# Tool schemas are sent with every chat completion and count against the token budget
+CHAT_TOOLS_TOKENS = estimate_tools_tokens(CHAT_TOOLS)
 
-def get_openai_client():
-    """Lazy initialize OpenAI client"""
-    global _client
-    if _client is None and settings.openai_api_key:
-        _client = OpenAI(api_key=settings.openai_api_key)
-    return _client
+# Async OpenAI client will be initialized lazily
+_async_client = None
+
+def get_async_openai_client():
+    """
+    Lazy initialize async OpenAI client
+
+    The async client lets chat completions be awaited, so a slow LLM round trip
+    no longer blocks the event loop for every other request on the worker.
+    """
+    global _async_client
+    if _async_client is None and settings.openai_api_key:
+        _async_client = AsyncOpenAI(api_key=settings.openai_api_key)
+    return _async_client
 
 
 class AIChatbotHandler:
     """AI-powered chatbot handler using OpenAI"""
 
-    def __init__(self, db: Session, user_id: int, session_id: Optional[int] = None):
+    # Recent messages loaded for each turn; as many as fit LLM_CONTEXT_TOKEN_BUDGET are sent
+    HISTORY_WINDOW = 20
+
+    def __init__(self, db: AsyncSession, user_id: int, session_id: Optional[int] = None):
         self.db = db
         self.user_id = user_id
         self.session_id = session_id
         self.session = None
         self.onboarding_data = None
 
-        # Load or create session
-        if session_id:
-            self.session = db.query(ChatSession).filter(
-                ChatSession.id == session_id,
-                ChatSession.user_id == user_id
-            ).first()
+        # Recent message window, kept in memory once known (seeded from the session state cache)
+        self._history = None
+
+        # Inside turn() writes are only flushed; the turn commits them once
+        self._in_turn = False
+        self._turn_flushed = False
+
+        # Messages added inside a turn, written with the rest of it after the LLM call
+        self._unsaved_messages = []
+
+    @asynccontextmanager
+    async def turn(self):
+        """
+        Unit of work for one chat turn
+
+        Everything the turn writes (messages, onboarding data, products, status) is
+        committed once when the block exits. Messages are buffered and other changes
+        flushed as they are made; since nothing is flushed before the LLM call, the
+        turn holds no connection while it waits for the model. If the block raises,
+        the whole turn is rolled back, including the user's message.
+        Loaded instances are expired by the rollback: call load_session() before
+        using the handler again.
+        """
+        self._in_turn = True
+        self._turn_flushed = False
+        try:
+            yield self
+            self._add_unsaved_messages()
+            await self.db.commit()
+        except BaseException:
+            self._unsaved_messages = []
+            await self.db.rollback()
+            self._history = None
+            if self.session_id:
+                invalidate_session_state(self.session_id)
+            raise
+        finally:
+            self._in_turn = False
+
+        # Write-through: the next turn on this session starts from the cache
+        if self.session:
+            store_session_state(self.session, self.onboarding_data, self._history, self.HISTORY_WINDOW)
+
+    async def _save(self, *instances):
+        """Flush pending writes inside a turn; otherwise commit and refresh the given instances"""
+        if self._in_turn:
+            # Flushing assigns ids and column defaults, so no refresh is needed
+            self._add_unsaved_messages()
+            await self.db.flush()
+            self._turn_flushed = True
+            return
+        await self.db.commit()
+        for instance in instances:
+            await self.db.refresh(instance)
+
+    def _add_unsaved_messages(self):
+        """Hand the turn's buffered messages to the db session, in the order they were added"""
+        self.db.add_all(self._unsaved_messages)
+        self._unsaved_messages = []
+
+    async def end_read_transaction(self):
+        """
+        Return the pooled connection before a slow LLM call
+
+        Until the turn flushes, its transaction only holds reads, so it is ended
+        here instead of sitting idle in transaction while the call (and its wait
+        for a limiter slot) runs. The turn's writes check out a connection again.
+        """
+        if self.db is None or self._turn_flushed or not self.db.in_transaction():
+            return
+        if self.db.new or self.db.dirty or self.db.deleted:
+            return
+        await self.db.commit()
+
+    async def _discard_changes(self, instance):
+        """
+        Drop the unsaved changes of a failed write
+
+        Outside a turn this rolls back; inside one it reloads the instance, so the
+        rest of the turn is kept. A failed flush cannot be undone that way: the
+        reload then raises and the whole turn rolls back.
+        """
+        if self._in_turn:
+            await self.db.refresh(instance)
+        else:
+            await self.db.rollback()
+
+    async def load_session(self, restore_archived: bool = False) -> Optional[ChatSession]:
+        """
+        Load the chat session and its onboarding data (if session_id was given)
+
+        Safe to call again to refresh state already loaded in this db session.
+        A session cached by an earlier turn is rebuilt without any SQL.
+        With restore_archived=True an archived session is restored to the hot
+        tables first. Only pass it while holding the session's turn lock: the
+        restore re-inserts the archived message ids, so two at once collide.
+        """
+        if self.session_id:
+            cached = await restore_session_state(self.db, self.session_id, self.user_id, self.HISTORY_WINDOW)
+            if cached:
+                self.session, self.onboarding_data, self._history = cached
+                return self.session
+
+            self._history = None
+            result = await self.db.execute(
+                select(ChatSession).where(
+                    ChatSession.id == self.session_id,
+                    ChatSession.user_id == self.user_id
+                ).execution_options(populate_existing=True)
+            )
+            self.session = result.scalar_one_or_none()
+
+            if restore_archived and self.session and self.session.archived_at is not None:
+                # A new turn on an archived session brings its transcript back to chat_messages
+                await restore_archived_session(self.db, self.session)
+                await self._save()
 
             if self.session:
-                self.onboarding_data = db.query(CompanyOnboarding).filter(
-                    CompanyOnboarding.chat_session_id == session_id
-                ).first()
+                result = await self.db.execute(
+                    select(CompanyOnboarding).where(
+                        CompanyOnboarding.chat_session_id == self.session_id
+                    ).execution_options(populate_existing=True)
+                )
+                self.onboarding_data = result.scalar_one_or_none()
+
+        return self.session
 
-    def create_session(self) -> ChatSession:
+    async def create_session(self) -> ChatSession:
         """Create a new chat session"""
         self.session = ChatSession(
             user_id=self.user_id,
             status=ChatSessionStatus.ACTIVE
         )
         self.db.add(self.session)
-        self.db.commit()
-        self.db.refresh(self.session)
+        await self._save(self.session)
 
         # Mark all previous records as not current
-        self.db.query(CompanyOnboarding).filter(
-            CompanyOnboarding.user_id == self.user_id,
-            CompanyOnboarding.is_current == True
-        ).update({"is_current": False})
-        self.db.commit()
+        await self.db.execute(
+            update(CompanyOnboarding).where(
+                CompanyOnboarding.user_id == self.user_id,
+                CompanyOnboarding.is_current == True
+            ).values(is_current=False)
+        )
 
         # Create new onboarding data marked as current
         self.onboarding_data = CompanyOnboarding(
             chat_session_id=self.session.id,
             user_id=self.user_id,
-            is_current=True
+            is_current=True,
+            products=[]  # loaded-empty, so a flush-only turn never lazy loads it
         )
         self.db.add(self.onboarding_data)
-        self.db.commit()
-        self.db.refresh(self.onboarding_data)
+        await self._save(self.onboarding_data)
 
+        # Older sessions' onboarding records were demoted in bulk, which skips the cache's ORM events
+        invalidate_session_state(user_id=self.user_id)
+
+        self._history = []
         return self.session
 
-    def get_conversation_history(self) -> List[ChatMessage]:
-        """Get conversation history for current session"""
+    async def get_conversation_history(self) -> List[ChatMessage]:
+        """Get the full conversation history for current session (turns use get_recent_messages)"""
+        if not self.session:
+            return []
+
+        result = await self.db.execute(
+            select(ChatMessage).where(
+                ChatMessage.session_id == self.session.id
+            ).order_by(ChatMessage.created_at)
+        )
+        return list(result.scalars().all())
+
+    async def get_recent_messages(self, limit: Optional[int] = None) -> List[ChatMessage]:
+        """Get the last `limit` messages (default HISTORY_WINDOW) for current session, oldest first"""
         if not self.session:
             return []
 
-        return self.db.query(ChatMessage).filter(
-            ChatMessage.session_id == self.session.id
-        ).order_by(ChatMessage.created_at).all()
+        limit = limit or self.HISTORY_WINDOW
+        if self._history is not None and limit <= self.HISTORY_WINDOW:
+            return self._history[-limit:]
 
-    def add_message(self, role: str, content: str) -> ChatMessage:
+        # Newest rows first so only the window is read, then put back in conversation order
+        result = await self.db.execute(
+            select(ChatMessage).where(
+                ChatMessage.session_id == self.session.id
+            ).order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(max(limit, self.HISTORY_WINDOW))
+        )
+        # Messages buffered by the current turn are not in the table yet
+        history = list(reversed(result.scalars().all())) + self._unsaved_messages
+
+        self._history = history[-self.HISTORY_WINDOW:]
+        return history[-limit:]
+
+    async def has_messages(self) -> bool:
+        """Check whether the current session has any messages yet"""
+        if not self.session:
+            return False
+
+        # Reading the window rather than an EXISTS lets the turn cache it too
+        return bool(await self.get_recent_messages(1))
+
+    async def add_message(self, role: str, content: str) -> ChatMessage:
         """Add a message to the conversation"""
         message = ChatMessage(
             session_id=self.session.id,
             role=role,
-            content=content
+            content=content,
+            created_at=datetime.utcnow()  # When it was said, not when the turn writes it
         )
-        self.db.add(message)
-        self.db.commit()
-        self.db.refresh(message)
+        if self._in_turn:
+            self._unsaved_messages.append(message)
+        else:
+            self.db.add(message)
+            await self._save(message)
+
+        if self._history is not None:
+            self._history.append(message)
+            del self._history[:-self.HISTORY_WINDOW]
         return message
 
-    def get_system_prompt(self) -> str:
-        """Get the system prompt for the AI"""
-        return """你是一個專業的企業資料收集助理。你的任務是：
-
-1. 用友善、專業的態度與使用者對話
-2. **一次只詢問一個欄位**，按照以下順序收集資訊：
-   - 產業別（如：食品業、鋼鐵業、電子業等）
-   - 資本總額（以臺幣為單位）
-   - 發明專利數量（⚠️ 特別注意：發明專利和新型專利要分開詢問，避免混淆）
-   - 新型專利數量（⚠️ 特別注意：發明專利和新型專利要分開詢問，避免混淆）
-   - 公司認證資料數量（⚠️ 不包括ESG認證，ESG認證會分開詢問）
-   - ESG相關認證資料（請使用者列出所有ESG認證，例如：ISO 14064, ISO 14067）
-
-3. 收集產品資訊（可以有多個產品）：
-   - 產品ID（⚠️ 必須是唯一的，例如：PROD001、PROD002）
-   - 產品名稱
-   - 價格
-   - 主要原料
-   - 產品規格（尺寸、精度）
-   - 技術優勢
-
-重要提示：
-- **一次詢問一個欄位**，等待使用者回答後再詢問下一個
-- **如果使用者主動提供多個資訊**，全部提取並記錄，然後詢問下一個未填寫的欄位（不要重複詢問已提供的）
-- **發明專利和新型專利必須分開詢問**，避免使用者混淆這兩種專利類型
-- 保持對話自然流暢，按順序逐個收集資料
-- 你的責任範圍僅限於上述資料的收集
-
-🏆 **ESG認證 vs 公司認證的區分**：
-
-**ESG相關認證（環境、社會、治理）：**
-- ISO 14064（溫室氣體盤查）
-- ISO 14067（碳足跡）
-- ISO 14046（水足跡）
-- GRI Standards（永續報告）
-- ISSB / IFRS S1、S2（永續揭露）
-
-**公司認證（依產業分類）：**
-- 食品/農產/餐飲：HACCP, ISO 22000, FSSC 22000, GMP
-- 汽車零組件：IATF 16949, ISO 9001, ISO 14001
-- 電子/半導體：ISO 9001, ISO 14001, ISO 45001, IECQ QC 080000, RoHS, REACH
-- 一般製造業：ISO 9001, ISO 14001, ISO 45001
-- 生技/醫療：ISO 13485
-- 化工/材料：ISO 9001, ISO 14001, ISO 45001, ISO 50001
-- 物流/倉儲：ISO 9001, ISO 22000/HACCP, GDP, ISO 28000
-- 資訊服務：ISO 27001, ISO 27701, ISO 9001
-
-**詢問方式：**
-1. 先問「公司認證資料數量」（不包括ESG）
-2. 再問「請列出所有ESG相關認證」（例如：ISO 14064, ISO 14067）
-3. 幫助使用者分辨：如果使用者混淆，主動提醒哪些屬於ESG，哪些屬於公司認證
-
-🔄 **更新現有資料**：
-- 如果使用者說要「修改」、「更新」或「更正」某個資料，直接使用 update_onboarding_data 函數更新
-- 使用者可以隨時修改已填寫的任何欄位
-- 更新後要確認：「已更新 [欄位名稱] 為 [新值]」
-
-📝 **產品ID指引**：
-- 收集產品資訊時，先詢問「請提供產品ID（例如：PROD001、SKU-001等）」
-- 強調產品ID必須是唯一的識別碼
-- 如果使用者不清楚，建議格式：「PROD001」、「PROD002」等
-
-📎 **文件上傳功能**：
-- 系統支援文件上傳功能（PDF、Word、圖片、TXT），可自動提取公司資料
-- 當使用者詢問是否能上傳文件時，告訴他們**可以上傳**，並鼓勵使用此功能
-- 文件會由系統自動處理，提取後的資料會自動填入相應欄位
-- 如果使用者想要上傳文件，請引導他們使用上傳功能來快速完成資料收集"""
-
-    def get_initial_greeting(self) -> str:
+    async def get_initial_greeting(self) -> str:
         """Get the initial greeting with menu options"""
         # Check if user has existing data
-        existing_data = self.db.query(CompanyOnboarding).filter(
-            CompanyOnboarding.user_id == self.user_id,
-            CompanyOnboarding.is_current == True
-        ).first()
+        result = await self.db.execute(
+            select(CompanyOnboarding).where(
+                CompanyOnboarding.user_id == self.user_id,
+                CompanyOnboarding.is_current == True
+            )
+        )
+        existing_data = result.scalars().first()
 
         if existing_data and existing_data.industry:
             # User has existing data
@@ -229,110 +340,69 @@ class AIChatbotHandler:
 
         return "\n".join(data) if data else "尚未收集任何資料"
 
-    def extract_data_with_ai(self, user_message: str, conversation_history: List[Dict]) -> Dict[str, Any]:
-        """Use OpenAI to extract structured data from conversation"""
-        client = get_openai_client()
-        if not client:
-            return {"error": "OpenAI API key not configured"}
+    def build_messages(self, user_message: str, conversation_history: List[Dict]) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Build the OpenAI message list for the current turn within the token budget
 
-        # Build conversation for OpenAI
-        messages = [
-            {"role": "system", "content": self.get_system_prompt()},
+        Returns (messages, estimated prompt tokens including the tool schemas).
+        """
+        # Static prompt first and per-session data after it, so the prefix (tools +
+        # system prompt) is byte-identical on every call and can be served from cache
+        prefix = [
+            {"role": "system", "content": CHAT_SYSTEM_PROMPT},
             {"role": "system", "content": f"目前已收集的資料：\n{self.get_current_data_summary()}"}
         ]
 
-        # Add recent conversation history (last 10 messages)
-        for msg in conversation_history[-10:]:
-            messages.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
-
-        # Add current user message
-        messages.append({"role": "user", "content": user_message})
-
-        # Define function for structured data extraction
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "update_company_data",
-                    "description": "更新公司資料。從使用者的訊息中提取產業別、資本總額、專利數量、公司認證數量、ESG認證等資訊並更新。",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "industry": {"type": "string", "description": "產業別"},
-                            "capital_amount": {"type": "integer", "description": "資本總額（以臺幣為單位）"},
-                            "invention_patent_count": {"type": "integer", "description": "發明專利數量"},
-                            "utility_patent_count": {"type": "integer", "description": "新型專利數量"},
-                            "certification_count": {"type": "integer", "description": "公司認證資料數量（不包括ESG認證）"},
-                            "esg_certification_count": {"type": "integer", "description": "ESG相關認證資料數量"},
-                            "esg_certification": {"type": "string", "description": "ESG相關認證資料列表（例如：ISO 14064, ISO 14067, ISO 14046）"}
-                        }
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "add_product",
-                    "description": "新增產品資訊",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "product_id": {"type": "string", "description": "產品ID"},
-                            "product_name": {"type": "string", "description": "產品名稱"},
-                            "price": {"type": "string", "description": "價格"},
-                            "main_raw_materials": {"type": "string", "description": "主要原料"},
-                            "product_standard": {"type": "string", "description": "產品規格"},
-                            "technical_advantages": {"type": "string", "description": "技術優勢"}
-                        },
-                        "required": ["product_name"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "mark_completed",
-                    "description": "當使用者表示已完成所有資料輸入時調用此函數",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "completed": {"type": "boolean", "description": "是否完成"}
-                        },
-                        "required": ["completed"]
-                    }
-                }
-            }
+        # Earlier conversation that has left the recent window
+        if self.session is not None and self.session.summary:
+            prefix.append({"role": "system", "content": f"先前對話摘要：\n{self.session.summary}"})
+
+        # Recent conversation history, newest messages first until the budget is used
+        history = [
+            {"role": msg["role"], "content": msg["content"]}
+            for msg in conversation_history[-self.HISTORY_WINDOW:]
         ]
 
+        return build_context(
+            prefix, history, {"role": "user", "content": user_message},
+            budget=settings.llm_context_token_budget, reserved=CHAT_TOOLS_TOKENS
+        )
+
+    async def extract_data_with_ai(self, user_message: str, conversation_history: List[Dict]) -> Dict[str, Any]:
+        """Use OpenAI to extract structured data from conversation"""
+        client = get_async_openai_client()
+        if not client:
+            return {"error": "OpenAI API key not configured"}
+
+        # Build conversation for OpenAI
+        messages, estimated_tokens = self.build_messages(user_message, conversation_history)
+        await self.end_read_transaction()
+
         try:
-            response = client.chat.completions.create(
-                model=settings.openai_model,
-                messages=messages,
-                tools=tools,
-                tool_choice="auto"
-            )
+            async with get_llm_limiter().slot():
+                response = await client.chat.completions.create(
+                    model=settings.openai_model,
+                    messages=messages,
+                    tools=CHAT_TOOLS,
+                    tool_choice="auto"
+                )
+            record_usage(estimated_tokens, getattr(response, "usage", None))
 
             result = {
                 "message": response.choices[0].message.content or "",
                 "function_calls": []
             }
 
-            # Process tool calls
-            if response.choices[0].message.tool_calls:
-                for tool_call in response.choices[0].message.tool_calls:
-                    function_name = tool_call.function.name
-                    function_args = json.loads(tool_call.function.arguments)
-
-                    result["function_calls"].append({
-                        "name": function_name,
-                        "arguments": function_args
-                    })
+            # Process tool calls (invalid ones are dropped)
+            for tool_call in response.choices[0].message.tool_calls or []:
+                call = parse_tool_call(tool_call.function.name, tool_call.function.arguments)
+                if call:
+                    result["function_calls"].append(call)
 
             return result
 
+        except LLMOverloadedError:
+            raise
         except Exception as e:
             print(f"OpenAI API error: {e}")
             return {
@@ -340,7 +410,7 @@ class AIChatbotHandler:
                 "message": "抱歉，我遇到了一些技術問題。請稍後再試。"
             }
 
-    def update_onboarding_data(self, data: Dict[str, Any]) -> bool:
+    async def update_onboarding_data(self, data: Dict[str, Any]) -> bool:
         """Update onboarding data with extracted information"""
         try:
             updated = False
@@ -376,25 +446,25 @@ class AIChatbotHandler:
                 updated = True
 
             if updated:
-                self.db.commit()
+                await self._save()
 
             return updated
 
         except Exception as e:
             print(f"Error updating onboarding data: {e}")
-            self.db.rollback()
+            await self._discard_changes(self.onboarding_data)
             return False
 
-    def add_product(self, product_data: Dict[str, Any]) -> Optional[Product]:
+    async def add_product(self, product_data: Dict[str, Any]) -> Optional[Product]:
         """Add a product to the onboarding data with duplicate checking"""
         try:
-            # Check for duplicate product_id in current onboarding
+            # Check for duplicate product_id in current onboarding (products are always loaded with it)
             product_id = product_data.get("product_id")
             if product_id:
-                existing_product = self.db.query(Product).filter(
-                    Product.onboarding_id == self.onboarding_data.id,
-                    Product.product_id == product_id
-                ).first()
+                existing_product = next(
+                    (product for product in self.onboarding_data.products if product.product_id == product_id),
+                    None
+                )
 
                 if existing_product:
                     # Update existing product instead of creating duplicate
@@ -403,13 +473,11 @@ class AIChatbotHandler:
                     existing_product.main_raw_materials = product_data.get("main_raw_materials") or existing_product.main_raw_materials
                     existing_product.product_standard = product_data.get("product_standard") or existing_product.product_standard
                     existing_product.technical_advantages = product_data.get("technical_advantages") or existing_product.technical_advantages
-                    self.db.commit()
-                    self.db.refresh(existing_product)
+                    await self._save(existing_product)
                     return existing_product
 
-            # Create new product
+            # Create new product (appended so the loaded products collection stays current)
             product = Product(
-                onboarding_id=self.onboarding_data.id,
                 product_id=product_id,
                 product_name=product_data.get("product_name"),
                 price=product_data.get("price"),
@@ -417,80 +485,116 @@ class AIChatbotHandler:
                 product_standard=product_data.get("product_standard"),
                 technical_advantages=product_data.get("technical_advantages")
             )
-            self.db.add(product)
-            self.db.commit()
-            self.db.refresh(product)
+            self.onboarding_data.products.append(product)
+            await self._save(product)
             return product
         except Exception as e:
             print(f"Error adding product: {e}")
-            self.db.rollback()
+            await self._discard_changes(self.onboarding_data)
             return None
 
-    def process_message(self, user_message: str) -> tuple[str, bool]:
-        """
-        Process user message with AI and return bot response
-        Returns: (response_message, is_completed)
-        """
-        # Get conversation history
-        history = self.get_conversation_history()
-        conversation_history = [
-            {"role": msg.role, "content": msg.content}
-            for msg in history
-        ]
-
-        # Check if this is the first message (no history yet)
-        if len(conversation_history) == 0:
-            # Check for menu selection
-            user_msg_lower = user_message.lower().strip()
+    async def get_menu_response(self, user_message: str) -> str:
+        """Get the response for the first message of a session (menu selection)"""
+        user_msg_lower = user_message.lower().strip()
 
-            # Option 1: Fill in data
-            if any(word in user_msg_lower for word in ["1", "填寫", "填写", "開始", "开始"]):
-                return "太好了！讓我們開始收集您的公司資料。\n\n請問您的公司所屬產業別是什麼？（例如：食品業、鋼鐵業、電子業等）", False
+        # Option 1: Fill in data
+        if any(word in user_msg_lower for word in ["1", "填寫", "填写", "開始", "开始"]):
+            return "太好了！讓我們開始收集您的公司資料。\n\n請問您的公司所屬產業別是什麼？（例如：食品業、鋼鐵業、電子業等）"
 
-            # Option 2: View progress
-            elif any(word in user_msg_lower for word in ["2", "進度", "进度", "查看進度"]):
-                progress = self.get_progress()
-                return f"""📊 資料填寫進度：
+        # Option 2: View progress
+        elif any(word in user_msg_lower for word in ["2", "進度", "进度", "查看進度"]):
+            progress = self.get_progress()
+            return f"""📊 資料填寫進度：
 
 已完成欄位：{progress['fields_completed']}/{progress['total_fields']}
 產品數量：{progress['products_count']} 個
 
 {self.get_current_data_summary()}
 
-您想繼續填寫資料嗎？（是/否）""", False
+您想繼續填寫資料嗎？（是/否）"""
 
-            # Option 3: View filled data
-            elif any(word in user_msg_lower for word in ["3", "已填", "查看資料", "查看数据"]):
-                data_summary = self.get_current_data_summary()
-                return f"""📝 目前已填寫的資料：
+        # Option 3: View filled data
+        elif any(word in user_msg_lower for word in ["3", "已填", "查看資料", "查看数据"]):
+            data_summary = self.get_current_data_summary()
+            return f"""📝 目前已填寫的資料：
 
 {data_summary}
 
-您想繼續填寫資料嗎？（是/否）""", False
+您想繼續填寫資料嗎？（是/否）"""
+
+        # Default: Show menu
+        else:
+            return await self.get_initial_greeting()
+
+    async def apply_function_calls(self, function_calls: List[Dict[str, Any]]) -> bool:
+        """
+        Apply tool calls returned by the AI to the onboarding data
+        Returns: True if the session was marked as completed
+        """
+        completed = False
+        for call in function_calls:
+            result = await dispatch_tool_call(self, call)
+            if call["name"] == "mark_completed" and result:
+                completed = True
+
+        return completed
+
+    async def mark_completed(self, data: Dict[str, Any]) -> bool:
+        """Mark the session completed (mark_completed tool); returns whether it was"""
+        if not data.get("completed"):
+            return False
+        self.session.status = ChatSessionStatus.COMPLETED
+        self.session.completed_at = datetime.utcnow()
+        await self._save()
+        return True
+
+    async def route_message(self, user_message: str, history: List[ChatMessage]) -> Optional[tuple[str, bool]]:
+        """
+        Answer the turn with the rule router instead of the LLM, if it is confident
+
+        Returns (response_message, is_completed), or None to call the LLM.
+        """
+        if not settings.rule_router_enabled or self.onboarding_data is None:
+            return None
+
+        last_question = next((msg.content for msg in reversed(history) if msg.role == "assistant"), "")
+        route = route_turn(user_message, self.onboarding_data, last_question)
+        if route is None or not await dispatch_tool_call(self, route["call"]):
+            record_route(None)
+            return None
+
+        record_route(route["rule"])
+        return route_reply(route, self.onboarding_data), route["rule"] == "completed"
+
+    async def process_message(self, user_message: str) -> tuple[str, bool]:
+        """
+        Process user message with AI and return bot response
+        Returns: (response_message, is_completed)
+        """
+        # Get recent conversation history (an empty window also means this is the first message)
+        history = await self.get_recent_messages()
+        conversation_history = [
+            {"role": msg.role, "content": msg.content}
+            for msg in history
+        ]
+
+        # Check if this is the first message (no history yet)
+        if len(conversation_history) == 0:
+            return await self.get_menu_response(user_message), False
 
-            # Default: Show menu
-            else:
-                return self.get_initial_greeting(), False
+        # Trivially parseable answers skip the LLM
+        routed = await self.route_message(user_message, history)
+        if routed:
+            return routed
 
         # Extract data with AI
-        ai_result = self.extract_data_with_ai(user_message, conversation_history)
+        ai_result = await self.extract_data_with_ai(user_message, conversation_history)
 
         if "error" in ai_result:
             return ai_result.get("message", "抱歉，發生錯誤。"), False
 
         # Process function calls
-        completed = False
-        if "function_calls" in ai_result:
-            for call in ai_result["function_calls"]:
-                if call["name"] == "update_company_data":
-                    self.update_onboarding_data(call["arguments"])
-                elif call["name"] == "add_product":
-                    self.add_product(call["arguments"])
-                elif call["name"] == "mark_completed":
-                    if call["arguments"].get("completed"):
-                        self.session.status = ChatSessionStatus.COMPLETED
-                        self.db.commit()
-                        completed = True
+        completed = await self.apply_function_calls(ai_result.get("function_calls", []))
 
         # Return AI response
         response_message = ai_result.get("message", "")
@@ -499,6 +603,105 @@ class AIChatbotHandler:
 
         return response_message, completed
 
+    async def stream_message(self, user_message: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process user message with AI, streaming the reply as it is generated
+
+        Yields {"type": "token", "content": ...} events while the model writes, then a
+        single {"type": "done", "message": ..., "completed": ...} event once the tool
+        calls collected from the stream have been applied.
+        """
+        # Get recent conversation history (an empty window also means this is the first message)
+        history = await self.get_recent_messages()
+        conversation_history = [
+            {"role": msg.role, "content": msg.content}
+            for msg in history
+        ]
+
+        # First message of a session is answered from the menu without the AI
+        if len(conversation_history) == 0:
+            response_message = await self.get_menu_response(user_message)
+            yield {"type": "token", "content": response_message}
+            yield {"type": "done", "message": response_message, "completed": False}
+            return
+
+        # Trivially parseable answers skip the LLM
+        routed = await self.route_message(user_message, history)
+        if routed:
+            response_message, completed = routed
+            yield {"type": "token", "content": response_message}
+            yield {"type": "done", "message": response_message, "completed": completed}
+            return
+
+        client = get_async_openai_client()
+        if not client:
+            response_message = "抱歉，發生錯誤。"
+            yield {"type": "error", "message": response_message}
+            yield {"type": "done", "message": response_message, "completed": False}
+            return
+
+        messages, estimated_tokens = self.build_messages(user_message, conversation_history)
+        content_parts = []
+        tool_calls = {}  # index -> {"name": ..., "arguments": ...} assembled from deltas
+        usage = None  # Sent in a final chunk without choices
+        await self.end_read_transaction()
+
+        try:
+            # The LLM slot is held until the stream has been fully consumed
+            async with get_llm_limiter().slot():
+                stream = await client.chat.completions.create(
+                    model=settings.openai_model,
+                    messages=messages,
+                    tools=CHAT_TOOLS,
+                    tool_choice="auto",
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+
+                async for chunk in stream:
+                    usage = getattr(chunk, "usage", None) or usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+
+                    if delta.content:
+                        content_parts.append(delta.content)
+                        yield {"type": "token", "content": delta.content}
+
+                    for tool_call in delta.tool_calls or []:
+                        call = tool_calls.setdefault(tool_call.index, {"name": "", "arguments": ""})
+                        if tool_call.function and tool_call.function.name:
+                            call["name"] += tool_call.function.name
+                        if tool_call.function and tool_call.function.arguments:
+                            call["arguments"] += tool_call.function.arguments
+
+        except LLMOverloadedError:
+            raise
+        except Exception as e:
+            print(f"OpenAI API error: {e}")
+            response_message = "抱歉，我遇到了一些技術問題。請稍後再試。"
+            yield {"type": "error", "message": response_message}
+            yield {"type": "done", "message": response_message, "completed": False}
+            return
+
+        record_usage(estimated_tokens, usage)
+
+        # Apply tool calls once the stream is complete
+        function_calls = []
+        for index in sorted(tool_calls):
+            call = parse_tool_call(tool_calls[index]["name"], tool_calls[index]["arguments"])
+            if call:
+                function_calls.append(call)
+
+        completed = await self.apply_function_calls(function_calls)
+
+        response_message = "".join(content_parts)
+        if not response_message:
+            response_message = "我已經記錄您的資訊。請繼續提供其他資料。"
+            yield {"type": "token", "content": response_message}
+
+        yield {"type": "done", "message": response_message, "completed": completed}
+
     def get_progress(self) -> Dict[str, Any]:
         """Get current progress of data collection"""
         fields_completed = 0
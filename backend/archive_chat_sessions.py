@@ -0,0 +1,98 @@
+"""
+Move the messages of finished chat sessions into the compressed archive
+
+Usage:
+    python archive_chat_sessions.py                # archive sessions idle for ARCHIVE_AFTER_DAYS
+    python archive_chat_sessions.py --days 90      # custom threshold
+    python archive_chat_sessions.py --dry-run      # list the next batch without archiving
+    python archive_chat_sessions.py --restore-all  # move every archived transcript back
+
+Completed and abandoned sessions with no message newer than the threshold are
+archived one per transaction, so the job can be stopped and rerun at any time.
+Archived sessions stay readable through /api/chatbot/sessions/{id}/messages, and a
+new turn on one restores it to chat_messages. Run it nightly, e.g. from cron.
+"""
+
+import argparse
+import asyncio
+from sqlalchemy import select
+from database import AsyncSessionLocal
+from models import ChatSession
+from chat_archive import find_sessions_to_archive, archive_session, restore_archived_session
+from config import get_settings
+
+settings = get_settings()
+
+
+async def archive(days: int, batch_size: int, dry_run: bool):
+    """Archive eligible sessions in batches until none are left"""
+    archived = 0
+    messages = 0
+    raw_bytes = 0
+    stored_bytes = 0
+
+    async with AsyncSessionLocal() as db:
+        while True:
+            session_ids = await find_sessions_to_archive(db, days, batch_size)
+            if dry_run:
+                print(f"{len(session_ids)} sessions in the next batch: {session_ids}")
+                return
+            if not session_ids:
+                break
+
+            for session_id in session_ids:
+                try:
+                    archive_row = await archive_session(db, session_id)
+                except Exception:
+                    await db.rollback()
+                    print(f"✗ Failed to archive session {session_id}")
+                    raise
+                if archive_row is None:
+                    continue
+                archived += 1
+                messages += archive_row.message_count
+                raw_bytes += archive_row.raw_size
+                stored_bytes += len(archive_row.transcript)
+
+            print(f"  ... {archived} sessions archived")
+            # Drop archived rows from the identity map between batches
+            db.expunge_all()
+
+    ratio = raw_bytes / stored_bytes if stored_bytes else 0
+    print(f"✓ Archived {archived} sessions ({messages} messages, "
+          f"{raw_bytes} bytes -> {stored_bytes} bytes, {ratio:.1f}x)")
+
+
+async def restore_all():
+    """Move every archived transcript back into chat_messages"""
+    restored = 0
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(ChatSession).where(ChatSession.archived_at.is_not(None)).order_by(ChatSession.id)
+        )
+        for session in result.scalars().all():
+            await restore_archived_session(db, session)
+            await db.commit()
+            restored += 1
+
+    print(f"✓ Restored {restored} sessions")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=settings.archive_after_days,
+                        help="archive sessions idle for at least this many days")
+    parser.add_argument("--batch-size", type=int, default=settings.archive_batch_size,
+                        help="sessions looked up per batch")
+    parser.add_argument("--dry-run", action="store_true", help="list the next batch without archiving")
+    parser.add_argument("--restore-all", action="store_true", help="move every archived transcript back")
+    args = parser.parse_args()
+
+    if args.restore_all:
+        asyncio.run(restore_all())
+    else:
+        asyncio.run(archive(args.days, args.batch_size, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
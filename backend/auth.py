@@ -1,12 +1,19 @@
+import hashlib
+import time
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Dict, Any, Tuple
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy import event, case, literal_column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, make_transient_to_detached
+from database import get_db, SessionLocal
 from models import User, UserRole
 from config import get_settings
+from cache import TTLCache
 
 # Security configuration
 settings = get_settings()
@@ -16,6 +23,18 @@ ALGORITHM = "HS256"
 # HTTP Bearer token scheme
 security = HTTPBearer()
 
+# Verified token payloads keyed by token digest, kept until the token's exp
+# (tokens without exp are kept for JWT_CACHE_TTL_SECONDS). Only successfully
+# verified tokens are ever stored.
+_jwt_cache = TTLCache(maxsize=settings.jwt_cache_max_entries, ttl=settings.jwt_cache_ttl_seconds)
+
+# Column snapshots of synced users keyed by external_user_id, so authenticated
+# requests skip the users lookup. Entries are dropped when the row is updated
+# through the ORM in this process, by the admin invalidation endpoint, or after
+# USER_CACHE_TTL_SECONDS (which bounds staleness for changes made elsewhere).
+_user_cache = TTLCache(maxsize=settings.user_cache_max_entries, ttl=settings.user_cache_ttl_seconds)
+USER_SNAPSHOT_FIELDS = ("id", "external_user_id", "username", "role", "is_active", "created_at", "updated_at")
+
 
 def decode_external_jwt(token: str) -> dict:
     """
@@ -25,10 +44,17 @@ def decode_external_jwt(token: str) -> dict:
     - user_id: The external user's ID from main system
     - username: The user's username
     - exp: Expiration timestamp (optional)
+
+    Verified payloads are cached by token digest, so repeated requests with
+    the same token skip the signature check until it expires.
     """
+    token_digest = hashlib.sha256(token.encode("utf-8")).digest()
+    payload = _jwt_cache.get(token_digest)
+    if payload is not None:
+        return dict(payload)
+
     try:
         payload = jwt.decode(token, EXTERNAL_JWT_SECRET, algorithms=[ALGORITHM])
-        return payload
     except JWTError as e:
         print(f"❌ JWT Validation Error: {e}")
         raise HTTPException(
@@ -37,6 +63,45 @@ def decode_external_jwt(token: str) -> dict:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    exp = payload.get("exp")
+    ttl = exp - time.time() if isinstance(exp, (int, float)) else None
+    if ttl is None or ttl > 0:
+        _jwt_cache.set(token_digest, dict(payload), ttl=ttl)
+
+    return payload
+
+
+def get_jwt_cache_stats() -> Dict[str, Any]:
+    """Get verified-token cache statistics"""
+    return _jwt_cache.get_stats()
+
+
+def _user_from_snapshot(db: Session, snapshot: Dict[str, Any]) -> User:
+    """Rebuild a cached user and attach it to the session without a SELECT"""
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    return db.merge(user, load=False)
+
+
+def invalidate_user_cache(external_user_id: Optional[str] = None) -> int:
+    """Drop one cached user (or all when external_user_id is None); returns how many were dropped"""
+    if external_user_id is None:
+        count = len(_user_cache)
+        _user_cache.clear()
+        return count
+    return 1 if _user_cache.pop(str(external_user_id)) is not None else 0
+
+
+@event.listens_for(User, "after_update")
+def _invalidate_updated_user(mapper, connection, target):
+    """Role, status and username changes made through the ORM take effect on the next request"""
+    _user_cache.pop(target.external_user_id)
+
+
+def get_user_cache_stats() -> Dict[str, Any]:
+    """Get user snapshot cache statistics"""
+    return _user_cache.get_stats()
+
 
 def sync_user_from_jwt(db: Session, external_user_id: str, username: str) -> User:
     """
@@ -45,6 +110,10 @@ def sync_user_from_jwt(db: Session, external_user_id: str, username: str) -> Use
     If user doesn't exist, create it.
     If user exists, update username if changed.
 
+    Both cases are a single INSERT ... ON CONFLICT (external_user_id) DO UPDATE
+    ... RETURNING, so concurrent first requests from one user can't collide on
+    the unique constraint and no follow-up SELECT/refresh is needed.
+
     Args:
         db: Database session
         external_user_id: User ID from main system
@@ -53,50 +122,63 @@ def sync_user_from_jwt(db: Session, external_user_id: str, username: str) -> Use
     Returns:
         User object from local database
     """
-    # Check if user already exists
-    user = db.query(User).filter(User.external_user_id == external_user_id).first()
-
-    if user:
-        # Update username if changed
-        if user.username != username:
-            user.username = username
-            user.updated_at = datetime.utcnow()
-            db.commit()
-            db.refresh(user)
-            print(f"✅ Updated user: {username} (external_id: {external_user_id})")
-    else:
-        # Create new user
-        user = User(
-            external_user_id=external_user_id,
-            username=username,
-            role=UserRole.USER,  # Default role
-            is_active=True
-        )
-        db.add(user)
-        db.commit()
-        db.refresh(user)
+    # Cached snapshot: no DB round trip unless the username changed
+    snapshot = _user_cache.get(external_user_id)
+    if snapshot is not None and snapshot["username"] == username:
+        return _user_from_snapshot(db, snapshot)
+
+    now = datetime.utcnow()
+    stmt = pg_insert(User).values(
+        external_user_id=external_user_id,
+        username=username,
+        role=UserRole.USER,  # Default role
+        is_active=True,
+        created_at=now,
+        updated_at=now
+    )
+    # Always DO UPDATE (never DO NOTHING) so RETURNING yields the existing row too;
+    # updated_at only moves when the username actually changed
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.external_user_id],
+        set_={
+            "username": stmt.excluded.username,
+            "updated_at": case(
+                (User.username != stmt.excluded.username, stmt.excluded.updated_at),
+                else_=User.updated_at
+            )
+        }
+    ).returning(
+        User,
+        # xmax is 0 only for a freshly inserted row version
+        literal_column("xmax = 0").label("inserted")
+    ).execution_options(populate_existing=True)
+
+    user, inserted = db.execute(stmt).one()
+    snapshot = {field: getattr(user, field) for field in USER_SNAPSHOT_FIELDS}
+    db.commit()
+
+    if inserted:
         print(f"✅ Created new user: {username} (external_id: {external_user_id})")
 
-    return user
+    _user_cache.set(external_user_id, snapshot)
+    # Commit expired the returned row; repopulate it from the snapshot instead of a refresh
+    return _user_from_snapshot(db, snapshot)
 
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    """
-    Get the current authenticated user from external JWT token
+@dataclass(frozen=True)
+class Principal:
+    """Identity of the caller for routes that only need the local user id and access flags"""
+
+    __slots__ = ("id", "external_user_id", "role", "is_active")
+
+    id: int
+    external_user_id: str
+    role: UserRole
+    is_active: bool
 
-    This function:
-    1. Validates the JWT token from the main system
-    2. Extracts user_id and username
-    3. Auto-creates/updates user in local database
-    4. Returns the local user object
-    """
-    token = credentials.credentials
-    payload = decode_external_jwt(token)
 
-    # Extract user info from JWT payload
+def _identity_from_claims(payload: dict) -> Tuple[str, str]:
+    """Extract (external_user_id, username) from a verified JWT payload"""
     external_user_id = payload.get("user_id")
     username = payload.get("username")
 
@@ -108,14 +190,50 @@ def get_current_user(
         )
 
     # Convert user_id to string for consistency
-    external_user_id_str = str(external_user_id)
+    return str(external_user_id), username
+
+
+def authenticate_token(db: Session, token: str) -> User:
+    """
+    Authenticate an external JWT token and return the local user
+
+    This function:
+    1. Validates the JWT token from the main system
+    2. Extracts user_id and username
+    3. Auto-creates/updates user in local database
+    4. Returns the local user object
+    """
+    payload = decode_external_jwt(token)
+    external_user_id, username = _identity_from_claims(payload)
 
     # Sync user from JWT to local database
-    user = sync_user_from_jwt(db, external_user_id_str, username)
+    user = sync_user_from_jwt(db, external_user_id, username)
 
     return user
 
 
+def _provision_user_snapshot(external_user_id: str, username: str) -> Dict[str, Any]:
+    """Sync the user on a cache miss (runs in the threadpool) and return its snapshot"""
+    db = SessionLocal()
+    try:
+        user = sync_user_from_jwt(db, external_user_id, username)
+        return {field: getattr(user, field) for field in USER_SNAPSHOT_FIELDS}
+    finally:
+        db.close()
+
+
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
+) -> User:
+    """
+    Get the current authenticated user from external JWT token
+
+    Token is read from the Authorization header (Bearer scheme).
+    """
+    return authenticate_token(db, credentials.credentials)
+
+
 def get_current_active_user(
     current_user: User = Depends(get_current_user)
 ) -> User:
@@ -128,6 +246,43 @@ def get_current_active_user(
     return current_user
 
 
+async def get_current_principal(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> Principal:
+    """
+    Get the caller's identity without loading an ORM User
+
+    Resolved from the verified-JWT and user snapshot caches, so a warm request
+    does no database work; the DB is only touched to provision or re-sync the
+    user on a cache miss or username change.
+    """
+    payload = decode_external_jwt(credentials.credentials)
+    external_user_id, username = _identity_from_claims(payload)
+
+    snapshot = _user_cache.get(external_user_id)
+    if snapshot is None or snapshot["username"] != username:
+        snapshot = await run_in_threadpool(_provision_user_snapshot, external_user_id, username)
+
+    return Principal(
+        id=snapshot["id"],
+        external_user_id=snapshot["external_user_id"],
+        role=snapshot["role"],
+        is_active=snapshot["is_active"]
+    )
+
+
+async def get_current_active_principal(
+    principal: Principal = Depends(get_current_principal)
+) -> Principal:
+    """Get the current active caller's identity"""
+    if not principal.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="User account is inactive"
+        )
+    return principal
+
+
 def require_admin(
     current_user: User = Depends(get_current_user)
 ) -> User:
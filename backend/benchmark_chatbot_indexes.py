@@ -0,0 +1,125 @@
+"""
+Benchmark the chatbot's hot queries and show which plan PostgreSQL picks
+
+Usage:
+    python benchmark_chatbot_indexes.py             # plans with the indexes as they are now
+    python benchmark_chatbot_indexes.py --compare   # also plans with the new indexes hidden
+
+Run it before and after migrate_add_chatbot_indexes.py, or use --compare after
+the migration: it drops the new indexes inside a transaction that is rolled
+back, so they are never really removed. DROP INDEX holds an exclusive lock on
+each table until the rollback, so only use --compare against a staging copy.
+"""
+
+import argparse
+import json
+import statistics
+from sqlalchemy import create_engine, text
+from config import get_settings
+from migrate_add_chatbot_indexes import INDEXES
+
+settings = get_settings()
+
+# Parameters for the queries are taken from the busiest user/session/onboarding record
+PARAMETER_QUERIES = {
+    "session_id": "SELECT session_id FROM chat_messages GROUP BY session_id ORDER BY COUNT(*) DESC LIMIT 1",
+    "user_id": "SELECT user_id FROM chat_sessions GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1",
+    "onboarding_id": "SELECT onboarding_id FROM products GROUP BY onboarding_id ORDER BY COUNT(*) DESC LIMIT 1",
+    "product_id": "SELECT product_id FROM products WHERE product_id IS NOT NULL ORDER BY id DESC LIMIT 1",
+}
+
+# The hot queries as the API issues them
+QUERIES = {
+    "conversation history": """
+        SELECT * FROM chat_messages
+        WHERE session_id = :session_id
+        ORDER BY created_at
+    """,
+    "recent message window": """
+        SELECT * FROM chat_messages
+        WHERE session_id = :session_id
+        ORDER BY created_at DESC, id DESC
+        LIMIT 10
+    """,
+    "current onboarding record": """
+        SELECT * FROM company_onboarding
+        WHERE user_id = :user_id AND is_current = TRUE
+    """,
+    "session list": """
+        SELECT * FROM chat_sessions
+        WHERE user_id = :user_id
+        ORDER BY created_at DESC, id DESC
+    """,
+    "latest active session": """
+        SELECT * FROM chat_sessions
+        WHERE user_id = :user_id AND status = 'ACTIVE'
+        ORDER BY created_at DESC
+        LIMIT 1
+    """,
+    "product lookup": """
+        SELECT * FROM products
+        WHERE onboarding_id = :onboarding_id AND product_id = :product_id
+    """,
+}
+
+
+def summarize_plan(node: dict) -> str:
+    """Render the plan tree as one line, e.g. Limit > Index Scan (ix_...)"""
+    label = node["Node Type"]
+    if "Index Name" in node:
+        label += f" ({node['Index Name']})"
+    children = node.get("Plans", [])
+    if children:
+        label += " > " + ", ".join(summarize_plan(child) for child in children)
+    return label
+
+
+def run_queries(conn, params: dict, runs: int):
+    """EXPLAIN ANALYZE each query `runs` times and print its plan and median execution time"""
+    for name, sql in QUERIES.items():
+        timings = []
+        plan = None
+        for _ in range(runs):
+            result = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}"), params)
+            explain = result.scalar()
+            if isinstance(explain, str):
+                explain = json.loads(explain)
+            plan = explain[0]
+            timings.append(plan["Execution Time"])
+
+        print(f"  {name:28s} {statistics.median(timings):8.3f} ms  "
+              f"{summarize_plan(plan['Plan'])}  (shared hit/read: "
+              f"{plan['Plan'].get('Shared Hit Blocks', 0)}/{plan['Plan'].get('Shared Read Blocks', 0)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="EXPLAIN ANALYZE runs per query (median is reported)")
+    parser.add_argument("--compare", action="store_true", help="also plan with the new indexes hidden (staging only)")
+    args = parser.parse_args()
+
+    engine = create_engine(settings.database_url)
+
+    with engine.connect() as conn:
+        params = {}
+        for key, sql in PARAMETER_QUERIES.items():
+            params[key] = conn.execute(text(sql)).scalar()
+        print(f"Parameters: {params}\n")
+
+        print("With current indexes:")
+        run_queries(conn, params, args.runs)
+        conn.rollback()
+
+        if args.compare:
+            print("\nWithout the new composite/partial indexes:")
+            trans = conn.begin()
+            try:
+                for name, _, _ in INDEXES:
+                    conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+                run_queries(conn, params, args.runs)
+            finally:
+                trans.rollback()
+
+
+if __name__ == "__main__":
+    main()
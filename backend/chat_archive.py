@@ -0,0 +1,138 @@
+"""
+Chat Message Archive
+Messages of finished sessions are moved out of chat_messages into one
+compressed row per session in chat_message_archives, so the hot table and
+its indexes only hold conversations that can still receive turns
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from sqlalchemy import select, delete, exists, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import ChatSession, ChatMessage, ChatMessageArchive, ChatSessionStatus
+from compression import encode_json, compress_json, decompress_json
+
+
+def _message_record(message: ChatMessage) -> Dict[str, Any]:
+    return {
+        "id": message.id,
+        "role": message.role,
+        "content": message.content,
+        "created_at": message.created_at.isoformat()
+    }
+
+
+def _message_from_record(session_id: int, record: Dict[str, Any]) -> ChatMessage:
+    return ChatMessage(
+        id=record["id"],
+        session_id=session_id,
+        role=record["role"],
+        content=record["content"],
+        created_at=datetime.fromisoformat(record["created_at"])
+    )
+
+
+async def find_sessions_to_archive(db: AsyncSession, older_than_days: int, limit: int) -> List[int]:
+    """
+    Ids of completed/abandoned sessions with no activity for `older_than_days`
+
+    A session qualifies when it finished (completed_at, or updated_at for sessions
+    completed before completed_at was recorded) before the cutoff and has no
+    message newer than the cutoff.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    recent_message = exists().where(
+        ChatMessage.session_id == ChatSession.id,
+        ChatMessage.created_at >= cutoff
+    )
+    result = await db.execute(
+        select(ChatSession.id).where(
+            ChatSession.status.in_([ChatSessionStatus.COMPLETED, ChatSessionStatus.ABANDONED]),
+            ChatSession.archived_at.is_(None),
+            func.coalesce(ChatSession.completed_at, ChatSession.updated_at) < cutoff,
+            ~recent_message
+        ).order_by(ChatSession.id).limit(limit)
+    )
+    return list(result.scalars().all())
+
+
+async def archive_session(db: AsyncSession, session_id: int) -> Optional[ChatMessageArchive]:
+    """
+    Move one session's messages into a compressed archive row (one transaction)
+
+    Only the messages that were read are deleted, so a message written while the
+    session is being archived stays in chat_messages; reads merge both.
+    """
+    session = await db.get(ChatSession, session_id)
+    if not session or session.archived_at is not None:
+        return None
+
+    result = await db.execute(
+        select(ChatMessage).where(
+            ChatMessage.session_id == session_id
+        ).order_by(ChatMessage.created_at, ChatMessage.id)
+    )
+    messages = list(result.scalars().all())
+
+    records = [_message_record(message) for message in messages]
+    transcript = compress_json(records)
+    archive = ChatMessageArchive(
+        session_id=session_id,
+        archived_at=datetime.utcnow(),
+        message_count=len(records),
+        first_message_at=messages[0].created_at if messages else None,
+        last_message_at=messages[-1].created_at if messages else None,
+        raw_size=len(encode_json(records)),
+        transcript=transcript
+    )
+    db.add(archive)
+
+    if messages:
+        await db.execute(
+            delete(ChatMessage).where(ChatMessage.id.in_([message.id for message in messages])),
+            execution_options={"synchronize_session": False}
+        )
+    session.archived_at = archive.archived_at
+    await db.commit()
+    return archive
+
+
+async def load_session_messages(db: AsyncSession, session: ChatSession) -> List[ChatMessage]:
+    """
+    All messages of an archived session, oldest first
+
+    Returns transient ChatMessage objects built from the transcript, plus any
+    message still in chat_messages.
+    """
+    result = await db.execute(
+        select(ChatMessageArchive.transcript).where(ChatMessageArchive.session_id == session.id)
+    )
+    transcript = result.scalar_one_or_none()
+    messages = [_message_from_record(session.id, record) for record in decompress_json(transcript)] if transcript else []
+
+    result = await db.execute(
+        select(ChatMessage).where(ChatMessage.session_id == session.id)
+    )
+    messages.extend(result.scalars().all())
+    messages.sort(key=lambda message: (message.created_at, message.id))
+    return messages
+
+
+async def restore_archived_session(db: AsyncSession, session: ChatSession):
+    """
+    Move an archived session's transcript back into chat_messages
+
+    Called when a new turn arrives for an archived session, so the chatbot
+    handlers only ever work with the hot table. Only flushes; the caller commits.
+    """
+    result = await db.execute(
+        select(ChatMessageArchive).where(ChatMessageArchive.session_id == session.id)
+    )
+    archive = result.scalar_one_or_none()
+    if archive is not None:
+        for record in decompress_json(archive.transcript):
+            db.add(_message_from_record(session.id, record))
+        await db.delete(archive)
+
+    session.archived_at = None
+    await db.flush()
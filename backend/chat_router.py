@@ -0,0 +1,164 @@
+"""
+Rule-First Chat Router
+Turns that are trivially parseable (a bare number answering the capital
+question, 無 for ESG, 完成 after the product question) are answered by
+deterministic extractors in milliseconds; everything else goes to the LLM
+"""
+
+import re
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from models import CompanyOnboarding
+
+_NONE_ANSWER = re.compile(r"^\s*(?:無|没|沒|沒有|没有|零|0|none|no)\s*[。.!！]?\s*$", re.IGNORECASE)
+_COUNT_ANSWER = re.compile(r"^\s*(\d{1,6})\s*(?:件|份|個|个|項|项)?\s*[。.]?\s*$")
+_CAPITAL_ANSWER = re.compile(
+    r"^\s*(?:NT\$|新臺幣|新台幣|臺幣|台幣)?\s*(\d[\d,]*(?:\.\d+)?)\s*(萬|万|億|亿)?\s*(?:元|臺幣|台幣)?\s*[。.]?\s*$",
+    re.IGNORECASE
+)
+# A bare industry noun such as 食品業 or 資訊服務業; anything phrased as a sentence goes to the LLM
+_INDUSTRY_ANSWER = re.compile(r"^\s*([\u4e00-\u9fff]{1,6}業)\s*[。.]?\s*$")
+_INDUSTRY_NON_NOUN = re.compile(r"[是不沒没無无非未哪還还確确做在的我們们嗎吗呢或]")
+# Only the ESG standards the system prompt names; ISO 9001, ISO 22000 etc. are company certifications
+_ESG_STANDARD = re.compile(
+    r"ISO\s?(?:14064|14067|14046)(?:-\d)?(?!\d)|GRI(?:\s?Standards)?|ISSB|IFRS\s?S[12]",
+    re.IGNORECASE
+)
+_LIST_SEPARATORS = re.compile(r"[\s,，、;；和及與]+")
+_DONE_ANSWER = re.compile(r"^\s*(?:完成|結束|结束|沒有了|没有了|不用了?|不需要了?)\s*[。.!！]?\s*$")
+
+_CAPITAL_UNITS = {"萬": 10_000, "万": 10_000, "億": 100_000_000, "亿": 100_000_000}
+
+# Per worker process: turns answered by each rule, and turns passed to the LLM
+_routed: Counter = Counter()
+_stats = {"llm": 0}
+
+
+def _parse_count(message: str) -> Optional[int]:
+    if _NONE_ANSWER.match(message):
+        return 0
+    match = _COUNT_ANSWER.match(message)
+    return int(match.group(1)) if match else None
+
+
+def _parse_capital(message: str) -> Optional[int]:
+    match = _CAPITAL_ANSWER.match(message)
+    if not match:
+        return None
+    amount = float(match.group(1).replace(",", "")) * _CAPITAL_UNITS.get(match.group(2), 1)
+    return int(amount) if amount > 0 else None
+
+
+def _parse_industry(message: str) -> Optional[str]:
+    match = _INDUSTRY_ANSWER.match(message)
+    if not match or _INDUSTRY_NON_NOUN.search(match.group(1)):
+        return None
+    return match.group(1)
+
+
+def _parse_esg(message: str) -> Optional[Dict[str, Any]]:
+    if _NONE_ANSWER.match(message):
+        return {"esg_certification_count": 0, "esg_certification": "無"}
+    standards = [re.sub(r"\s+", " ", standard).upper() for standard in _ESG_STANDARD.findall(message)]
+    # Confident only if the message is nothing but a list of known ESG standards
+    if not standards or _LIST_SEPARATORS.sub("", _ESG_STANDARD.sub("", message)):
+        return None
+    return {"esg_certification_count": len(standards), "esg_certification": ", ".join(standards)}
+
+
+# Company fields in the order the system prompt asks for them:
+# (field, label, keyword the last question must contain, parser, unit shown in the reply)
+_FIELDS: List[Tuple[str, str, str, Callable[[str], Any], str]] = [
+    ("industry", "產業別", "產業", _parse_industry, ""),
+    ("capital_amount", "資本總額", "資本", _parse_capital, " 臺幣"),
+    ("invention_patent_count", "發明專利數量", "發明專利", _parse_count, " 件"),
+    ("utility_patent_count", "新型專利數量", "新型專利", _parse_count, " 件"),
+    ("certification_count", "公司認證資料數量", "認證", _parse_count, " 份"),
+    ("esg_certification", "ESG認證", "ESG", _parse_esg, ""),  # Parses to both ESG arguments
+]
+
+_QUESTIONS = {
+    "industry": "請問貴公司所屬的產業別是什麼？（例如：食品業、鋼鐵業、電子業等）",
+    "capital_amount": "請問貴公司的資本總額是多少？（以臺幣為單位）",
+    "invention_patent_count": "請問貴公司擁有多少件發明專利？",
+    "utility_patent_count": "請問貴公司擁有多少件新型專利？（與發明專利分開計算）",
+    "certification_count": "請問貴公司擁有多少份公司認證資料？（不包括ESG認證）",
+    "esg_certification": "請列出貴公司所有ESG相關認證（例如：ISO 14064, ISO 14067），如果沒有請回答「無」。",
+}
+
+_PRODUCTS_QUESTION = "公司基本資料已收集完成！接下來請提供產品資訊，首先請提供產品ID（例如：PROD001、SKU-001等）。"
+
+
+def _missing_field(onboarding_data: CompanyOnboarding) -> Optional[str]:
+    """First company field still to be collected, in the order it is asked"""
+    for field, _, _, _, _ in _FIELDS:
+        if field == "esg_certification":
+            if onboarding_data.esg_certification_count is None or not onboarding_data.esg_certification:
+                return field
+        elif getattr(onboarding_data, field) in (None, ""):
+            return field
+    return None
+
+
+def route_turn(user_message: str, onboarding_data: CompanyOnboarding, last_question: str) -> Optional[Dict[str, Any]]:
+    """
+    Try to answer a turn without the LLM
+
+    Returns {"rule": ..., "call": {"name": ..., "arguments": ...}} when the
+    message is a bare answer to the field the last assistant message asked for
+    (or 完成 after the product question once every field is filled in), else None.
+    The last message must be the router's own question for that field, or
+    mention no other field: a reply to a combined question goes to the LLM.
+    """
+    missing = _missing_field(onboarding_data)
+
+    if missing is None:
+        # Like the rule-based flow, finishing is only taken as such once products were asked about
+        if "產品" in last_question and _DONE_ANSWER.match(user_message):
+            return {"rule": "completed", "call": {"name": "mark_completed", "arguments": {"completed": True}}}
+        return None
+
+    _, _, _, parse, _ = next(entry for entry in _FIELDS if entry[0] == missing)
+    # The LLM may have asked something else; only route a reply to this field's question
+    if _QUESTIONS[missing] not in last_question:
+        asked = [field for field, _, keyword, _, _ in _FIELDS if keyword in last_question]
+        if asked != [missing]:
+            return None
+
+    value = parse(user_message)
+    if value is None:
+        return None
+    arguments = value if isinstance(value, dict) else {missing: value}
+    return {"rule": missing, "call": {"name": "update_company_data", "arguments": arguments}}
+
+
+def route_reply(route: Dict[str, Any], onboarding_data: CompanyOnboarding) -> str:
+    """Reply for an applied route: confirm what was recorded and ask the next question"""
+    if route["rule"] == "completed":
+        return "太棒了！您的資料已經收集完成，感謝您的配合。如需修改任何資料，隨時告訴我。"
+
+    _, label, _, _, unit = next(entry for entry in _FIELDS if entry[0] == route["rule"])
+    value = route["call"]["arguments"][route["rule"]]
+    missing = _missing_field(onboarding_data)
+    next_question = _QUESTIONS[missing] if missing else _PRODUCTS_QUESTION
+    return f"好的，已記錄{label}：{value}{unit}。\n\n{next_question}"
+
+
+def record_route(rule: Optional[str]):
+    """Count a turn as answered by `rule`, or by the LLM when rule is None"""
+    if rule is None:
+        _stats["llm"] += 1
+    else:
+        _routed[rule] += 1
+
+
+def get_router_stats() -> Dict[str, Any]:
+    """Get rule router hit counts for this worker process"""
+    routed = sum(_routed.values())
+    total = routed + _stats["llm"]
+    return {
+        "routed": routed,
+        "llm": _stats["llm"],
+        "hit_rate": round(routed / total, 4) if total else 0.0,
+        "by_rule": dict(_routed)
+    }
@@ -4,10 +4,14 @@ Manages conversation flow and data extraction
 """
 
 import re
-import json
+from contextlib import asynccontextmanager
+from datetime import datetime
 from typing import Dict, Any, Optional, List
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import ChatSession, ChatMessage, CompanyOnboarding, Product, ChatSessionStatus
+from session_cache import store_session_state, restore_session_state, invalidate_session_state
+from chat_archive import restore_archived_session
 
 
 class ConversationState:
@@ -32,56 +36,174 @@ class ConversationState:
 class ChatbotHandler:
     """Handles chatbot conversation logic"""
 
-    def __init__(self, db: Session, user_id: int, session_id: Optional[int] = None):
+    # Messages the rule-based flow looks back over
+    HISTORY_WINDOW = 5
+
+    def __init__(self, db: AsyncSession, user_id: int, session_id: Optional[int] = None):
         self.db = db
         self.user_id = user_id
         self.session_id = session_id
         self.session = None
         self.onboarding_data = None
 
-        # Load or create session
-        if session_id:
-            self.session = db.query(ChatSession).filter(
-                ChatSession.id == session_id,
-                ChatSession.user_id == user_id
-            ).first()
+        # Recent message window, kept in memory once known (seeded from the session state cache)
+        self._history = None
+
+        # Inside turn() writes are only flushed; the turn commits them once
+        self._in_turn = False
+
+    @asynccontextmanager
+    async def turn(self):
+        """
+        Unit of work for one chat turn
+
+        Everything the turn writes (messages, onboarding data, products, status) is
+        flushed as it goes and committed once when the block exits. If the block
+        raises, the whole turn is rolled back, including the user's message.
+        Loaded instances are expired by the rollback: call load_session() before
+        using the handler again.
+        """
+        self._in_turn = True
+        try:
+            yield self
+            await self.db.commit()
+        except BaseException:
+            await self.db.rollback()
+            self._history = None
+            if self.session_id:
+                invalidate_session_state(self.session_id)
+            raise
+        finally:
+            self._in_turn = False
+
+        # Write-through: the next turn on this session starts from the cache
+        if self.session:
+            store_session_state(self.session, self.onboarding_data, self._history, self.HISTORY_WINDOW)
+
+    async def _save(self, *instances):
+        """Flush pending writes inside a turn; otherwise commit and refresh the given instances"""
+        if self._in_turn:
+            # Flushing assigns ids and column defaults, so no refresh is needed
+            await self.db.flush()
+            return
+        await self.db.commit()
+        for instance in instances:
+            await self.db.refresh(instance)
+
+    async def load_session(self, restore_archived: bool = False) -> Optional[ChatSession]:
+        """
+        Load the chat session and its onboarding data (if session_id was given)
+
+        Safe to call again to refresh state already loaded in this db session.
+        A session cached by an earlier turn is rebuilt without any SQL.
+        With restore_archived=True an archived session is restored to the hot
+        tables first. Only pass it while holding the session's turn lock: the
+        restore re-inserts the archived message ids, so two at once collide.
+        """
+        if self.session_id:
+            cached = await restore_session_state(self.db, self.session_id, self.user_id, self.HISTORY_WINDOW)
+            if cached:
+                self.session, self.onboarding_data, self._history = cached
+                return self.session
+
+            self._history = None
+            result = await self.db.execute(
+                select(ChatSession).where(
+                    ChatSession.id == self.session_id,
+                    ChatSession.user_id == self.user_id
+                ).execution_options(populate_existing=True)
+            )
+            self.session = result.scalar_one_or_none()
+
+            if restore_archived and self.session and self.session.archived_at is not None:
+                # A new turn on an archived session brings its transcript back to chat_messages
+                await restore_archived_session(self.db, self.session)
+                await self._save()
 
             if self.session:
-                self.onboarding_data = db.query(CompanyOnboarding).filter(
-                    CompanyOnboarding.chat_session_id == session_id
-                ).first()
+                result = await self.db.execute(
+                    select(CompanyOnboarding).where(
+                        CompanyOnboarding.chat_session_id == self.session_id
+                    ).execution_options(populate_existing=True)
+                )
+                self.onboarding_data = result.scalar_one_or_none()
 
-    def create_session(self) -> ChatSession:
+        return self.session
+
+    async def create_session(self) -> ChatSession:
         """Create a new chat session"""
         self.session = ChatSession(
             user_id=self.user_id,
             status=ChatSessionStatus.ACTIVE
         )
         self.db.add(self.session)
-        self.db.commit()
-        self.db.refresh(self.session)
+        await self._save(self.session)
+
+        # Mark all previous records as not current (at most one current record per user)
+        await self.db.execute(
+            update(CompanyOnboarding).where(
+                CompanyOnboarding.user_id == self.user_id,
+                CompanyOnboarding.is_current == True
+            ).values(is_current=False)
+        )
 
-        # Create empty onboarding data
+        # Create empty onboarding data marked as current
         self.onboarding_data = CompanyOnboarding(
             chat_session_id=self.session.id,
-            user_id=self.user_id
+            user_id=self.user_id,
+            is_current=True,
+            products=[]  # loaded-empty, so a flush-only turn never lazy loads it
         )
         self.db.add(self.onboarding_data)
-        self.db.commit()
-        self.db.refresh(self.onboarding_data)
+        await self._save(self.onboarding_data)
 
+        # Older sessions' onboarding records were demoted in bulk, which skips the cache's ORM events
+        invalidate_session_state(user_id=self.user_id)
+
+        self._history = []
         return self.session
 
-    def get_conversation_history(self) -> List[ChatMessage]:
-        """Get conversation history for current session"""
+    async def get_conversation_history(self) -> List[ChatMessage]:
+        """Get the full conversation history for current session (turns use get_recent_messages)"""
+        if not self.session:
+            return []
+
+        result = await self.db.execute(
+            select(ChatMessage).where(
+                ChatMessage.session_id == self.session.id
+            ).order_by(ChatMessage.created_at)
+        )
+        return list(result.scalars().all())
+
+    async def get_recent_messages(self, limit: Optional[int] = None) -> List[ChatMessage]:
+        """Get the last `limit` messages (default HISTORY_WINDOW) for current session, oldest first"""
         if not self.session:
             return []
 
-        return self.db.query(ChatMessage).filter(
-            ChatMessage.session_id == self.session.id
-        ).order_by(ChatMessage.created_at).all()
+        limit = limit or self.HISTORY_WINDOW
+        if self._history is not None and limit <= self.HISTORY_WINDOW:
+            return self._history[-limit:]
+
+        # Newest rows first so only the window is read, then put back in conversation order
+        result = await self.db.execute(
+            select(ChatMessage).where(
+                ChatMessage.session_id == self.session.id
+            ).order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(max(limit, self.HISTORY_WINDOW))
+        )
+        history = list(reversed(result.scalars().all()))
 
-    def add_message(self, role: str, content: str) -> ChatMessage:
+        self._history = history[-self.HISTORY_WINDOW:]
+        return history[-limit:]
+
+    async def has_messages(self) -> bool:
+        """Check whether the current session has any messages yet"""
+        if not self.session:
+            return False
+
+        # Reading the window rather than an EXISTS lets the turn cache it too
+        return bool(await self.get_recent_messages(1))
+
+    async def add_message(self, role: str, content: str) -> ChatMessage:
         """Add a message to the conversation"""
         message = ChatMessage(
             session_id=self.session.id,
@@ -89,11 +211,14 @@ class ChatbotHandler:
             content=content
         )
         self.db.add(message)
-        self.db.commit()
-        self.db.refresh(message)
+        await self._save(message)
+
+        if self._history is not None:
+            self._history.append(message)
+            del self._history[:-self.HISTORY_WINDOW]
         return message
 
-    def get_next_field_to_collect(self) -> Optional[str]:
+    async def get_next_field_to_collect(self) -> Optional[str]:
         """Determine the next field to collect based on current data"""
         # Only collect fields within chatbot's responsibility
         if not self.onboarding_data.industry:
@@ -110,15 +235,15 @@ class ChatbotHandler:
             return ConversationState.ESG_CERTIFICATION
 
         # Check if we've asked about products
-        history = self.get_conversation_history()
-        asked_about_products = any("產品" in msg.content and msg.role == "assistant" for msg in history[-5:])
+        history = await self.get_recent_messages(5)
+        asked_about_products = any("產品" in msg.content and msg.role == "assistant" for msg in history)
 
         if not asked_about_products:
             return ConversationState.ADDING_PRODUCTS
 
         return ConversationState.COMPLETED
 
-    def extract_and_save_data(self, user_message: str, field: str) -> bool:
+    async def extract_and_save_data(self, user_message: str, field: str) -> bool:
         """Extract data from user message and save to database"""
         try:
             # Only collect fields within chatbot's responsibility
@@ -163,7 +288,7 @@ class ChatbotHandler:
                 else:
                     return False
 
-            self.db.commit()
+            await self._save()
             return True
 
         except Exception as e:
@@ -200,10 +325,9 @@ class ChatbotHandler:
 
         return product_data if product_data else None
 
-    def add_product(self, product_data: Dict[str, Any]) -> Product:
+    async def add_product(self, product_data: Dict[str, Any]) -> Product:
         """Add a product to the onboarding data"""
         product = Product(
-            onboarding_id=self.onboarding_data.id,
             product_id=product_data.get("product_id"),
             product_name=product_data.get("product_name"),
             price=product_data.get("price"),
@@ -211,9 +335,8 @@ class ChatbotHandler:
             product_standard=product_data.get("product_standard"),
             technical_advantages=product_data.get("technical_advantages")
         )
-        self.db.add(product)
-        self.db.commit()
-        self.db.refresh(product)
+        self.onboarding_data.products.append(product)
+        await self._save(product)
         return product
 
     def get_initial_greeting(self) -> str:
@@ -277,16 +400,13 @@ class ChatbotHandler:
 
         return prompts.get(field, "請繼續提供資料。")
 
-    def process_message(self, user_message: str) -> tuple[str, bool]:
+    async def process_message(self, user_message: str) -> tuple[str, bool]:
         """
         Process user message and return bot response
         Returns: (response_message, is_completed)
         """
-        # Get conversation history
-        history = self.get_conversation_history()
-
         # Check if this is the first message (no history yet)
-        if len(history) == 0:
+        if not await self.has_messages():
             # Check for menu selection
             user_msg_lower = user_message.lower().strip()
 
@@ -322,9 +442,10 @@ class ChatbotHandler:
         # Check if user wants to finish
         if any(word in user_message for word in ["完成", "結束", "不用", "沒有了", "不需要"]):
             # Check if we're in product adding phase
-            if any("產品" in msg.content for msg in history[-3:]):
+            if any("產品" in msg.content for msg in await self.get_recent_messages(3)):
                 self.session.status = ChatSessionStatus.COMPLETED
-                self.db.commit()
+                self.session.completed_at = datetime.utcnow()
+                await self._save()
 
                 products_count = len(self.onboarding_data.products)
                 return (
@@ -341,13 +462,13 @@ class ChatbotHandler:
                 )
 
         # Try to extract product data if we're in product adding phase
-        next_field = self.get_next_field_to_collect()
+        next_field = await self.get_next_field_to_collect()
 
         if next_field == ConversationState.ADDING_PRODUCTS or next_field == ConversationState.COMPLETED:
             product_data = self.extract_product_data(user_message)
             if product_data and product_data.get("product_name"):
                 # Valid product data found
-                self.add_product(product_data)
+                await self.add_product(product_data)
                 return (
                     f"產品「{product_data.get('product_name')}」已新增成功！\n\n"
                     f"是否要繼續新增其他產品？（如果是，請提供下一個產品資料；如果不是，請回答「完成」）",
@@ -356,13 +477,13 @@ class ChatbotHandler:
 
         # Extract and save data for current field
         if next_field and next_field not in [ConversationState.ADDING_PRODUCTS, ConversationState.COMPLETED]:
-            success = self.extract_and_save_data(user_message, next_field)
+            success = await self.extract_and_save_data(user_message, next_field)
 
             if not success:
                 return f"抱歉，我無法理解您的輸入。{self.get_prompt_for_field(next_field)}", False
 
             # Get next field to collect
-            next_field = self.get_next_field_to_collect()
+            next_field = await self.get_next_field_to_collect()
 
             if next_field == ConversationState.COMPLETED:
                 return "所有資料已收集完成！感謝您的配合。", True
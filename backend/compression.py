@@ -0,0 +1,88 @@
+"""
+Compression Helpers
+zlib-compressed JSON for cold data such as archived chat transcripts, and
+transparent compression of large text columns (zstd when available, else zlib)
+"""
+
+import json
+import zlib
+from typing import Any, Optional, Tuple
+from config import get_settings
+
+# zstd compresses faster and smaller than zlib; it is optional
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+settings = get_settings()
+
+# Archives are written once and read rarely, so favour size over speed
+ARCHIVE_COMPRESSION_LEVEL = 9
+
+# Codec names stored next to compressed text (e.g. chat_messages.content_codec)
+CODEC_ZSTD = "zstd"
+CODEC_ZLIB = "zlib"
+
+# Text columns are compressed on the request path, so favour speed
+ZSTD_TEXT_LEVEL = 3
+ZLIB_TEXT_LEVEL = 6
+
+
+def encode_json(value: Any) -> bytes:
+    """Serialize value as compact UTF-8 JSON"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def compress_json(value: Any, level: int = ARCHIVE_COMPRESSION_LEVEL) -> bytes:
+    """Serialize value as compact UTF-8 JSON and zlib-compress it"""
+    return zlib.compress(encode_json(value), level)
+
+
+def decompress_json(blob: bytes) -> Any:
+    """Inverse of compress_json"""
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def text_codec() -> str:
+    """Codec for newly compressed text: the configured one, or zlib without zstandard"""
+    if settings.text_compression_codec == CODEC_ZSTD and ZSTD_AVAILABLE:
+        return CODEC_ZSTD
+    return CODEC_ZLIB
+
+
+def compress_text(value: Optional[str]) -> Tuple[Optional[str], Optional[str], Optional[bytes]]:
+    """
+    Split text into (plain, codec, blob) column values
+
+    Text below TEXT_COMPRESSION_MIN_BYTES, or that does not shrink, stays plain
+    (codec and blob None); otherwise plain is None and blob holds the compressed text.
+    """
+    if value is None:
+        return None, None, None
+
+    raw = value.encode("utf-8")
+    if not settings.text_compression_enabled or len(raw) < settings.text_compression_min_bytes:
+        return value, None, None
+
+    codec = text_codec()
+    if codec == CODEC_ZSTD:
+        blob = zstandard.ZstdCompressor(level=ZSTD_TEXT_LEVEL).compress(raw)
+    else:
+        blob = zlib.compress(raw, ZLIB_TEXT_LEVEL)
+
+    if len(blob) >= len(raw):
+        return value, None, None
+    return None, codec, blob
+
+
+def decompress_text(codec: str, blob: bytes) -> str:
+    """Inverse of compress_text for a compressed value"""
+    if codec == CODEC_ZSTD:
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("Text was compressed with zstd; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(blob).decode("utf-8")
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(blob).decode("utf-8")
+    raise ValueError(f"Unknown text codec: {codec}")
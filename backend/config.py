@@ -1,3 +1,4 @@
+from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from functools import lru_cache
 
@@ -19,6 +20,65 @@ class Settings(BaseSettings):
     openai_model: str = "gpt-4o-mini"  # Cost-effective and powerful
     use_ai_chatbot: bool = True  # Toggle AI vs rule-based
 
+    # LLM Admission Control (per worker process)
+    llm_max_concurrency: int = 8  # Max concurrent OpenAI calls
+    llm_max_queue: int = 22  # Max calls waiting for a slot before shedding load (concurrency + queue <= DB pool of 30)
+    llm_queue_timeout_seconds: float = 30.0  # Max time a call waits for a slot
+    llm_retry_after_seconds: int = 5  # Retry-After sent with 503 responses
+    llm_context_token_budget: int = 6000  # Estimated prompt tokens per chat completion (history is trimmed to fit)
+    rule_router_enabled: bool = True  # Answer bare numbers / 無 / 完成 with rules before calling the LLM
+
+    # Document extraction response cache (llm_response_cache table, shared by all workers)
+    llm_cache_enabled: bool = True
+    llm_cache_max_entries: int = 5000  # Least recently used entries beyond this are evicted
+    llm_cache_ttl_seconds: float = 604800.0  # 7 days
+
+    # Per-session turn serialization: "local" (in-process) or "postgres" (advisory locks, multi-worker)
+    session_lock_backend: str = "local"
+    # Connections holding advisory locks (postgres backend), one per turn in progress; also caps
+    # the LLM limiter's concurrency + queue, since every admitted or queued turn holds one
+    session_lock_pool_size: int = 30
+
+    # Idempotency-Key replay store (per worker process)
+    idempotency_ttl_seconds: float = 86400.0
+    idempotency_max_entries: int = 10000
+
+    # Verified JWT cache (entries expire with the token's exp claim)
+    jwt_cache_max_entries: int = 10000
+    jwt_cache_ttl_seconds: float = 300.0  # For tokens without exp
+
+    # Synced user snapshot cache (per worker process)
+    user_cache_max_entries: int = 10000
+    user_cache_ttl_seconds: float = 60.0
+
+    # Chat session state cache (per worker process). Turns on one session must reach the
+    # same worker while it is enabled, e.g. single worker or sticky routing; it is
+    # turned off with SESSION_LOCK_BACKEND=postgres, which means several workers
+    session_cache_enabled: bool = True
+    session_cache_max_entries: int = 10000
+    session_cache_ttl_seconds: float = 300.0
+
+    # Rolling conversation summary (refreshed in the background every N turns)
+    summary_enabled: bool = True
+    summary_refresh_turns: int = 5
+
+    # Chat message archive (archive_chat_sessions.py moves finished sessions' messages
+    # into one compressed row per session)
+    archive_after_days: int = 30
+    archive_batch_size: int = 100
+
+    # Compression of large text columns (chat message bodies); zstd needs the zstandard
+    # package and falls back to zlib without it
+    text_compression_enabled: bool = True
+    text_compression_codec: str = "zstd"  # zstd or zlib
+    text_compression_min_bytes: int = 1024
+
+    # File Extraction Worker Pool (PDF/DOCX parsing and OCR run off the event loop)
+    file_worker_processes: int = 2  # Max concurrent extraction processes
+    file_worker_max_tasks: int = 50  # Recycle a worker process after this many jobs
+    file_job_timeout_seconds: float = 60.0  # Per-file extraction timeout
+    extraction_job_max_seconds: float = 600.0  # Unfinished jobs older than this were lost with their process
+
     # Modern Pydantic V2 configuration
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -27,6 +87,14 @@ class Settings(BaseSettings):
         extra="ignore" # This prevents errors if there are extra variables in .env
     )
 
+    @model_validator(mode="after")
+    def disable_session_cache_for_multiple_workers(self):
+        """Invalidation only reaches the worker that wrote, so other workers would serve stale sessions"""
+        if self.session_cache_enabled and self.session_lock_backend == "postgres":
+            print("⚠️  SESSION_CACHE_ENABLED ignored: the per-process session cache is off with SESSION_LOCK_BACKEND=postgres")
+            self.session_cache_enabled = False
+        return self
+
 @lru_cache()
 def get_settings() -> Settings:
     """Get cached settings instance"""
@@ -0,0 +1,180 @@
+"""
+Rolling Conversation Summary
+Messages that fall out of the recent window sent to the LLM are folded into a
+per-session summary in the background, so prompts stay the same size however
+long a session runs
+"""
+
+import asyncio
+from typing import List, Optional, Set
+from sqlalchemy import select, func, update
+from sqlalchemy.orm.attributes import set_committed_value
+from database import AsyncSessionLocal
+from models import ChatSession, ChatMessage
+from ai_chatbot_handler import AIChatbotHandler, get_async_openai_client
+from llm_limiter import get_llm_limiter, LLMOverloadedError
+from session_cache import invalidate_session_state
+from cache import TTLCache
+from config import get_settings
+
+settings = get_settings()
+
+# Upper bound on messages folded in one refresh (older sessions catch up over several turns)
+MAX_MESSAGES_PER_REFRESH = 100
+
+# How long an idle session's turn counter is kept
+TURN_COUNTER_TTL_SECONDS = 86400.0
+
+SUMMARY_PROMPT = """你負責為企業資料收集對話撰寫摘要。
+請將「先前摘要」與「新對話」整合成一份新的摘要，保留：
+- 使用者提供過的公司資訊與產品資訊（包含數字）
+- 使用者的更正、疑問與尚未回答的問題
+- 助理已經詢問過的項目
+
+使用繁體中文，條列式，不超過300字。只輸出摘要內容。"""
+
+# Running refresh tasks (kept referenced so they are not garbage collected mid-run)
+_running_refreshes: Set[asyncio.Task] = set()
+# Sessions with a refresh in progress, so one session never has two at once
+_refreshing_sessions: Set[int] = set()
+# Turns since the last refresh check per session; a check runs every SUMMARY_REFRESH_TURNS turns
+_turns_since_check = TTLCache(maxsize=settings.session_cache_max_entries, ttl=TURN_COUNTER_TTL_SECONDS)
+
+
+def schedule_summary_refresh(session: ChatSession) -> Optional[asyncio.Task]:
+    """
+    Start a background summary refresh for a session after a turn
+
+    Turns are counted in memory and a refresh is only started every
+    SUMMARY_REFRESH_TURNS turns, so most turns cost nothing here. The refresh only
+    calls the LLM once at least that many turns have left the recent window since
+    the last summary. When it finishes, the new
+    summary is also set on the given session object, and the session's cached
+    state is dropped so the next turn loads it.
+    """
+    if not settings.summary_enabled or session.id in _refreshing_sessions:
+        return None
+
+    turns = _turns_since_check.get(session.id, 0) + 1
+    if turns < settings.summary_refresh_turns:
+        _turns_since_check.set(session.id, turns)
+        return None
+    _turns_since_check.pop(session.id)
+
+    _refreshing_sessions.add(session.id)
+    task = asyncio.create_task(refresh_session_summary(session.id, session.summary_through_message_id))
+    _running_refreshes.add(task)
+
+    def on_done(finished: asyncio.Task):
+        _running_refreshes.discard(finished)
+        _refreshing_sessions.discard(session.id)
+        if finished.cancelled() or finished.exception() or finished.result() is None:
+            return
+        summary, through_message_id = finished.result()
+        # Committed values: the caller's db session must not see this as a pending change
+        set_committed_value(session, "summary", summary)
+        set_committed_value(session, "summary_through_message_id", through_message_id)
+        # A turn that committed during the refresh may have cached the old summary
+        invalidate_session_state(session.id)
+
+    task.add_done_callback(on_done)
+    return task
+
+
+async def cancel_running_summaries():
+    """Cancel in-flight summary refreshes (called on application shutdown)"""
+    tasks = list(_running_refreshes)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def refresh_session_summary(session_id: int, summary_through_message_id: Optional[int] = None):
+    """
+    Fold messages older than the recent window into the session summary
+
+    summary_through_message_id is the caller's (possibly stale) copy of the
+    session's value: messages after it are counted first, and the session and its
+    messages are only loaded when enough of them have left the recent window.
+    The reads are committed before the LLM call and the new summary is written in
+    a second short session, so no connection is held while the call runs.
+    Returns (summary, summary_through_message_id) if the summary was updated, else None.
+    """
+    window = AIChatbotHandler.HISTORY_WINDOW
+    min_new_messages = settings.summary_refresh_turns * 2  # a turn is a user + assistant message
+
+    try:
+        async with AsyncSessionLocal() as db:
+            new_messages = select(func.count()).select_from(ChatMessage).where(ChatMessage.session_id == session_id)
+            if summary_through_message_id is not None:
+                new_messages = new_messages.where(ChatMessage.id > summary_through_message_id)
+            if await db.scalar(new_messages) < window + min_new_messages:
+                return None
+
+            session = await db.get(ChatSession, session_id)
+            if not session:
+                return None
+            previous_summary = session.summary
+            previous_through_message_id = session.summary_through_message_id
+
+            query = select(ChatMessage).where(ChatMessage.session_id == session_id)
+            if previous_through_message_id is not None:
+                query = query.where(ChatMessage.id > previous_through_message_id)
+            result = await db.execute(
+                query.order_by(ChatMessage.created_at, ChatMessage.id).limit(MAX_MESSAGES_PER_REFRESH + window)
+            )
+            messages = list(result.scalars().all())
+            await db.commit()
+
+        # Keep the recent window out of the summary: it is sent to the LLM verbatim
+        to_fold = messages[:-window]
+        if len(to_fold) < min_new_messages:
+            return None
+
+        summary = await summarize_messages(previous_summary, to_fold)
+        if not summary:
+            return None
+
+        async with AsyncSessionLocal() as db:
+            # Skipped if another worker moved the summary on during the call
+            result = await db.execute(
+                update(ChatSession).where(
+                    ChatSession.id == session_id,
+                    ChatSession.summary_through_message_id.is_not_distinct_from(previous_through_message_id)
+                ).values(summary=summary, summary_through_message_id=to_fold[-1].id)
+            )
+            await db.commit()
+        if not result.rowcount:
+            return None
+        return summary, to_fold[-1].id
+
+    except LLMOverloadedError:
+        # Not urgent: the next turn tries again
+        return None
+    except Exception as e:
+        print(f"Summary refresh for session {session_id} failed: {e}")
+        return None
+
+
+async def summarize_messages(previous_summary: Optional[str], messages: List[ChatMessage]) -> Optional[str]:
+    """Ask the LLM for a new summary covering previous_summary plus messages"""
+    client = get_async_openai_client()
+    if not client:
+        return None
+
+    transcript = "\n".join(
+        f"{'使用者' if msg.role == 'user' else '助理'}：{msg.content}"
+        for msg in messages
+    )
+
+    async with get_llm_limiter().slot():
+        response = await client.chat.completions.create(
+            model=settings.openai_model,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"先前摘要：\n{previous_summary or '（無）'}\n\n新對話：\n{transcript}"}
+            ],
+            max_tokens=600
+        )
+
+    return (response.choices[0].message.content or "").strip() or None
@@ -0,0 +1,266 @@
+"""
+Background Document Extraction Jobs
+Uploads are queued as jobs: file extraction runs in the worker process pool,
+then AI extraction results are applied to the chat session's onboarding data.
+"""
+
+import asyncio
+import json
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Set
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal
+from models import ExtractionJob, ExtractionJobStatus
+from ai_chatbot_handler import AIChatbotHandler, get_async_openai_client
+from file_processor import process_file_in_pool
+from llm_limiter import get_llm_limiter, LLMOverloadedError
+from llm_response_cache import response_cache_key, get_cached_response, store_response
+from llm_context import estimate_message_tokens, estimate_tools_tokens, record_usage
+from llm_tools import DOCUMENT_EXTRACTION_PROMPT, DOCUMENT_TOOLS, parse_tool_call, dispatch_tool_call
+from session_locks import session_turn_lock
+from config import get_settings
+
+settings = get_settings()
+
+# Running job tasks (kept referenced so they are not garbage collected mid-run)
+_running_jobs: Set[asyncio.Task] = set()
+
+# Tools a document extraction may apply (it cannot complete the session)
+DOCUMENT_TOOL_NAMES = {tool["function"]["name"] for tool in DOCUMENT_TOOLS}
+DOCUMENT_TOOLS_TOKENS = estimate_tools_tokens(DOCUMENT_TOOLS)
+
+UNFINISHED_STATUSES = (ExtractionJobStatus.PENDING, ExtractionJobStatus.RUNNING)
+INTERRUPTED_ERROR = "Job was interrupted by a server restart, please upload the file again"
+
+
+async def enqueue_extraction_job(
+    db: AsyncSession,
+    user_id: int,
+    session_id: Optional[int],
+    file_content: bytes,
+    filename: str,
+    content_type: str
+) -> ExtractionJob:
+    """Create an extraction job and start processing it in the background"""
+    job = ExtractionJob(
+        user_id=user_id,
+        session_id=session_id,
+        filename=filename,
+        content_type=content_type,
+        status=ExtractionJobStatus.PENDING
+    )
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+
+    task = asyncio.create_task(run_extraction_job(job.id, file_content))
+    _running_jobs.add(task)
+    task.add_done_callback(_running_jobs.discard)
+
+    return job
+
+
+async def cancel_running_jobs():
+    """Cancel in-flight jobs (called on application shutdown); they are marked as failed"""
+    tasks = list(_running_jobs)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _stale_job_cutoff() -> datetime:
+    """Jobs created before this cannot still be running in any worker"""
+    return datetime.utcnow() - timedelta(seconds=settings.extraction_job_max_seconds)
+
+
+async def fail_interrupted_jobs() -> int:
+    """
+    Mark jobs left PENDING/RUNNING by a process that died as failed (called on startup)
+
+    Jobs run inside the API process and their file bytes only live in its memory,
+    so a crash or kill -9 leaves them unfinished for good. With the local lock
+    backend this process is the only worker and every unfinished job is such a
+    job; with several workers only those older than EXTRACTION_JOB_MAX_SECONDS are.
+    Returns how many jobs were marked.
+    """
+    if settings.session_lock_backend == "local":
+        cutoff = datetime.utcnow()
+    else:
+        cutoff = _stale_job_cutoff()
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(ExtractionJob).where(
+                ExtractionJob.status.in_(UNFINISHED_STATUSES),
+                ExtractionJob.created_at < cutoff
+            ).values(
+                status=ExtractionJobStatus.FAILED,
+                error=INTERRUPTED_ERROR,
+                finished_at=datetime.utcnow()
+            )
+        )
+        await db.commit()
+
+    if result.rowcount:
+        print(f"Marked {result.rowcount} interrupted extraction jobs as failed")
+    return result.rowcount
+
+
+async def fail_if_stale(db: AsyncSession, job: ExtractionJob):
+    """Mark an unfinished job as failed once it is older than any job can run, so polling ends"""
+    if job.status in UNFINISHED_STATUSES and job.created_at < _stale_job_cutoff():
+        job.status = ExtractionJobStatus.FAILED
+        job.error = INTERRUPTED_ERROR
+        job.finished_at = datetime.utcnow()
+        await db.commit()
+
+
+async def _finish_job(job_id: int, status: ExtractionJobStatus, result: Optional[Dict[str, Any]] = None,
+                      error: Optional[str] = None):
+    """Record the final state of a job"""
+    async with AsyncSessionLocal() as db:
+        job = await db.get(ExtractionJob, job_id)
+        if not job:
+            return
+        job.status = status
+        job.result = json.dumps(result, ensure_ascii=False) if result is not None else None
+        job.error = error
+        job.finished_at = datetime.utcnow()
+        await db.commit()
+
+
+async def run_extraction_job(job_id: int, file_content: bytes):
+    """Process an extraction job: extract text, run AI extraction, apply results"""
+    try:
+        async with AsyncSessionLocal() as db:
+            job = await db.get(ExtractionJob, job_id)
+            if not job:
+                return
+            job.status = ExtractionJobStatus.RUNNING
+            job.started_at = datetime.utcnow()
+            await db.commit()
+
+            # Process file and extract text (CPU-heavy parsing/OCR runs in the worker pool)
+            result = await process_file_in_pool(file_content, job.filename, job.content_type)
+
+            if not result["success"]:
+                await _finish_job(job_id, ExtractionJobStatus.FAILED, error=result["error"])
+                return
+
+            extracted_text = result["extracted_text"]
+
+            # Return raw extracted text if AI is not available
+            if not settings.use_ai_chatbot or not settings.openai_api_key:
+                await _finish_job(job_id, ExtractionJobStatus.SUCCEEDED, result={
+                    "success": True,
+                    "filename": job.filename,
+                    "extracted_text": extracted_text,
+                    "message": "文件已成功處理。請將提取的文字發送給聊天機器人進行處理。",
+                    "ai_available": False
+                })
+                return
+
+            # Applying results is a turn on the session: serialize it with chat messages
+            async with session_turn_lock(job.session_id):
+                handler = AIChatbotHandler(db, job.user_id, job.session_id)
+                await handler.load_session(restore_archived=True)
+                if not handler.session:
+                    await _finish_job(job_id, ExtractionJobStatus.FAILED, error="Chat session not found")
+                    return
+
+                # Data updates, products and the assistant message are committed together
+                async with handler.turn():
+                    job_result = await apply_document_extraction(handler, job.filename, extracted_text)
+
+        await _finish_job(job_id, ExtractionJobStatus.SUCCEEDED, result=job_result)
+
+    except asyncio.CancelledError:
+        await _finish_job(job_id, ExtractionJobStatus.FAILED, error="Job was interrupted by a server shutdown")
+        raise
+    except LLMOverloadedError as e:
+        await _finish_job(job_id, ExtractionJobStatus.FAILED,
+                          error=f"AI service is busy, please upload again in {e.retry_after} seconds")
+    except Exception as e:
+        print(f"Extraction job {job_id} failed: {e}")
+        await _finish_job(job_id, ExtractionJobStatus.FAILED, error=f"Error processing file: {str(e)}")
+
+
+async def apply_document_extraction(handler: AIChatbotHandler, filename: str, extracted_text: str) -> Dict[str, Any]:
+    """
+    Use AI to extract structured company information from document text
+    and apply it through the shared tool registry (llm_tools)
+
+    A document already extracted (same text, prompt and model) replays the
+    cached reply and tool calls without calling OpenAI.
+    """
+    messages = [
+        {"role": "system", "content": DOCUMENT_EXTRACTION_PROMPT},
+        {
+            "role": "user",
+            "content": f"從以下文件內容中提取公司資訊：\n\n{extracted_text[:4000]}"  # Limit to 4000 chars
+        }
+    ]
+
+    # No connection is held through the cache lookup, the limiter wait and the LLM call
+    await handler.end_read_transaction()
+
+    # The same document yields the same request, so a stored reply is replayed
+    cache_key = response_cache_key(settings.openai_model, messages, DOCUMENT_TOOLS)
+    response = await get_cached_response(cache_key)
+    cached = response is not None
+
+    if not cached:
+        client = get_async_openai_client()
+        async with get_llm_limiter().slot():
+            ai_response = await client.chat.completions.create(
+                model=settings.openai_model,
+                messages=messages,
+                tools=DOCUMENT_TOOLS,
+                tool_choice="auto"
+            )
+        record_usage(
+            sum(estimate_message_tokens(message) for message in messages) + DOCUMENT_TOOLS_TOKENS,
+            getattr(ai_response, "usage", None)
+        )
+
+        ai_choice = ai_response.choices[0].message
+        response = {
+            "message": ai_choice.content,
+            "tool_calls": [
+                {"name": tool_call.function.name, "arguments": tool_call.function.arguments}
+                for tool_call in ai_choice.tool_calls or []
+            ]
+        }
+        await store_response(cache_key, settings.openai_model, response)
+
+    # Process AI response and update database
+    ai_message = response["message"] or "已處理文件並提取資訊。"
+    data_updated = False
+    products_added = 0
+
+    for tool_call in response["tool_calls"]:
+        call = parse_tool_call(tool_call["name"], tool_call["arguments"])
+        if not call or call["name"] not in DOCUMENT_TOOL_NAMES:
+            continue
+
+        if await dispatch_tool_call(handler, call):
+            if call["name"] == "update_company_data":
+                data_updated = True
+            else:
+                products_added += 1
+
+    # Save the AI message to conversation history
+    await handler.add_message("assistant", f"📄 已處理文件：{filename}\n\n{ai_message}")
+
+    return {
+        "success": True,
+        "filename": filename,
+        "session_id": handler.session.id,
+        "message": ai_message,
+        "extracted_text_length": len(extracted_text),
+        "data_updated": data_updated,
+        "products_added": products_added,
+        "cached": cached,
+        "progress": handler.get_progress()
+    }
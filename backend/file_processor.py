@@ -5,6 +5,11 @@ Extracts text and data from various file formats
 
 import os
 import io
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
 from typing import Optional, Dict, Any
 from pathlib import Path
 import mimetypes
@@ -34,6 +39,7 @@ except ImportError:
 # OpenAI for advanced image understanding
 from openai import OpenAI
 from config import get_settings
+from llm_limiter import get_llm_limiter, LLMOverloadedError
 
 settings = get_settings()
 
@@ -271,3 +277,114 @@ def get_file_info(filename: str, content_type: str) -> Dict[str, str]:
         'type': file_type_names.get(file_type, '未知格式'),
         'type_code': file_type
     }
+
+
+# ============== Process Pool Offload ==============
+
+# Extraction pool is created lazily on first upload
+_extraction_pool: Optional[ProcessPoolExecutor] = None
+_extraction_slots: Optional[asyncio.Semaphore] = None
+
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    """
+    Lazy initialize the process pool used for file extraction
+
+    Workers are recycled after file_worker_max_tasks jobs, which bounds memory
+    growth from PDF/OCR libraries. Recycling requires the spawn start method,
+    so every new worker re-imports the server's main module (as __mp_main__);
+    main.py therefore does its startup work in startup hooks, not at import.
+    """
+    global _extraction_pool
+    if _extraction_pool is None:
+        _extraction_pool = ProcessPoolExecutor(
+            max_workers=settings.file_worker_processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            max_tasks_per_child=settings.file_worker_max_tasks
+        )
+    return _extraction_pool
+
+
+def shutdown_extraction_pool():
+    """Shut down the extraction pool (called on application shutdown)"""
+    global _extraction_pool
+    if _extraction_pool is not None:
+        _extraction_pool.shutdown(wait=False, cancel_futures=True)
+        _extraction_pool = None
+
+
+def _replace_extraction_pool(pool: ProcessPoolExecutor, terminate: bool = False):
+    """
+    Drop a broken or hung pool so the next job starts a fresh one
+
+    With terminate=True its worker processes are killed first: a job stuck in
+    PDF parsing or OCR would otherwise keep its CPU and its worker forever.
+    Other jobs still running on that pool fail with BrokenProcessPool.
+    """
+    global _extraction_pool
+    if _extraction_pool is pool:
+        _extraction_pool = None
+    if terminate:
+        # ProcessPoolExecutor has no public way to stop a running job
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _process_file_in_worker(file_content: bytes, filename: str, content_type: str) -> Dict[str, Any]:
+    """Entry point executed inside a pool worker process"""
+    return FileProcessor().process_file(file_content, filename, content_type)
+
+
+async def process_file_in_pool(file_content: bytes, filename: str, content_type: str) -> Dict[str, Any]:
+    """
+    Run FileProcessor.process_file in the extraction process pool
+
+    At most file_worker_processes jobs are handed to the pool at a time; further
+    uploads wait here instead of piling up in the executor queue. Returns the same
+    result dictionary as process_file, with an error result on timeout.
+    """
+    global _extraction_slots
+    if _extraction_slots is None:
+        _extraction_slots = asyncio.Semaphore(settings.file_worker_processes)
+
+    # Images are sent to OpenAI Vision from the worker, so they also take an LLM slot
+    uses_llm = FileProcessor.SUPPORTED_FORMATS.get(content_type) == 'image' and bool(settings.openai_api_key)
+
+    async with _extraction_slots:
+        loop = asyncio.get_running_loop()
+        pool = get_extraction_pool()
+
+        try:
+            async with (get_llm_limiter().slot() if uses_llm else nullcontext()):
+                future = loop.run_in_executor(
+                    pool,
+                    _process_file_in_worker,
+                    file_content,
+                    filename,
+                    content_type
+                )
+                return await asyncio.wait_for(future, timeout=settings.file_job_timeout_seconds)
+        except BrokenProcessPool as e:
+            # A worker died (e.g. OOM during OCR); start a fresh pool for the next job
+            _replace_extraction_pool(pool)
+            return {
+                "success": False,
+                "error": f"Error processing file: {str(e)}"
+            }
+        except LLMOverloadedError:
+            raise
+        except asyncio.TimeoutError:
+            # Kill the hung worker; left running it would hold its process while later
+            # jobs queue behind it in the executor and time out in turn
+            print(f"File extraction timed out after {settings.file_job_timeout_seconds}s: {filename}")
+            _replace_extraction_pool(pool, terminate=True)
+            return {
+                "success": False,
+                "error": f"File processing timed out after {settings.file_job_timeout_seconds:g} seconds"
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Error processing file: {str(e)}"
+            }
@@ -0,0 +1,113 @@
+"""
+Idempotency Keys
+Replays the stored response when a client repeats a POST with the same
+Idempotency-Key, so retries and double-clicks don't run the turn (and the
+LLM call) twice
+"""
+
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from cache import TTLCache
+from config import get_settings
+
+settings = get_settings()
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+@dataclass
+class _StoredResponse:
+    fingerprint: str
+    body: Any
+
+
+@dataclass
+class _PendingRequest:
+    fingerprint: str
+    done: asyncio.Future
+
+
+def request_fingerprint(*parts: Any) -> str:
+    """Hash the parts of a request that must match for a key to be replayed"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else repr(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class IdempotencyStore:
+    """Stores first responses per (user, route, key) and coalesces in-flight duplicates"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._responses = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._in_flight: Dict[Hashable, _PendingRequest] = {}
+
+    @staticmethod
+    def _check_fingerprint(expected: str, fingerprint: str):
+        if expected != fingerprint:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"{IDEMPOTENCY_HEADER} was already used with a different request"
+            )
+
+    async def run(
+        self,
+        key: Hashable,
+        fingerprint: str,
+        func: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """
+        Run func once per key and return (json_body, replayed)
+
+        A repeat of a completed request gets the stored body back; a repeat that
+        arrives while the original is still running waits for it. Failed requests
+        are not stored, so the client may retry them with the same key.
+        """
+        while True:
+            stored = self._responses.get(key)
+            if stored is not None:
+                self._check_fingerprint(stored.fingerprint, fingerprint)
+                return stored.body, True
+
+            pending = self._in_flight.get(key)
+            if pending is None:
+                break
+
+            self._check_fingerprint(pending.fingerprint, fingerprint)
+            # Shielded so a disconnecting duplicate doesn't cancel the shared future
+            await asyncio.shield(pending.done)
+
+        pending = _PendingRequest(fingerprint, asyncio.get_running_loop().create_future())
+        self._in_flight[key] = pending
+        try:
+            body = jsonable_encoder(await func())
+            self._responses.set(key, _StoredResponse(fingerprint, body))
+            return body, False
+        finally:
+            del self._in_flight[key]
+            pending.done.set_result(None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get stored response and in-flight counts"""
+        return {**self._responses.get_stats(), "in_flight": len(self._in_flight)}
+
+
+# Store will be initialized lazily
+_store: Optional[IdempotencyStore] = None
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    """Lazy initialize the process-wide idempotency store"""
+    global _store
+    if _store is None:
+        _store = IdempotencyStore(
+            maxsize=settings.idempotency_max_entries,
+            ttl=settings.idempotency_ttl_seconds
+        )
+    return _store
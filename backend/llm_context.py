@@ -0,0 +1,96 @@
+"""
+Token-Budgeted LLM Context
+Prompts are packed by estimated tokens instead of message count: the system
+prompt, collected data and summary always go in, then as many recent messages
+as fit the budget. Estimates are compared with the usage the API reports
+"""
+
+import json
+import math
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from config import get_settings
+
+settings = get_settings()
+
+# CJK ideographs, kana, hangul and full-width punctuation are about one token per
+# character; other text (English, digits, JSON) is about four characters per token
+_WIDE_CHARS = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\ufe30-\ufe4f\uff00-\uffef]")
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and separators added per message
+
+# Per worker process totals of estimated vs reported prompt tokens
+_usage = {"calls": 0, "estimated_prompt_tokens": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+
+def estimate_tokens(text: str) -> int:
+    """Offline token estimate for mixed Chinese/English text"""
+    wide = len(_WIDE_CHARS.findall(text))
+    return wide + math.ceil((len(text) - wide) / CHARS_PER_TOKEN)
+
+
+def estimate_message_tokens(message: Dict[str, Any]) -> int:
+    """Estimated tokens of one chat message"""
+    return estimate_tokens(message["content"] or "") + MESSAGE_OVERHEAD_TOKENS
+
+
+def estimate_tools_tokens(tools: List[Dict[str, Any]]) -> int:
+    """Estimated tokens of the tool schemas sent with a request"""
+    return estimate_tokens(json.dumps(tools, ensure_ascii=False))
+
+
+def build_context(
+    prefix: List[Dict[str, Any]],
+    history: List[Dict[str, Any]],
+    user_message: Dict[str, Any],
+    budget: int,
+    reserved: int = 0
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Pack prefix + the newest history messages that fit + user_message
+
+    The prefix and the user message are always sent; history (oldest first) is
+    added newest to oldest while the total stays within `budget` minus `reserved`
+    (e.g. tool schemas). Returns (messages, estimated prompt tokens).
+    """
+    used = reserved + sum(estimate_message_tokens(message) for message in prefix)
+    used += estimate_message_tokens(user_message)
+
+    packed = []
+    for message in reversed(history):
+        cost = estimate_message_tokens(message)
+        if used + cost > budget:
+            break
+        packed.append(message)
+        used += cost
+    packed.reverse()
+
+    if len(packed) < len(history):
+        print(f"LLM context: {len(history) - len(packed)} older messages left out to fit {budget} tokens")
+
+    return prefix + packed + [user_message], used
+
+
+def record_usage(estimated_prompt_tokens: int, usage: Optional[Any]):
+    """Log the estimate against the usage the API reported (if any) and add both to the totals"""
+    if usage is None:
+        print(f"LLM call: ~{estimated_prompt_tokens} prompt tokens (estimated)")
+        return
+
+    _usage["calls"] += 1
+    _usage["estimated_prompt_tokens"] += estimated_prompt_tokens
+    _usage["prompt_tokens"] += usage.prompt_tokens
+    _usage["completion_tokens"] += usage.completion_tokens
+    print(f"LLM call: ~{estimated_prompt_tokens} prompt tokens estimated, "
+          f"{usage.prompt_tokens} prompt + {usage.completion_tokens} completion tokens used")
+
+
+def get_token_usage_stats() -> Dict[str, Any]:
+    """Get estimated vs reported token totals for this worker process"""
+    return {
+        **_usage,
+        "budget": settings.llm_context_token_budget,
+        # Reported / estimated prompt tokens; above 1 means the estimate runs low
+        "estimate_ratio": _usage["prompt_tokens"] / _usage["estimated_prompt_tokens"]
+        if _usage["estimated_prompt_tokens"] else None
+    }
@@ -0,0 +1,136 @@
+"""
+LLM Admission Control
+Caps concurrent OpenAI calls per worker with a bounded wait queue, and sheds
+load (HTTP 503 + Retry-After) when the queue is full
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional
+from fastapi import Request, status
+from fastapi.responses import JSONResponse
+from config import get_settings
+from database import ASYNC_POOL_CAPACITY, SESSION_LOCK_POOL_SIZE
+
+settings = get_settings()
+
+
+class LLMOverloadedError(Exception):
+    """Raised when an LLM call cannot be admitted (wait queue full or wait timed out)"""
+
+    def __init__(self, retry_after: int, reason: str = "LLM service is busy"):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+async def llm_overloaded_handler(request: Request, exc: LLMOverloadedError) -> JSONResponse:
+    """Exception handler: shed load with 503 + Retry-After when the LLM queue is full"""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": f"AI service is busy: {exc.reason}. Please retry later."},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+class LLMAdmissionController:
+    """Concurrency limiter with a bounded wait queue for LLM calls"""
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float, retry_after: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        # Monitoring counters
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted_total = 0
+        self.rejected_total = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def is_overloaded(self) -> bool:
+        """True if a new call would be rejected right now"""
+        return self._semaphore.locked() and self.waiting >= self.max_queue
+
+    def check_admission(self):
+        """Raise LLMOverloadedError now if a new call would be rejected"""
+        if self.is_overloaded():
+            self.rejected_total += 1
+            raise LLMOverloadedError(self.retry_after, "LLM wait queue is full")
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one LLM concurrency slot for the duration of the block"""
+        self.check_admission()
+
+        start = time.perf_counter()
+        if self._semaphore.locked():
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected_total += 1
+                raise LLMOverloadedError(self.retry_after, "Timed out waiting for an LLM slot")
+            finally:
+                self.waiting -= 1
+        else:
+            # Free slot: acquire() returns without suspending, so accounting stays exact
+            await self._semaphore.acquire()
+
+        wait_seconds = time.perf_counter() - start
+        self.admitted_total += 1
+        self.total_wait_seconds += wait_seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue depth and wait time statistics"""
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "admitted_total": self.admitted_total,
+            "rejected_total": self.rejected_total,
+            "avg_wait_ms": round(self.total_wait_seconds / self.admitted_total * 1000, 2) if self.admitted_total else 0.0,
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 2)
+        }
+
+
+# Limiter will be initialized lazily
+_limiter: Optional[LLMAdmissionController] = None
+
+
+def get_llm_limiter() -> LLMAdmissionController:
+    """Lazy initialize the process-wide LLM admission controller"""
+    global _limiter
+    if _limiter is None:
+        # A turn admitted or queued here still checks out a connection for its writes,
+        # so together they may not outnumber the async pool. With advisory session locks
+        # each of them also holds a connection from the lock pool for the whole turn.
+        pool_capacity = ASYNC_POOL_CAPACITY
+        if settings.session_lock_backend == "postgres":
+            pool_capacity = min(pool_capacity, SESSION_LOCK_POOL_SIZE)
+        max_concurrency = min(settings.llm_max_concurrency, pool_capacity)
+        max_queue = min(settings.llm_max_queue, pool_capacity - max_concurrency)
+        if (max_concurrency, max_queue) != (settings.llm_max_concurrency, settings.llm_max_queue):
+            print(f"LLM limiter: capped to {max_concurrency} concurrent + {max_queue} queued calls "
+                  f"(database pools have {pool_capacity} connections for turns)")
+
+        _limiter = LLMAdmissionController(
+            max_concurrency=max_concurrency,
+            max_queue=max_queue,
+            queue_timeout=settings.llm_queue_timeout_seconds,
+            retry_after=settings.llm_retry_after_seconds
+        )
+    return _limiter
@@ -0,0 +1,111 @@
+"""
+LLM Response Cache
+Content-addressed cache of document extraction completions in the
+llm_response_cache table: re-uploading the same document replays the stored
+reply and tool calls instead of calling OpenAI again
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from sqlalchemy import select, delete, update
+from sqlalchemy.exc import IntegrityError
+from database import AsyncSessionLocal
+from models import LLMResponseCache
+from compression import encode_json
+from config import get_settings
+
+settings = get_settings()
+
+# Per worker process counters (entries themselves are shared through the table)
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+
+def response_cache_key(model: str, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]]) -> str:
+    """SHA-256 of everything that determines the completion: model, prompt, tool schemas and input"""
+    return hashlib.sha256(encode_json({"model": model, "messages": messages, "tools": tools})).hexdigest()
+
+
+async def get_cached_response(cache_key: str) -> Optional[Dict[str, Any]]:
+    """
+    Stored {"message": ..., "tool_calls": [...]} for cache_key, or None
+
+    Expired entries count as misses. Uses its own db session, so lookups are
+    never part of the caller's transaction.
+    """
+    if not settings.llm_cache_enabled:
+        return None
+
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(LLMResponseCache.response).where(
+                LLMResponseCache.cache_key == cache_key,
+                LLMResponseCache.created_at >= now - timedelta(seconds=settings.llm_cache_ttl_seconds)
+            )
+        )
+        response = result.scalar_one_or_none()
+        if response is None:
+            _stats["misses"] += 1
+            return None
+
+        await db.execute(
+            update(LLMResponseCache).where(LLMResponseCache.cache_key == cache_key).values(
+                last_used_at=now,
+                hit_count=LLMResponseCache.hit_count + 1
+            )
+        )
+        await db.commit()
+
+    _stats["hits"] += 1
+    return json.loads(response)
+
+
+async def store_response(cache_key: str, model: str, response: Dict[str, Any]):
+    """Store a response, then evict expired and least recently used entries"""
+    if not settings.llm_cache_enabled:
+        return
+
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        # Replaces an expired entry with the same key
+        await db.execute(delete(LLMResponseCache).where(LLMResponseCache.cache_key == cache_key))
+        db.add(LLMResponseCache(
+            cache_key=cache_key,
+            model=model,
+            response=json.dumps(response, ensure_ascii=False),
+            created_at=now,
+            last_used_at=now
+        ))
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Another worker stored the same response first
+            await db.rollback()
+            return
+        _stats["stores"] += 1
+
+        expired = await db.execute(
+            delete(LLMResponseCache).where(
+                LLMResponseCache.created_at < now - timedelta(seconds=settings.llm_cache_ttl_seconds)
+            )
+        )
+        least_recent = select(LLMResponseCache.id).order_by(
+            LLMResponseCache.last_used_at.desc(), LLMResponseCache.id.desc()
+        ).offset(settings.llm_cache_max_entries)
+        evicted = await db.execute(
+            delete(LLMResponseCache).where(LLMResponseCache.id.in_(least_recent))
+        )
+        await db.commit()
+        _stats["evictions"] += expired.rowcount + evicted.rowcount
+
+
+def get_response_cache_stats() -> Dict[str, Any]:
+    """Get response cache hit/miss counts for this worker process"""
+    lookups = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "maxsize": settings.llm_cache_max_entries,
+        "hit_rate": _stats["hits"] / lookups if lookups else 0.0
+    }
@@ -0,0 +1,241 @@
+"""
+LLM Prompt and Tool Registry
+System prompts and tool (function) schemas are built once at import, so every
+request sends a byte-identical static prefix that providers can cache. Each tool
+is dispatched to an AIChatbotHandler method after its arguments are validated.
+"""
+
+import json
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+
+class ToolArgumentError(ValueError):
+    """Tool call arguments that cannot be applied"""
+
+
+@dataclass(frozen=True)
+class Tool:
+    """One tool the model can call"""
+    name: str
+    schema: Dict[str, Any]  # OpenAI tool definition
+    method: str  # AIChatbotHandler method the validated arguments are passed to
+    validate: Callable[[Any], Dict[str, Any]]
+
+
+def _to_string(value: Any) -> str:
+    if isinstance(value, (dict, list)):
+        raise ValueError("expected a string")
+    return str(value)
+
+
+def _to_integer(value: Any) -> int:
+    if isinstance(value, bool):
+        raise ValueError("expected an integer")
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError("expected an integer")
+    if isinstance(value, str):
+        value = value.replace(",", "").strip()
+    return int(value)
+
+
+def _to_boolean(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    raise ValueError("expected a boolean")
+
+
+_COERCERS = {"string": _to_string, "integer": _to_integer, "boolean": _to_boolean}
+
+
+def _compile_validator(name: str, parameters: Dict[str, Any]) -> Callable[[Any], Dict[str, Any]]:
+    """
+    Build the argument validator for a tool's JSON schema
+
+    Unknown keys and nulls are dropped, values are coerced to the schema type
+    (a value that cannot be is dropped), and missing required keys raise
+    ToolArgumentError.
+    """
+    coercers = {key: _COERCERS[spec["type"]] for key, spec in parameters["properties"].items()}
+    required = tuple(parameters.get("required", ()))
+
+    def validate(arguments: Any) -> Dict[str, Any]:
+        if not isinstance(arguments, dict):
+            raise ToolArgumentError(f"{name}: arguments must be an object")
+
+        validated = {}
+        for key, value in arguments.items():
+            coerce = coercers.get(key)
+            if coerce is None or value is None:
+                continue
+            try:
+                validated[key] = coerce(value)
+            except (TypeError, ValueError):
+                print(f"Dropping invalid {name} argument {key}={value!r}")
+
+        missing = [key for key in required if validated.get(key) in (None, "")]
+        if missing:
+            raise ToolArgumentError(f"{name}: missing {', '.join(missing)}")
+        return validated
+
+    return validate
+
+
+def _tool(name: str, description: str, properties: Dict[str, Any], method: str, required: Optional[List[str]] = None) -> Tool:
+    parameters = {"type": "object", "properties": properties}
+    if required:
+        parameters["required"] = required
+    schema = {
+        "type": "function",
+        "function": {"name": name, "description": description, "parameters": parameters}
+    }
+    return Tool(name=name, schema=schema, method=method, validate=_compile_validator(name, parameters))
+
+
+TOOLS: Dict[str, Tool] = {tool.name: tool for tool in [
+    _tool(
+        "update_company_data",
+        "更新公司資料。從使用者的訊息中提取產業別、資本總額、專利數量、公司認證數量、ESG認證等資訊並更新。",
+        {
+            "industry": {"type": "string", "description": "產業別"},
+            "capital_amount": {"type": "integer", "description": "資本總額（以臺幣為單位）"},
+            "invention_patent_count": {"type": "integer", "description": "發明專利數量"},
+            "utility_patent_count": {"type": "integer", "description": "新型專利數量"},
+            "certification_count": {"type": "integer", "description": "公司認證資料數量（不包括ESG認證）"},
+            "esg_certification_count": {"type": "integer", "description": "ESG相關認證資料數量"},
+            "esg_certification": {"type": "string", "description": "ESG相關認證資料列表（例如：ISO 14064, ISO 14067, ISO 14046）"}
+        },
+        method="update_onboarding_data"
+    ),
+    _tool(
+        "add_product",
+        "新增產品資訊",
+        {
+            "product_id": {"type": "string", "description": "產品ID"},
+            "product_name": {"type": "string", "description": "產品名稱"},
+            "price": {"type": "string", "description": "價格"},
+            "main_raw_materials": {"type": "string", "description": "主要原料"},
+            "product_standard": {"type": "string", "description": "產品規格"},
+            "technical_advantages": {"type": "string", "description": "技術優勢"}
+        },
+        method="add_product",
+        required=["product_name"]
+    ),
+    _tool(
+        "mark_completed",
+        "當使用者表示已完成所有資料輸入時調用此函數",
+        {"completed": {"type": "boolean", "description": "是否完成"}},
+        method="mark_completed",
+        required=["completed"]
+    ),
+]}
+
+# Tool lists sent with each kind of request (same objects every call, so identical bytes)
+CHAT_TOOLS = [TOOLS[name].schema for name in ("update_company_data", "add_product", "mark_completed")]
+DOCUMENT_TOOLS = [TOOLS[name].schema for name in ("update_company_data", "add_product")]
+
+
+CHAT_SYSTEM_PROMPT = """你是一個專業的企業資料收集助理。你的任務是：
+
+1. 用友善、專業的態度與使用者對話
+2. **一次只詢問一個欄位**，按照以下順序收集資訊：
+   - 產業別（如：食品業、鋼鐵業、電子業等）
+   - 資本總額（以臺幣為單位）
+   - 發明專利數量（⚠️ 特別注意：發明專利和新型專利要分開詢問，避免混淆）
+   - 新型專利數量（⚠️ 特別注意：發明專利和新型專利要分開詢問，避免混淆）
+   - 公司認證資料數量（⚠️ 不包括ESG認證，ESG認證會分開詢問）
+   - ESG相關認證資料（請使用者列出所有ESG認證，例如：ISO 14064, ISO 14067）
+
+3. 收集產品資訊（可以有多個產品）：
+   - 產品ID（⚠️ 必須是唯一的，例如：PROD001、PROD002）
+   - 產品名稱
+   - 價格
+   - 主要原料
+   - 產品規格（尺寸、精度）
+   - 技術優勢
+
+重要提示：
+- **一次詢問一個欄位**，等待使用者回答後再詢問下一個
+- **如果使用者主動提供多個資訊**，全部提取並記錄，然後詢問下一個未填寫的欄位（不要重複詢問已提供的）
+- **發明專利和新型專利必須分開詢問**，避免使用者混淆這兩種專利類型
+- 保持對話自然流暢，按順序逐個收集資料
+- 你的責任範圍僅限於上述資料的收集
+
+🏆 **ESG認證 vs 公司認證的區分**：
+
+**ESG相關認證（環境、社會、治理）：**
+- ISO 14064（溫室氣體盤查）
+- ISO 14067（碳足跡）
+- ISO 14046（水足跡）
+- GRI Standards（永續報告）
+- ISSB / IFRS S1、S2（永續揭露）
+
+**公司認證（依產業分類）：**
+- 食品/農產/餐飲：HACCP, ISO 22000, FSSC 22000, GMP
+- 汽車零組件：IATF 16949, ISO 9001, ISO 14001
+- 電子/半導體：ISO 9001, ISO 14001, ISO 45001, IECQ QC 080000, RoHS, REACH
+- 一般製造業：ISO 9001, ISO 14001, ISO 45001
+- 生技/醫療：ISO 13485
+- 化工/材料：ISO 9001, ISO 14001, ISO 45001, ISO 50001
+- 物流/倉儲：ISO 9001, ISO 22000/HACCP, GDP, ISO 28000
+- 資訊服務：ISO 27001, ISO 27701, ISO 9001
+
+**詢問方式：**
+1. 先問「公司認證資料數量」（不包括ESG）
+2. 再問「請列出所有ESG相關認證」（例如：ISO 14064, ISO 14067）
+3. 幫助使用者分辨：如果使用者混淆，主動提醒哪些屬於ESG，哪些屬於公司認證
+
+🔄 **更新現有資料**：
+- 如果使用者說要「修改」、「更新」或「更正」某個資料，直接使用 update_company_data 函數更新
+- 使用者可以隨時修改已填寫的任何欄位
+- 更新後要確認：「已更新 [欄位名稱] 為 [新值]」
+
+📝 **產品ID指引**：
+- 收集產品資訊時，先詢問「請提供產品ID（例如：PROD001、SKU-001等）」
+- 強調產品ID必須是唯一的識別碼
+- 如果使用者不清楚，建議格式：「PROD001」、「PROD002」等
+
+📎 **文件上傳功能**：
+- 系統支援文件上傳功能（PDF、Word、圖片、TXT），可自動提取公司資料
+- 當使用者詢問是否能上傳文件時，告訴他們**可以上傳**，並鼓勵使用此功能
+- 文件會由系統自動處理，提取後的資料會自動填入相應欄位
+- 如果使用者想要上傳文件，請引導他們使用上傳功能來快速完成資料收集"""
+
+DOCUMENT_EXTRACTION_PROMPT = """你是一個資料提取專家。從提供的文件內容中提取以下公司資訊（如果存在）：
+- 產業別
+- 資本總額（以臺幣為單位）
+- 發明專利數量
+- 新型專利數量
+- 公司認證資料數量（不包括ESG認證）
+- ESG相關認證（數量與列表）
+- 產品資訊（產品ID、名稱、價格、原料、規格、技術優勢）
+
+以友善的方式總結找到的資訊，並告訴使用者已自動填入這些資料。
+如果某些資訊未找到，禮貌地告知使用者可以稍後補充。"""
+
+
+def parse_tool_call(name: str, raw_arguments: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Turn a model tool call into {"name": ..., "arguments": ...} with validated arguments
+
+    Returns None (and logs why) for unknown tools and unparseable or invalid arguments.
+    """
+    tool = TOOLS.get(name)
+    if tool is None:
+        print(f"Ignoring unknown tool call: {name}")
+        return None
+
+    try:
+        arguments = tool.validate(json.loads(raw_arguments or "{}"))
+    except (json.JSONDecodeError, ToolArgumentError) as e:
+        print(f"Invalid tool call arguments for {name}: {e}")
+        return None
+
+    return {"name": name, "arguments": arguments}
+
+
+async def dispatch_tool_call(handler, call: Dict[str, Any]) -> Any:
+    """Apply a parsed tool call through its handler method and return the method's result"""
+    return await getattr(handler, TOOLS[call["name"]].method)(call["arguments"])
@@ -1,35 +1,43 @@
-from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile, Form
+from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile, Form, Header, Query, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List, Optional
-from datetime import datetime
-
-from database import get_db, engine, Base
-from models import User, ChatSession, ChatMessage, CompanyOnboarding, Product, ChatSessionStatus
+from fastapi.responses import StreamingResponse, JSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional, Dict, Any, AsyncIterator
+from contextlib import nullcontext
+import asyncio
+import json
+import time
+
+from database import get_async_db, AsyncSessionLocal, SessionLocal, engine, Base
+from models import User, ChatSession, ChatMessage, CompanyOnboarding, Product, ChatSessionStatus, ExtractionJob
 from schemas import (
     UserResponse,
-    ChatMessageCreate, ChatResponse, ChatSessionResponse, ChatMessageResponse,
-    OnboardingDataResponse
+    ChatMessageCreate, ChatResponse,
+    ChatSessionPage, ChatMessagePage, OnboardingDataResponse
 )
 from config import get_settings
-from auth import get_current_active_user
+from auth import (
+    get_current_active_user, get_current_active_principal, Principal, authenticate_token, decode_external_jwt, require_admin,
+    get_jwt_cache_stats, get_user_cache_stats, invalidate_user_cache
+)
 from chatbot_handler import ChatbotHandler
 from ai_chatbot_handler import AIChatbotHandler
-from file_processor import FileProcessor
+from file_processor import FileProcessor, shutdown_extraction_pool
+from extraction_jobs import enqueue_extraction_job, cancel_running_jobs, fail_interrupted_jobs, fail_if_stale
+from conversation_summary import schedule_summary_refresh, cancel_running_summaries
+from session_cache import get_session_cache_stats
+from chat_archive import load_session_messages
+from llm_limiter import get_llm_limiter, LLMOverloadedError, llm_overloaded_handler
+from llm_response_cache import get_response_cache_stats
+from llm_context import get_token_usage_stats
+from chat_router import get_router_stats
+from session_locks import session_turn_lock
+from pagination import keyset_page, page_loaded_rows, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from idempotency import get_idempotency_store, request_fingerprint, IDEMPOTENCY_HEADER, REPLAYED_HEADER
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
-
-# Debug: Print configuration on startup
 settings = get_settings()
-print("=" * 60)
-print("🔧 Backend Configuration:")
-print(f"   Database: {settings.database_url[:30]}...")
-print(f"   API Host: {settings.api_host}")
-print(f"   API Port: {settings.api_port}")
-print(f"   External JWT Secret: {settings.external_jwt_secret[:20]}... (length: {len(settings.external_jwt_secret)})")
-print(f"   AI Chatbot: {'Enabled' if settings.use_ai_chatbot else 'Disabled'}")
-print("=" * 60)
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -48,6 +56,42 @@ app.add_middleware(
 )
 
 
+app.add_exception_handler(LLMOverloadedError, llm_overloaded_handler)
+
+
+# Startup work lives in hooks, not at import time: spawned file worker processes
+# re-import this module as __mp_main__ and must not connect to the database
+@app.on_event("startup")
+async def create_tables():
+    """Print the configuration and create database tables"""
+    # Debug: Print configuration on startup
+    print("=" * 60)
+    print("🔧 Backend Configuration:")
+    print(f"   Database: {settings.database_url[:30]}...")
+    print(f"   API Host: {settings.api_host}")
+    print(f"   API Port: {settings.api_port}")
+    print(f"   External JWT Secret: {settings.external_jwt_secret[:20]}... (length: {len(settings.external_jwt_secret)})")
+    print(f"   AI Chatbot: {'Enabled' if settings.use_ai_chatbot else 'Disabled'}")
+    print("=" * 60)
+
+    # Create database tables
+    await run_in_threadpool(Base.metadata.create_all, bind=engine)
+
+
+@app.on_event("startup")
+async def recover_extraction_jobs():
+    """Fail extraction jobs that a previous process left unfinished"""
+    await fail_interrupted_jobs()
+
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    """Stop background jobs and worker processes"""
+    await cancel_running_jobs()
+    await cancel_running_summaries()
+    shutdown_extraction_pool()
+
+
 # ============== Health Check ==============
 
 @app.get("/")
@@ -80,60 +124,128 @@ async def get_current_user_info(
 
 # ============== Chatbot Endpoints ==============
 
-@app.post("/api/chatbot/message", response_model=ChatResponse)
-async def send_chatbot_message(
-    chat_data: ChatMessageCreate,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
-):
-    """
-    Send a message to the onboarding chatbot
+def get_welcome_message(use_ai: bool) -> str:
+    """Get the welcome message sent when a new chat session is started"""
+    if use_ai:
+        return (
+            "您好！我是企業導入 AI 助理 🤖\n\n"
+            "我將用智能對話的方式協助您建立公司資料。您可以用自然的方式告訴我：\n"
+            "• 產業別\n"
+            "• 資本總額與專利數量\n"
+            "• 認證資料（包括ESG認證）\n"
+            "• 產品資訊\n\n"
+            "您可以一次提供多個資訊，我會自動理解並記錄。\n"
+            "讓我們開始吧！請告訴我您的公司資料。"
+        )
 
-    - **message**: User's message to the chatbot
-    - **session_id**: Optional session ID to continue an existing conversation
+    return (
+        "您好！我是企業導入助理 👋\n\n"
+        "我將協助您建立公司資料。我會逐步引導您輸入以下資訊：\n"
+        "• 產業別\n"
+        "• 資本總額與專利數量\n"
+        "• 認證資料（包括ESG認證）\n"
+        "• 產品資訊\n\n"
+        "讓我們開始吧！請問您的公司所屬產業別是什麼？（例如：食品業、鋼鐵業、電子業等）"
+    )
 
-    Requires: Authentication
-    Returns: Chatbot response with session information
+
+def format_sse(event: str, data: dict) -> str:
+    """Format a Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_chat_turn(handler, user_message: str, use_ai: bool) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run one chat turn on an existing session, yielding events as the reply is produced
+
+    Yields token/error events, then a final done event with the ChatResponse fields.
+    Used by the SSE and WebSocket endpoints.
     """
+    # The turn commits once, before the done event; a failure rolls back the user message too
+    async with handler.turn():
+        # Save user message
+        await handler.add_message("user", user_message)
+
+        if use_ai:
+            bot_response, is_completed = "", False
+            async for event in handler.stream_message(user_message):
+                if event["type"] == "done":
+                    bot_response, is_completed = event["message"], event["completed"]
+                else:
+                    yield event
+        else:
+            bot_response, is_completed = await handler.process_message(user_message)
+            yield {"type": "token", "content": bot_response}
+
+        # Save bot response
+        await handler.add_message("assistant", bot_response)
+
+    if use_ai:
+        schedule_summary_refresh(handler.session)
+
+    response = ChatResponse(
+        session_id=handler.session.id,
+        message=bot_response,
+        completed=is_completed,
+        progress=handler.get_progress()
+    )
+    yield {"type": "done", **response.model_dump()}
+
+
+# WebSocket clients authenticate with their first frame, within this many seconds
+WS_AUTH_TIMEOUT_SECONDS = 10.0
+# Close code for a missing, invalid or expired token (4000-4999 are application codes)
+WS_CLOSE_UNAUTHORIZED = 4401
+
+
+def authenticate_websocket_token(token: str) -> tuple[User, Optional[float]]:
+    """Authenticate a WebSocket connection's token (runs in the threadpool); returns (user, exp)"""
+    exp = decode_external_jwt(token).get("exp")
+    db = SessionLocal()
     try:
+        user = authenticate_token(db, token)
+        if not user.is_active:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="User account is inactive"
+            )
+        return user, exp if isinstance(exp, (int, float)) else None
+    finally:
+        db.close()
+
+
+def parse_websocket_frame(frame: str) -> Dict[str, Any]:
+    """Decode a client frame; anything but a JSON object is treated as empty"""
+    try:
+        data = json.loads(frame)
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+async def run_chat_message(db: AsyncSession, user_id: int, chat_data: ChatMessageCreate) -> ChatResponse:
+    """Run one chatbot turn for POST /api/chatbot/message"""
+    # Turns on the same session run one at a time; a new session has nothing to race with
+    turn_lock = session_turn_lock(chat_data.session_id) if chat_data.session_id else nullcontext()
+
+    async with turn_lock:
         # Choose handler based on configuration
         settings = get_settings()
         use_ai = settings.use_ai_chatbot and settings.openai_api_key
 
         # Initialize appropriate chatbot handler
         if use_ai:
-            handler = AIChatbotHandler(db, current_user.id, chat_data.session_id)
-            ai_mode = " 🤖 (AI模式)"
+            handler = AIChatbotHandler(db, user_id, chat_data.session_id)
         else:
-            handler = ChatbotHandler(db, current_user.id, chat_data.session_id)
-            ai_mode = ""
+            handler = ChatbotHandler(db, user_id, chat_data.session_id)
+        await handler.load_session(restore_archived=True)
 
         # Create new session if needed
         if not handler.session:
-            session = handler.create_session()
-            # Send welcome message
-            if use_ai:
-                welcome_message = (
-                    "您好！我是企業導入 AI 助理 🤖\n\n"
-                    "我將用智能對話的方式協助您建立公司資料。您可以用自然的方式告訴我：\n"
-                    "• 產業別\n"
-                    "• 資本總額與專利數量\n"
-                    "• 認證資料（包括ESG認證）\n"
-                    "• 產品資訊\n\n"
-                    "您可以一次提供多個資訊，我會自動理解並記錄。\n"
-                    "讓我們開始吧！請告訴我您的公司資料。"
-                )
-            else:
-                welcome_message = (
-                    "您好！我是企業導入助理 👋\n\n"
-                    "我將協助您建立公司資料。我會逐步引導您輸入以下資訊：\n"
-                    "• 產業別\n"
-                    "• 資本總額與專利數量\n"
-                    "• 認證資料（包括ESG認證）\n"
-                    "• 產品資訊\n\n"
-                    "讓我們開始吧！請問您的公司所屬產業別是什麼？（例如：食品業、鋼鐵業、電子業等）"
-                )
-            handler.add_message("assistant", welcome_message)
+            async with handler.turn():
+                session = await handler.create_session()
+                # Send welcome message
+                welcome_message = get_welcome_message(use_ai)
+                await handler.add_message("assistant", welcome_message)
 
             return ChatResponse(
                 session_id=session.id,
@@ -142,14 +254,19 @@ async def send_chatbot_message(
                 progress=handler.get_progress()
             )
 
-        # Save user message
-        handler.add_message("user", chat_data.message)
+        # One transaction for the whole turn: a failure (or a busy LLM) leaves nothing behind
+        async with handler.turn():
+            # Save user message
+            await handler.add_message("user", chat_data.message)
 
-        # Process message and get response
-        bot_response, is_completed = handler.process_message(chat_data.message)
+            # Process message and get response
+            bot_response, is_completed = await handler.process_message(chat_data.message)
 
-        # Save bot response
-        handler.add_message("assistant", bot_response)
+            # Save bot response
+            await handler.add_message("assistant", bot_response)
+
+        if use_ai:
+            schedule_summary_refresh(handler.session)
 
         return ChatResponse(
             session_id=handler.session.id,
@@ -158,28 +275,260 @@ async def send_chatbot_message(
             progress=handler.get_progress()
         )
 
+
+@app.post("/api/chatbot/message", response_model=ChatResponse)
+async def send_chatbot_message(
+    chat_data: ChatMessageCreate,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER, max_length=255)
+):
+    """
+    Send a message to the onboarding chatbot
+
+    - **message**: User's message to the chatbot
+    - **session_id**: Optional session ID to continue an existing conversation
+    - **Idempotency-Key** header: Optional; a repeated request with the same key gets
+      the first response back (header `Idempotent-Replayed: true`) instead of a new turn
+
+    Requires: Authentication
+    Returns: Chatbot response with session information
+    """
+    try:
+        if not idempotency_key:
+            return await run_chat_message(db, current_user.id, chat_data)
+
+        body, replayed = await get_idempotency_store().run(
+            (current_user.id, "chatbot_message", idempotency_key),
+            request_fingerprint(chat_data.message, chat_data.session_id),
+            lambda: run_chat_message(db, current_user.id, chat_data)
+        )
+        return JSONResponse(body, headers={REPLAYED_HEADER: "true" if replayed else "false"})
+
+    except (HTTPException, LLMOverloadedError):
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An error occurred while processing your message: {str(e)}"
+        )
+
+
+@app.post("/api/chatbot/message/stream")
+async def stream_chatbot_message(
+    chat_data: ChatMessageCreate,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Send a message to the onboarding chatbot and stream the reply (Server-Sent Events)
+
+    - **message**: User's message to the chatbot
+    - **session_id**: Optional session ID to continue an existing conversation
+
+    Events:
+    - **token**: `{"content": "..."}` - part of the assistant reply, sent as it is generated
+    - **error**: `{"message": "..."}` - the AI call failed
+    - **done**: ChatResponse fields - sent last, after tool calls are applied and saved
+
+    Requires: Authentication
+    """
+    settings = get_settings()
+    use_ai = settings.use_ai_chatbot and settings.openai_api_key
+
+    # Fail fast before the stream starts if the LLM queue is already full
+    if use_ai:
+        get_llm_limiter().check_admission()
+
+    # The session outlives this function, so it is managed here rather than by Depends
+    db = AsyncSessionLocal()
+    try:
+        if use_ai:
+            handler = AIChatbotHandler(db, current_user.id, chat_data.session_id)
+        else:
+            handler = ChatbotHandler(db, current_user.id, chat_data.session_id)
+        # Existence check only: an archived session is restored under the turn lock below
+        await handler.load_session()
+
+        welcome_message = None
+        if not handler.session:
+            async with handler.turn():
+                await handler.create_session()
+                welcome_message = get_welcome_message(use_ai)
+                await handler.add_message("assistant", welcome_message)
+        # The turn may wait for the session lock: don't hold the load's read transaction meanwhile
+        await db.commit()
     except Exception as e:
+        await db.close()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An error occurred while processing your message: {str(e)}"
         )
 
+    async def event_stream():
+        try:
+            if welcome_message is not None:
+                yield format_sse("token", {"content": welcome_message})
+                response = ChatResponse(
+                    session_id=handler.session.id,
+                    message=welcome_message,
+                    completed=False,
+                    progress=handler.get_progress()
+                )
+                yield format_sse("done", response.model_dump())
+                return
+
+            async with session_turn_lock(handler.session.id):
+                # Reload under the lock: a turn that finished while we waited may have changed the data
+                await handler.load_session(restore_archived=True)
+                async for event in stream_chat_turn(handler, chat_data.message, use_ai):
+                    event_type = event.pop("type")
+                    yield format_sse(event_type, event)
+        except LLMOverloadedError as e:
+            yield format_sse("error", {"message": f"AI service is busy: {e.reason}", "retry_after": e.retry_after})
+        except Exception as e:
+            print(f"Error while streaming chatbot reply: {e}")
+            yield format_sse("error", {"message": f"An error occurred while processing your message: {str(e)}"})
+        finally:
+            await db.close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.websocket("/ws/chatbot/{session_id}")
+async def chatbot_websocket(websocket: WebSocket, session_id: int):
+    """
+    WebSocket chat channel for an existing chat session
+
+    The first frame must carry the JWT (`{"type": "auth", "token": "..."}`), so the
+    token never appears in a URL or access log. The chatbot handler stays open for
+    the lifetime of the connection. Each turn reloads the session state from the
+    session state cache (no SQL when warm), so it sees changes made by other
+    requests, such as a finished upload, while only costing the LLM call and the
+    writes. The token's exp is checked before every turn: once it has passed the
+    connection is closed with code 4401, unless the client sent a fresh token first.
+
+    Client frames:
+    - `{"type": "auth", "token": "..."}` - first frame; may be sent again to replace an expiring token
+    - `{"message": "..."}` - one chat turn
+    Server frames:
+    - `{"type": "ready", "session_id": ..., "progress": {...}}` - sent once after connecting
+    - `{"type": "token", "content": "..."}` - part of the assistant reply
+    - `{"type": "error", "message": "..."}` - the turn failed or the frame was invalid
+    - `{"type": "done", ...ChatResponse fields}` - sent last for each turn
+    """
+    await websocket.accept()
+    try:
+        auth_frame = parse_websocket_frame(
+            await asyncio.wait_for(websocket.receive_text(), timeout=WS_AUTH_TIMEOUT_SECONDS)
+        )
+        if auth_frame.get("type") != "auth" or not auth_frame.get("token"):
+            await websocket.close(code=WS_CLOSE_UNAUTHORIZED, reason="First frame must be {\"type\": \"auth\", \"token\": ...}")
+            return
+        current_user, token_exp = await run_in_threadpool(authenticate_websocket_token, str(auth_frame["token"]))
+    except asyncio.TimeoutError:
+        await websocket.close(code=WS_CLOSE_UNAUTHORIZED, reason="Authentication timed out")
+        return
+    except HTTPException as e:
+        await websocket.close(code=WS_CLOSE_UNAUTHORIZED, reason=e.detail)
+        return
+    except WebSocketDisconnect:
+        return
+
+    settings = get_settings()
+    use_ai = settings.use_ai_chatbot and settings.openai_api_key
+
+    async with AsyncSessionLocal() as db:
+        if use_ai:
+            handler = AIChatbotHandler(db, current_user.id, session_id)
+        else:
+            handler = ChatbotHandler(db, current_user.id, session_id)
+        # Existence check only: an archived session is restored under the turn lock of its first turn
+        await handler.load_session()
+
+        if not handler.session:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Chat session not found")
+            return
 
-@app.post("/api/chatbot/upload-file")
+        # An idle socket must not pin a pooled connection: end the load's read transaction
+        await db.commit()
+
+        await websocket.send_json({
+            "type": "ready",
+            "session_id": handler.session.id,
+            "progress": handler.get_progress()
+        })
+
+        try:
+            while True:
+                frame = parse_websocket_frame(await websocket.receive_text())
+
+                if frame.get("type") == "auth":
+                    # A refreshed token keeps the connection open past the old one's exp
+                    try:
+                        user, exp = await run_in_threadpool(authenticate_websocket_token, str(frame.get("token") or ""))
+                    except HTTPException as e:
+                        await websocket.close(code=WS_CLOSE_UNAUTHORIZED, reason=e.detail)
+                        return
+                    if user.id != current_user.id:
+                        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Token belongs to another user")
+                        return
+                    token_exp = exp
+                    continue
+
+                if token_exp is not None and time.time() >= token_exp:
+                    await websocket.close(code=WS_CLOSE_UNAUTHORIZED, reason="Token has expired")
+                    return
+
+                message = str(frame.get("message") or "").strip()
+                if not message:
+                    await websocket.send_json({"type": "error", "message": "Frame must be JSON with a non-empty \"message\""})
+                    continue
+
+                try:
+                    async with session_turn_lock(session_id):
+                        await handler.load_session(restore_archived=True)
+                        async for event in stream_chat_turn(handler, message, use_ai):
+                            await websocket.send_json(event)
+                except WebSocketDisconnect:
+                    raise
+                except LLMOverloadedError as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": f"AI service is busy: {e.reason}",
+                        "retry_after": e.retry_after
+                    })
+                except Exception as e:
+                    print(f"Error while processing WebSocket chat turn: {e}")
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": f"An error occurred while processing your message: {str(e)}"
+                    })
+        except WebSocketDisconnect:
+            pass
+
+
+@app.post("/api/chatbot/upload-file", status_code=status.HTTP_202_ACCEPTED)
 async def upload_file_for_extraction(
     file: UploadFile = File(...),
     session_id: Optional[int] = Form(None),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER, max_length=255)
 ):
     """
-    Upload a file (PDF, DOCX, Image) and extract company information using AI
+    Upload a file (PDF, DOCX, Image) and queue it for AI extraction of company information
 
     - **file**: File to upload (PDF, DOCX, JPG, PNG, TXT)
     - **session_id**: Optional session ID to add extracted data to existing session
+    - **Idempotency-Key** header: Optional; a repeated upload with the same key returns
+      the original job instead of queueing a new one
 
     Requires: Authentication
-    Returns: Extracted text and AI-processed company information
+    Returns: Job ID immediately; poll GET /api/chatbot/jobs/{job_id} for status and results
 
     Supported file types:
     - PDF documents (.pdf)
@@ -193,147 +542,62 @@ async def upload_file_for_extraction(
         # Read file content
         file_content = await file.read()
 
-        # Initialize file processor
-        processor = FileProcessor()
+        async def queue_upload() -> Dict[str, Any]:
+            nonlocal session_id
 
-        # Check file type
-        content_type = file.content_type
-        if not processor.is_supported(content_type):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Unsupported file type: {content_type}. Supported: PDF, DOCX, JPG, PNG, TXT"
-            )
+            # Initialize file processor
+            processor = FileProcessor()
 
-        # Process file and extract text
-        result = processor.process_file(file_content, file.filename, content_type)
+            # Check file type and size before queueing
+            content_type = file.content_type
+            if not processor.is_supported(content_type):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Unsupported file type: {content_type}. Supported: PDF, DOCX, JPG, PNG, TXT"
+                )
 
-        if not result["success"]:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=result["error"]
-            )
+            if len(file_content) > processor.MAX_FILE_SIZE:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"File too large. Maximum size: {processor.MAX_FILE_SIZE / 1024 / 1024}MB"
+                )
 
-        extracted_text = result["extracted_text"]
+            # Resolve the chat session the extracted data will be applied to
+            settings = get_settings()
+            if settings.use_ai_chatbot and settings.openai_api_key:
+                handler = AIChatbotHandler(db, current_user.id, session_id)
+                await handler.load_session()
+
+                # Create session if needed
+                if not handler.session:
+                    await handler.create_session()
+                session_id = handler.session.id
+
+            job = await enqueue_extraction_job(
+                db, current_user.id, session_id, file_content, file.filename, content_type
+            )
 
-        # Use AI to extract structured data from text
-        settings = get_settings()
-        if not settings.use_ai_chatbot or not settings.openai_api_key:
-            # Return raw extracted text if AI is not available
             return {
                 "success": True,
+                "job_id": job.id,
+                "status": job.status.value,
                 "filename": file.filename,
-                "extracted_text": extracted_text,
-                "message": "文件已成功處理。請將提取的文字發送給聊天機器人進行處理。",
-                "ai_available": False
+                "session_id": session_id
             }
 
-        # Initialize AI handler
-        handler = AIChatbotHandler(db, current_user.id, session_id)
+        if not idempotency_key:
+            return await queue_upload()
 
-        # Create session if needed
-        if not handler.session:
-            handler.create_session()
-            session_id = handler.session.id
-
-        # Use AI to extract structured company information
-        from openai import OpenAI
-        client = OpenAI(api_key=settings.openai_api_key)
-
-        ai_response = client.chat.completions.create(
-            model=settings.openai_model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": """你是一個資料提取專家。從提供的文件內容中提取以下公司資訊（如果存在）：
-                    - 產業別
-                    - 資本總額（以臺幣為單位）
-                    - 發明專利數量
-                    - 新型專利數量
-                    - 公司認證資料數量
-                    - ESG相關認證（是/否）
-                    - 產品資訊（產品ID、名稱、價格、原料、規格、技術優勢）
-
-                    以友善的方式總結找到的資訊，並告訴使用者已自動填入這些資料。
-                    如果某些資訊未找到，禮貌地告知使用者可以稍後補充。"""
-                },
-                {
-                    "role": "user",
-                    "content": f"從以下文件內容中提取公司資訊：\n\n{extracted_text[:4000]}"  # Limit to 4000 chars
-                }
-            ],
-            tools=[
-                {
-                    "type": "function",
-                    "function": {
-                        "name": "update_company_data",
-                        "description": "更新公司資料",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "industry": {"type": "string"},
-                                "capital_amount": {"type": "integer"},
-                                "invention_patent_count": {"type": "integer"},
-                                "utility_patent_count": {"type": "integer"},
-                                "certification_count": {"type": "integer"},
-                                "esg_certification": {"type": "boolean"}
-                            }
-                        }
-                    }
-                },
-                {
-                    "type": "function",
-                    "function": {
-                        "name": "add_product",
-                        "description": "新增產品資訊",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "product_id": {"type": "string"},
-                                "product_name": {"type": "string"},
-                                "price": {"type": "string"},
-                                "main_raw_materials": {"type": "string"},
-                                "product_standard": {"type": "string"},
-                                "technical_advantages": {"type": "string"}
-                            },
-                            "required": ["product_name"]
-                        }
-                    }
-                }
-            ],
-            tool_choice="auto"
+        body, replayed = await get_idempotency_store().run(
+            (current_user.id, "chatbot_upload_file", idempotency_key),
+            request_fingerprint(file_content, file.filename, file.content_type, session_id),
+            queue_upload
+        )
+        return JSONResponse(
+            body,
+            status_code=status.HTTP_202_ACCEPTED,
+            headers={REPLAYED_HEADER: "true" if replayed else "false"}
         )
-
-        # Process AI response and update database
-        ai_message = ai_response.choices[0].message.content or "已處理文件並提取資訊。"
-        data_updated = False
-        products_added = 0
-
-        if ai_response.choices[0].message.tool_calls:
-            import json
-            for tool_call in ai_response.choices[0].message.tool_calls:
-                function_name = tool_call.function.name
-                function_args = json.loads(tool_call.function.arguments)
-
-                if function_name == "update_company_data":
-                    if handler.update_onboarding_data(function_args):
-                        data_updated = True
-                elif function_name == "add_product":
-                    if handler.add_product(function_args):
-                        products_added += 1
-
-        # Save the AI message to conversation history
-        handler.add_message("assistant", f"📄 已處理文件：{file.filename}\n\n{ai_message}")
-
-        return {
-            "success": True,
-            "filename": file.filename,
-            "session_id": session_id,
-            "message": ai_message,
-            "extracted_text_length": len(extracted_text),
-            "data_updated": data_updated,
-            "products_added": products_added,
-            "progress": handler.get_progress()
-        }
 
     except HTTPException:
         raise
@@ -344,28 +608,73 @@ async def upload_file_for_extraction(
         )
 
 
-@app.get("/api/chatbot/sessions", response_model=List[ChatSessionResponse])
+@app.get("/api/chatbot/jobs/{job_id}")
+async def get_extraction_job(
+    job_id: int,
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Get the status of a document extraction job
+
+    - **job_id**: The ID returned by /api/chatbot/upload-file
+
+    Requires: Authentication
+    Authorization: Users can only view their own jobs
+    Returns: Job status (pending, running, succeeded, failed) and, once finished, the result or error
+    """
+    result = await db.execute(
+        select(ExtractionJob).where(
+            ExtractionJob.id == job_id,
+            ExtractionJob.user_id == current_user.id
+        )
+    )
+    job = result.scalar_one_or_none()
+
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Extraction job not found"
+        )
+
+    await fail_if_stale(db, job)
+    return job.to_dict()
+
+
+@app.get("/api/chatbot/sessions", response_model=ChatSessionPage)
 async def get_user_chat_sessions(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = Query(None, description="Cursor: sessions older than this"),
+    after: Optional[str] = Query(None, description="Cursor: sessions newer than this"),
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Get all chat sessions for the current user
+    Get the current user's chat sessions, newest first, one page at a time
+
+    - **limit**: Page size (default 50, max 200)
+    - **before** / **after**: Cursor from a previous page's `next_cursor`
 
     Requires: Authentication
-    Returns: List of user's chat sessions
+    Returns: Page of user's chat sessions with `next_cursor` (null on the last page)
     """
-    sessions = db.query(ChatSession).filter(
-        ChatSession.user_id == current_user.id
-    ).order_by(ChatSession.created_at.desc()).all()
+    sessions, next_cursor, has_more = await keyset_page(
+        db,
+        select(ChatSession).where(ChatSession.user_id == current_user.id),
+        ChatSession, limit, before=before, after=after, newest_first=True
+    )
 
-    return [session.to_dict() for session in sessions]
+    return {
+        "items": [session.to_dict() for session in sessions],
+        "next_cursor": next_cursor,
+        "has_more": has_more
+    }
 
 
 @app.get("/api/chatbot/sessions/latest")
 async def get_latest_active_session(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get the latest active chat session for the current user
@@ -377,10 +686,13 @@ async def get_latest_active_session(
     Returns: Latest active session or null if none exists
     """
     # Find the most recent active session
-    latest_session = db.query(ChatSession).filter(
-        ChatSession.user_id == current_user.id,
-        ChatSession.status == ChatSessionStatus.ACTIVE
-    ).order_by(ChatSession.created_at.desc()).first()
+    result = await db.execute(
+        select(ChatSession).where(
+            ChatSession.user_id == current_user.id,
+            ChatSession.status == ChatSessionStatus.ACTIVE
+        ).order_by(ChatSession.created_at.desc()).limit(1)
+    )
+    latest_session = result.scalars().first()
 
     if latest_session:
         return {
@@ -395,7 +707,7 @@ async def get_latest_active_session(
 @app.post("/api/chatbot/sessions/new")
 async def create_new_session_with_context(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Create a new chat session and copy company info from the latest session
@@ -408,10 +720,13 @@ async def create_new_session_with_context(
     Returns: New session ID with pre-populated company info
     """
     # Find the current company data (marked as is_current=True)
-    latest_company_data = db.query(CompanyOnboarding).filter(
-        CompanyOnboarding.user_id == current_user.id,
-        CompanyOnboarding.is_current == True
-    ).first()
+    result = await db.execute(
+        select(CompanyOnboarding).where(
+            CompanyOnboarding.user_id == current_user.id,
+            CompanyOnboarding.is_current == True
+        )
+    )
+    latest_company_data = result.scalars().first()
 
     # Choose handler based on configuration
     settings = get_settings()
@@ -423,47 +738,7 @@ async def create_new_session_with_context(
     else:
         handler = ChatbotHandler(db, current_user.id, None)
 
-    # Create new session
-    new_session = handler.create_session()
-
-    # If we found previous company data, copy it to the new session
-    if latest_company_data:
-        # Get the newly created onboarding data
-        new_onboarding = db.query(CompanyOnboarding).filter(
-            CompanyOnboarding.chat_session_id == new_session.id
-        ).first()
-
-        if new_onboarding:
-            # Copy chatbot collected fields from latest session
-            new_onboarding.industry = latest_company_data.industry
-            new_onboarding.capital_amount = latest_company_data.capital_amount
-            new_onboarding.invention_patent_count = latest_company_data.invention_patent_count
-            new_onboarding.utility_patent_count = latest_company_data.utility_patent_count
-            new_onboarding.certification_count = latest_company_data.certification_count
-            new_onboarding.esg_certification = latest_company_data.esg_certification
-
-            db.commit()
-
-            # Copy products
-            old_products = db.query(Product).filter(
-                Product.onboarding_id == latest_company_data.id
-            ).all()
-
-            for old_product in old_products:
-                new_product = Product(
-                    onboarding_id=new_onboarding.id,
-                    product_id=old_product.product_id,
-                    product_name=old_product.product_name,
-                    price=old_product.price,
-                    main_raw_materials=old_product.main_raw_materials,
-                    product_standard=old_product.product_standard,
-                    technical_advantages=old_product.technical_advantages
-                )
-                db.add(new_product)
-
-            db.commit()
-
-    # Send welcome message
+    # Welcome message
     if use_ai:
         if latest_company_data and latest_company_data.industry:
             welcome_message = (
@@ -498,7 +773,39 @@ async def create_new_session_with_context(
                 "（例如：食品業、鋼鐵業、電子業等）"
             )
 
-    handler.add_message("assistant", welcome_message)
+    # Session, copied company data and welcome message are committed together
+    async with handler.turn():
+        # Create new session
+        new_session = await handler.create_session()
+
+        # If we found previous company data, copy it to the new session
+        if latest_company_data:
+            # Get the newly created onboarding data
+            new_onboarding = handler.onboarding_data
+
+            if new_onboarding:
+                # Copy chatbot collected fields from latest session
+                new_onboarding.industry = latest_company_data.industry
+                new_onboarding.capital_amount = latest_company_data.capital_amount
+                new_onboarding.invention_patent_count = latest_company_data.invention_patent_count
+                new_onboarding.utility_patent_count = latest_company_data.utility_patent_count
+                new_onboarding.certification_count = latest_company_data.certification_count
+                new_onboarding.esg_certification = latest_company_data.esg_certification
+
+                # Copy products
+                for old_product in latest_company_data.products:
+                    new_product = Product(
+                        product_id=old_product.product_id,
+                        product_name=old_product.product_name,
+                        price=old_product.price,
+                        main_raw_materials=old_product.main_raw_materials,
+                        product_standard=old_product.product_standard,
+                        technical_advantages=old_product.technical_advantages
+                    )
+                    new_onboarding.products.append(new_product)
+
+        # Send welcome message
+        await handler.add_message("assistant", welcome_message)
 
     return {
         "session_id": new_session.id,
@@ -508,25 +815,36 @@ async def create_new_session_with_context(
     }
 
 
-@app.get("/api/chatbot/sessions/{session_id}/messages", response_model=List[ChatMessageResponse])
+@app.get("/api/chatbot/sessions/{session_id}/messages", response_model=ChatMessagePage)
 async def get_session_messages(
     session_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = Query(None, description="Cursor: messages older than this"),
+    after: Optional[str] = Query(None, description="Cursor: messages newer than this"),
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Get all messages for a specific chat session
+    Get messages for a specific chat session, oldest first, one page at a time
 
     - **session_id**: The ID of the chat session
+    - **limit**: Page size (default 50, max 200)
+    - **before** / **after**: Cursor from a previous page's `next_cursor`
+
+    Without a cursor the page holds the most recent messages; follow `next_cursor`
+    with `before` to load earlier ones.
 
     Requires: Authentication
     Authorization: Users can only view their own sessions
     """
     # Verify session belongs to user
-    session = db.query(ChatSession).filter(
-        ChatSession.id == session_id,
-        ChatSession.user_id == current_user.id
-    ).first()
+    result = await db.execute(
+        select(ChatSession).where(
+            ChatSession.id == session_id,
+            ChatSession.user_id == current_user.id
+        )
+    )
+    session = result.scalar_one_or_none()
 
     if not session:
         raise HTTPException(
@@ -534,18 +852,31 @@ async def get_session_messages(
             detail="Chat session not found"
         )
 
-    messages = db.query(ChatMessage).filter(
-        ChatMessage.session_id == session_id
-    ).order_by(ChatMessage.created_at).all()
+    if session.archived_at is not None:
+        # Archived transcripts are one compressed row; page them in memory
+        messages, next_cursor, has_more = page_loaded_rows(
+            await load_session_messages(db, session),
+            limit, before=before, after=after, newest_first=False
+        )
+    else:
+        messages, next_cursor, has_more = await keyset_page(
+            db,
+            select(ChatMessage).where(ChatMessage.session_id == session_id),
+            ChatMessage, limit, before=before, after=after, newest_first=False
+        )
 
-    return [msg.to_dict() for msg in messages]
+    return {
+        "items": [msg.to_dict() for msg in messages],
+        "next_cursor": next_cursor,
+        "has_more": has_more
+    }
 
 
 @app.get("/api/chatbot/data/{session_id}", response_model=OnboardingDataResponse)
 async def get_onboarding_data(
     session_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get the onboarding data collected in a chat session
@@ -556,10 +887,13 @@ async def get_onboarding_data(
     Authorization: Users can only view their own data
     """
     # Verify session belongs to user
-    session = db.query(ChatSession).filter(
-        ChatSession.id == session_id,
-        ChatSession.user_id == current_user.id
-    ).first()
+    result = await db.execute(
+        select(ChatSession).where(
+            ChatSession.id == session_id,
+            ChatSession.user_id == current_user.id
+        )
+    )
+    session = result.scalar_one_or_none()
 
     if not session:
         raise HTTPException(
@@ -567,9 +901,12 @@ async def get_onboarding_data(
             detail="Chat session not found"
         )
 
-    onboarding_data = db.query(CompanyOnboarding).filter(
-        CompanyOnboarding.chat_session_id == session_id
-    ).first()
+    result = await db.execute(
+        select(CompanyOnboarding).where(
+            CompanyOnboarding.chat_session_id == session_id
+        )
+    )
+    onboarding_data = result.scalar_one_or_none()
 
     if not onboarding_data:
         raise HTTPException(
@@ -582,8 +919,8 @@ async def get_onboarding_data(
 
 @app.get("/api/chatbot/data/current")
 async def get_current_company_data(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get the current (active) company onboarding data for the user
@@ -594,10 +931,13 @@ async def get_current_company_data(
     Requires: Authentication
     Returns: Current company data or null
     """
-    current_data = db.query(CompanyOnboarding).filter(
-        CompanyOnboarding.user_id == current_user.id,
-        CompanyOnboarding.is_current == True
-    ).first()
+    result = await db.execute(
+        select(CompanyOnboarding).where(
+            CompanyOnboarding.user_id == current_user.id,
+            CompanyOnboarding.is_current == True
+        )
+    )
+    current_data = result.scalars().first()
 
     if not current_data:
         return {"has_data": False, "data": None}
@@ -611,8 +951,8 @@ async def get_current_company_data(
 @app.get("/api/chatbot/export/{session_id}")
 async def export_onboarding_data(
     session_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Export onboarding data in the specified JSON format
@@ -624,10 +964,13 @@ async def export_onboarding_data(
     Returns: Data in the Chinese field name format
     """
     # Verify session belongs to user
-    session = db.query(ChatSession).filter(
-        ChatSession.id == session_id,
-        ChatSession.user_id == current_user.id
-    ).first()
+    result = await db.execute(
+        select(ChatSession).where(
+            ChatSession.id == session_id,
+            ChatSession.user_id == current_user.id
+        )
+    )
+    session = result.scalar_one_or_none()
 
     if not session:
         raise HTTPException(
@@ -635,9 +978,12 @@ async def export_onboarding_data(
             detail="Chat session not found"
         )
 
-    onboarding_data = db.query(CompanyOnboarding).filter(
-        CompanyOnboarding.chat_session_id == session_id
-    ).first()
+    result = await db.execute(
+        select(CompanyOnboarding).where(
+            CompanyOnboarding.chat_session_id == session_id
+        )
+    )
+    onboarding_data = result.scalar_one_or_none()
 
     if not onboarding_data:
         raise HTTPException(
@@ -651,8 +997,8 @@ async def export_onboarding_data(
 
 @app.get("/api/chatbot/export/all")
 async def export_all_onboarding_data(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db),
     include_history: bool = False
 ):
     """
@@ -666,16 +1012,22 @@ async def export_all_onboarding_data(
     """
     if include_history:
         # Get all completed sessions for user (historical data)
-        completed_sessions = db.query(ChatSession).filter(
-            ChatSession.user_id == current_user.id,
-            ChatSession.status == ChatSessionStatus.COMPLETED
-        ).all()
+        result = await db.execute(
+            select(ChatSession).where(
+                ChatSession.user_id == current_user.id,
+                ChatSession.status == ChatSessionStatus.COMPLETED
+            )
+        )
+        completed_sessions = result.scalars().all()
     else:
         # Get only current data
-        current_data = db.query(CompanyOnboarding).filter(
-            CompanyOnboarding.user_id == current_user.id,
-            CompanyOnboarding.is_current == True
-        ).first()
+        result = await db.execute(
+            select(CompanyOnboarding).where(
+                CompanyOnboarding.user_id == current_user.id,
+                CompanyOnboarding.is_current == True
+            )
+        )
+        current_data = result.scalars().first()
 
         if not current_data:
             return []
@@ -685,9 +1037,12 @@ async def export_all_onboarding_data(
     # Historical data export
     export_data = []
     for session in completed_sessions:
-        onboarding_data = db.query(CompanyOnboarding).filter(
-            CompanyOnboarding.chat_session_id == session.id
-        ).first()
+        result = await db.execute(
+            select(CompanyOnboarding).where(
+                CompanyOnboarding.chat_session_id == session.id
+            )
+        )
+        onboarding_data = result.scalar_one_or_none()
 
         if onboarding_data:
             export_data.append(onboarding_data.to_export_format())
@@ -695,6 +1050,84 @@ async def export_all_onboarding_data(
     return export_data
 
 
+# ============== Monitoring Endpoints ==============
+
+@app.get("/api/monitoring/llm")
+async def get_llm_stats(
+    current_user: User = Depends(require_admin)
+):
+    """
+    Get LLM admission control statistics for this worker process
+
+    Returns: In-flight calls, queue depth, admitted/rejected counts and wait times,
+    document extraction response cache hits/misses, estimated vs used tokens, and
+    chat turns answered by the rule router instead of the LLM
+
+    Requires: Admin
+    """
+    return {
+        **get_llm_limiter().get_stats(),
+        "response_cache": get_response_cache_stats(),
+        "token_usage": get_token_usage_stats(),
+        "router": get_router_stats()
+    }
+
+
+@app.get("/api/monitoring/auth")
+async def get_auth_cache_stats(
+    current_user: User = Depends(require_admin)
+):
+    """
+    Get authentication cache statistics for this worker process
+
+    Returns: Verified-JWT and user snapshot cache sizes, hits, misses and hit rates
+
+    Requires: Admin
+    """
+    return {"jwt_cache": get_jwt_cache_stats(), "user_cache": get_user_cache_stats()}
+
+
+@app.get("/api/monitoring/session-cache")
+async def get_session_state_cache_stats(
+    current_user: User = Depends(require_admin)
+):
+    """
+    Get chat session state cache statistics for this worker process
+
+    Returns: Cached session count, hits (turns that loaded no rows), misses and hit rate
+
+    Requires: Admin
+    """
+    return get_session_cache_stats()
+
+
+@app.delete("/api/admin/user-cache/{external_user_id}")
+async def invalidate_cached_user(
+    external_user_id: str,
+    current_user: User = Depends(require_admin)
+):
+    """
+    Drop a user's cached snapshot after changing their role or active status outside the API
+
+    Applies to this worker process; other workers pick up the change within USER_CACHE_TTL_SECONDS.
+
+    Requires: Admin
+    """
+    return {"invalidated": invalidate_user_cache(external_user_id)}
+
+
+@app.delete("/api/admin/user-cache")
+async def clear_user_cache(
+    current_user: User = Depends(require_admin)
+):
+    """
+    Drop all cached user snapshots in this worker process
+
+    Requires: Admin
+    """
+    return {"invalidated": invalidate_user_cache()}
+
+
 if __name__ == "__main__":
     import uvicorn
     settings = get_settings()
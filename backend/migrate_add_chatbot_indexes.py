@@ -0,0 +1,101 @@
+"""
+Migration script to add composite and partial indexes for the chatbot's hot queries
+and enforce a single current company_onboarding record per user
+
+Indexes are built with CREATE INDEX CONCURRENTLY, so the tables stay writable
+while the script runs. CONCURRENTLY cannot run inside a transaction block, so
+each statement runs in autocommit mode.
+"""
+
+from sqlalchemy import create_engine, text
+from config import get_settings
+
+settings = get_settings()
+
+# (index name, unique, table and column definition)
+INDEXES = [
+    ("ix_chat_messages_session_created", False, "chat_messages (session_id, created_at, id)"),
+    ("ix_chat_sessions_user_created", False, "chat_sessions (user_id, created_at DESC, id DESC)"),
+    ("ix_chat_sessions_user_status_created", False, "chat_sessions (user_id, status, created_at DESC)"),
+    ("ix_products_onboarding_product", False, "products (onboarding_id, product_id)"),
+    ("uq_company_onboarding_user_current", True, "company_onboarding (user_id) WHERE is_current"),
+]
+
+
+def drop_invalid_index(conn, name: str):
+    """A failed concurrent build leaves an INVALID index behind; drop it so it can be rebuilt"""
+    result = conn.execute(text("""
+        SELECT NOT i.indisvalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = :name
+    """), {"name": name})
+    invalid = result.scalar()
+    if invalid:
+        print(f"   Dropping invalid index {name} left by an earlier failed build...")
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+def migrate():
+    """Deduplicate current onboarding records, then build the indexes concurrently"""
+    engine = create_engine(settings.database_url)
+
+    # Deduplicate in one transaction so the unique index can be built
+    with engine.connect() as conn:
+        trans = conn.begin()
+
+        try:
+            print("Keeping only the most recent current onboarding record per user...")
+            result = conn.execute(text("""
+                UPDATE company_onboarding co
+                SET is_current = FALSE
+                WHERE co.is_current
+                  AND co.id NOT IN (
+                      SELECT DISTINCT ON (user_id) id
+                      FROM company_onboarding
+                      WHERE is_current
+                      ORDER BY user_id, created_at DESC, id DESC
+                  )
+            """))
+            print(f"   Demoted {result.rowcount} duplicate current record(s)")
+
+            trans.commit()
+
+        except Exception as e:
+            trans.rollback()
+            print(f"\n❌ Migration failed: {e}")
+            raise
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        try:
+            for name, unique, definition in INDEXES:
+                print(f"Creating {name}...")
+                drop_invalid_index(conn, name)
+                conn.execute(text(
+                    f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}"
+                ))
+
+            # Verify the indexes
+            result = conn.execute(text("""
+                SELECT c.relname, i.indisvalid, pg_size_pretty(pg_relation_size(c.oid))
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = ANY(:names)
+                ORDER BY c.relname
+            """), {"names": [name for name, _, _ in INDEXES]})
+
+            print("\nMigration Results:")
+            print(f"{'Index':40s} | Valid | Size")
+            print("-" * 60)
+            for row in result:
+                print(f"{row[0]:40s} | {str(row[1]):5s} | {row[2]}")
+
+            print("\n✅ Migration completed successfully!")
+
+        except Exception as e:
+            print(f"\n❌ Migration failed: {e}")
+            raise
+
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,92 @@
+"""
+Migration: Add Rolling Conversation Summary to ChatSession
+Date: 2026-10-16
+Description: Add columns for the rolling conversation summary:
+  - summary: summary of the messages older than the recent window
+  - summary_through_message_id: last chat message folded into the summary
+
+The summary is filled in by the background refresh as sessions continue;
+existing sessions start without one.
+"""
+
+def migrate():
+    """
+    Apply the migration to add the summary columns
+
+    Run this script with:
+    python migrations/004_add_chat_session_summary.py
+    """
+    from sqlalchemy import create_engine, text
+    from config import get_settings
+
+    settings = get_settings()
+    engine = create_engine(settings.database_url)
+
+    with engine.connect() as connection:
+        # Start transaction
+        trans = connection.begin()
+
+        try:
+            print("Adding summary columns to chat_sessions table...")
+
+            connection.execute(text("""
+                ALTER TABLE chat_sessions
+                ADD COLUMN IF NOT EXISTS summary TEXT,
+                ADD COLUMN IF NOT EXISTS summary_through_message_id INTEGER;
+            """))
+
+            print("✓ Successfully added: summary, summary_through_message_id")
+
+            # Commit transaction
+            trans.commit()
+            print("✓ Migration completed successfully")
+
+        except Exception as e:
+            # Rollback on error
+            trans.rollback()
+            print(f"✗ Migration failed: {str(e)}")
+            raise
+
+
+def rollback():
+    """
+    Rollback the migration - drop the summary columns
+    """
+    from sqlalchemy import create_engine, text
+    from config import get_settings
+
+    settings = get_settings()
+    engine = create_engine(settings.database_url)
+
+    with engine.connect() as connection:
+        trans = connection.begin()
+
+        try:
+            print("Rolling back: Removing summary columns from chat_sessions table...")
+
+            connection.execute(text("""
+                ALTER TABLE chat_sessions
+                DROP COLUMN IF EXISTS summary,
+                DROP COLUMN IF EXISTS summary_through_message_id;
+            """))
+
+            print("✓ Successfully removed: summary, summary_through_message_id")
+
+            trans.commit()
+            print("✓ Rollback completed successfully")
+
+        except Exception as e:
+            trans.rollback()
+            print(f"✗ Rollback failed: {str(e)}")
+            raise
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "rollback":
+        print("Running rollback...")
+        rollback()
+    else:
+        print("Running migration...")
+        migrate()
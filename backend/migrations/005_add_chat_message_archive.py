@@ -0,0 +1,118 @@
+"""
+Migration: Add Chat Message Archive
+Date: 2026-10-16
+Description: Add the archive tier for finished chat sessions:
+  - chat_message_archives: one zlib-compressed transcript per archived session
+  - chat_sessions.archived_at: set while a session's messages live in the archive
+  - chat_sessions.completed_at: backfilled from updated_at for completed sessions,
+    which were never stamped before
+
+Sessions are archived by archive_chat_sessions.py; nothing is moved by this migration.
+"""
+
+def migrate():
+    """
+    Apply the migration to add the archive table and columns
+
+    Run this script with:
+    python migrations/005_add_chat_message_archive.py
+    """
+    from sqlalchemy import create_engine, text
+    from config import get_settings
+
+    settings = get_settings()
+    engine = create_engine(settings.database_url)
+
+    with engine.connect() as connection:
+        # Start transaction
+        trans = connection.begin()
+
+        try:
+            print("Creating chat_message_archives table...")
+
+            connection.execute(text("""
+                CREATE TABLE IF NOT EXISTS chat_message_archives (
+                    id SERIAL PRIMARY KEY,
+                    session_id INTEGER NOT NULL UNIQUE REFERENCES chat_sessions(id),
+                    message_count INTEGER NOT NULL,
+                    first_message_at TIMESTAMP,
+                    last_message_at TIMESTAMP,
+                    raw_size INTEGER NOT NULL,
+                    transcript BYTEA NOT NULL,
+                    archived_at TIMESTAMP NOT NULL DEFAULT NOW()
+                );
+            """))
+
+            print("Adding archived_at column to chat_sessions table...")
+
+            connection.execute(text("""
+                ALTER TABLE chat_sessions
+                ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP;
+            """))
+
+            print("Backfilling completed_at for completed sessions...")
+
+            result = connection.execute(text("""
+                UPDATE chat_sessions
+                SET completed_at = updated_at
+                WHERE status = 'COMPLETED' AND completed_at IS NULL;
+            """))
+
+            print(f"✓ Successfully added: chat_message_archives, archived_at ({result.rowcount} sessions backfilled)")
+
+            # Commit transaction
+            trans.commit()
+            print("✓ Migration completed successfully")
+
+        except Exception as e:
+            # Rollback on error
+            trans.rollback()
+            print(f"✗ Migration failed: {str(e)}")
+            raise
+
+
+def rollback():
+    """
+    Rollback the migration - drop the archive table and archived_at column
+
+    Run archive_chat_sessions.py --restore-all first, or the archived messages are lost.
+    The completed_at backfill is kept.
+    """
+    from sqlalchemy import create_engine, text
+    from config import get_settings
+
+    settings = get_settings()
+    engine = create_engine(settings.database_url)
+
+    with engine.connect() as connection:
+        trans = connection.begin()
+
+        try:
+            print("Rolling back: Removing chat message archive...")
+
+            connection.execute(text("DROP TABLE IF EXISTS chat_message_archives;"))
+            connection.execute(text("""
+                ALTER TABLE chat_sessions
+                DROP COLUMN IF EXISTS archived_at;
+            """))
+
+            print("✓ Successfully removed: chat_message_archives, archived_at")
+
+            trans.commit()
+            print("✓ Rollback completed successfully")
+
+        except Exception as e:
+            trans.rollback()
+            print(f"✗ Rollback failed: {str(e)}")
+            raise
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "rollback":
+        print("Running rollback...")
+        rollback()
+    else:
+        print("Running migration...")
+        migrate()
@@ -0,0 +1,168 @@
+"""
+Migration: Compressed Chat Message Content
+Date: 2026-10-16
+Description: Store large chat message bodies compressed:
+  - content_codec: 'zstd' or 'zlib' for compressed rows, NULL for plain text
+  - content_blob: the compressed body
+  - content becomes nullable (NULL while the body is in content_blob)
+
+New messages above TEXT_COMPRESSION_MIN_BYTES are compressed on write. Existing rows
+stay plain until compressed with:
+    python migrations/006_compress_chat_message_content.py compress
+"""
+
+BATCH_SIZE = 500
+
+
+def migrate():
+    """
+    Apply the migration to add the compressed content columns
+
+    Run this script with:
+    python migrations/006_compress_chat_message_content.py
+    """
+    from sqlalchemy import create_engine, text
+    from config import get_settings
+
+    settings = get_settings()
+    engine = create_engine(settings.database_url)
+
+    with engine.connect() as connection:
+        # Start transaction
+        trans = connection.begin()
+
+        try:
+            print("Adding compressed content columns to chat_messages table...")
+
+            connection.execute(text("""
+                ALTER TABLE chat_messages
+                ADD COLUMN IF NOT EXISTS content_codec VARCHAR(10),
+                ADD COLUMN IF NOT EXISTS content_blob BYTEA,
+                ALTER COLUMN content DROP NOT NULL;
+            """))
+
+            print("✓ Successfully added: content_codec, content_blob")
+
+            # Commit transaction
+            trans.commit()
+            print("✓ Migration completed successfully")
+
+        except Exception as e:
+            # Rollback on error
+            trans.rollback()
+            print(f"✗ Migration failed: {str(e)}")
+            raise
+
+
+def compress_existing():
+    """
+    Compress existing plain message bodies above the threshold, one batch per transaction
+
+    Safe to stop and rerun. Space is reclaimed by autovacuum (or VACUUM FULL) afterwards.
+    """
+    from sqlalchemy import create_engine, text
+    from config import get_settings
+    from compression import compress_text
+
+    settings = get_settings()
+    engine = create_engine(settings.database_url)
+
+    compressed = 0
+    last_id = 0
+    with engine.connect() as connection:
+        while True:
+            trans = connection.begin()
+            try:
+                rows = connection.execute(text("""
+                    SELECT id, content FROM chat_messages
+                    WHERE id > :last_id AND content_codec IS NULL
+                      AND octet_length(content) >= :min_bytes
+                    ORDER BY id
+                    LIMIT :batch_size
+                """), {
+                    "last_id": last_id,
+                    "min_bytes": settings.text_compression_min_bytes,
+                    "batch_size": BATCH_SIZE
+                }).fetchall()
+
+                for row_id, content in rows:
+                    plain, codec, blob = compress_text(content)
+                    if codec is None:
+                        continue
+                    connection.execute(text("""
+                        UPDATE chat_messages
+                        SET content = NULL, content_codec = :codec, content_blob = :blob
+                        WHERE id = :id AND content_codec IS NULL
+                    """), {"id": row_id, "codec": codec, "blob": blob})
+                    compressed += 1
+
+                trans.commit()
+            except Exception as e:
+                trans.rollback()
+                print(f"✗ Compression failed: {str(e)}")
+                raise
+
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            print(f"  ... {compressed} messages compressed")
+
+    print(f"✓ Compressed {compressed} messages")
+
+
+def rollback():
+    """
+    Rollback the migration - decompress every message and drop the columns
+    """
+    from sqlalchemy import create_engine, text
+    from config import get_settings
+    from compression import decompress_text
+
+    settings = get_settings()
+    engine = create_engine(settings.database_url)
+
+    with engine.connect() as connection:
+        trans = connection.begin()
+
+        try:
+            print("Rolling back: Decompressing chat messages...")
+
+            rows = connection.execute(text("""
+                SELECT id, content_codec, content_blob FROM chat_messages
+                WHERE content_codec IS NOT NULL
+            """)).fetchall()
+            for row_id, codec, blob in rows:
+                connection.execute(text("""
+                    UPDATE chat_messages SET content = :content WHERE id = :id
+                """), {"id": row_id, "content": decompress_text(codec, bytes(blob))})
+
+            connection.execute(text("""
+                ALTER TABLE chat_messages
+                DROP COLUMN IF EXISTS content_codec,
+                DROP COLUMN IF EXISTS content_blob,
+                ALTER COLUMN content SET NOT NULL;
+            """))
+
+            print(f"✓ Successfully removed: content_codec, content_blob ({len(rows)} messages decompressed)")
+
+            trans.commit()
+            print("✓ Rollback completed successfully")
+
+        except Exception as e:
+            trans.rollback()
+            print(f"✗ Rollback failed: {str(e)}")
+            raise
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "rollback":
+        print("Running rollback...")
+        rollback()
+    elif len(sys.argv) > 1 and sys.argv[1] == "compress":
+        print("Compressing existing messages...")
+        compress_existing()
+    else:
+        print("Running migration...")
+        migrate()
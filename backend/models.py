@@ -1,8 +1,11 @@
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Enum, Text, Boolean, Float
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Enum, Text, Boolean, Float, Index, LargeBinary, text
 from sqlalchemy.orm import relationship
+from sqlalchemy.ext.hybrid import hybrid_property
 from datetime import datetime
 import enum
+import json
 from database import Base
+from compression import compress_text, decompress_text
 
 
 class UserRole(str, enum.Enum):
@@ -25,6 +28,14 @@ class ChatSessionStatus(str, enum.Enum):
     ABANDONED = "abandoned"
 
 
+class ExtractionJobStatus(str, enum.Enum):
+    """Document extraction job status enumeration"""
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
 class User(Base):
     """User table for external JWT authentication (synced from main system)"""
 
@@ -99,6 +110,11 @@ class ChatSession(Base):
     """Chat session table for managing user chatbot conversations"""
 
     __tablename__ = "chat_sessions"
+    __table_args__ = (
+        # Session list (newest first) and latest-active-session lookups per user
+        Index("ix_chat_sessions_user_created", "user_id", text("created_at DESC"), text("id DESC")),
+        Index("ix_chat_sessions_user_status_created", "user_id", "status", text("created_at DESC")),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
@@ -108,6 +124,13 @@ class ChatSession(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     completed_at = Column(DateTime, nullable=True)
 
+    # Rolling summary of the messages older than the recent window sent to the LLM
+    summary = Column(Text, nullable=True)
+    summary_through_message_id = Column(Integer, nullable=True)  # Last message folded into the summary
+
+    # Set while the session's messages live in chat_message_archives instead of chat_messages
+    archived_at = Column(DateTime, nullable=True)
+
     # Relationships
     user = relationship("User")
     messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan")
@@ -129,16 +152,39 @@ class ChatMessage(Base):
     """Chat message table for storing conversation history"""
 
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        # Conversation history in order, and the recent window read backwards
+        Index("ix_chat_messages_session_created", "session_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(Integer, ForeignKey("chat_sessions.id"), nullable=False, index=True)
     role = Column(String(20), nullable=False)  # 'user' or 'assistant'
-    content = Column(Text, nullable=False)
+    # Large bodies are stored compressed in content_blob (see the content property)
+    _content = Column("content", Text, nullable=True)  # Plain text, NULL when compressed
+    content_codec = Column(String(10), nullable=True)  # 'zstd' or 'zlib', NULL when plain
+    content_blob = Column(LargeBinary, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
     # Relationships
     session = relationship("ChatSession", back_populates="messages")
 
+    @hybrid_property
+    def content(self):
+        """Message text, decompressed if it was stored compressed"""
+        if self.content_codec:
+            return decompress_text(self.content_codec, self.content_blob)
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content, self.content_codec, self.content_blob = compress_text(value)
+
+    @content.expression
+    def content(cls):
+        # Only plain rows match SQL on content; compressed rows read as NULL
+        return cls._content
+
     def to_dict(self):
         """Convert model to dictionary"""
         return {
@@ -150,10 +196,30 @@ class ChatMessage(Base):
         }
 
 
+class ChatMessageArchive(Base):
+    """Compressed transcript of a finished chat session, moved out of chat_messages"""
+
+    __tablename__ = "chat_message_archives"
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("chat_sessions.id"), nullable=False, unique=True)
+    message_count = Column(Integer, nullable=False)
+    first_message_at = Column(DateTime, nullable=True)
+    last_message_at = Column(DateTime, nullable=True)
+    raw_size = Column(Integer, nullable=False)  # Uncompressed JSON size in bytes
+    transcript = Column(LargeBinary, nullable=False)  # zlib-compressed JSON list of messages
+    archived_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
 class CompanyOnboarding(Base):
     """Company onboarding data collected through chatbot"""
 
     __tablename__ = "company_onboarding"
+    __table_args__ = (
+        # At most one current onboarding record per user (also serves the current-record lookup)
+        Index("uq_company_onboarding_user_current", "user_id", unique=True,
+              postgresql_where=text("is_current"), sqlite_where=text("is_current")),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     chat_session_id = Column(Integer, ForeignKey("chat_sessions.id"), nullable=False, unique=True, index=True)
@@ -176,7 +242,8 @@ class CompanyOnboarding(Base):
     # Relationships
     user = relationship("User")
     chat_session = relationship("ChatSession", back_populates="onboarding_data")
-    products = relationship("Product", back_populates="company_onboarding", cascade="all, delete-orphan")
+    # Eagerly loaded: async sessions cannot lazy-load products on attribute access
+    products = relationship("Product", back_populates="company_onboarding", cascade="all, delete-orphan", lazy="selectin")
 
     def to_dict(self):
         """Convert model to dictionary"""
@@ -214,6 +281,9 @@ class Product(Base):
     """Product information table (子欄)"""
 
     __tablename__ = "products"
+    __table_args__ = (
+        Index("ix_products_onboarding_product", "onboarding_id", "product_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     onboarding_id = Column(Integer, ForeignKey("company_onboarding.id"), nullable=False, index=True)
@@ -255,3 +325,50 @@ class Product(Base):
             "產品規格(尺寸、精度)": self.product_standard,
             "技術優勢": self.technical_advantages
         }
+
+
+class ExtractionJob(Base):
+    """Background document extraction job (file upload -> text -> AI -> onboarding data)"""
+
+    __tablename__ = "extraction_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    session_id = Column(Integer, ForeignKey("chat_sessions.id"), nullable=True)
+    filename = Column(String(255), nullable=True)
+    content_type = Column(String(100), nullable=True)
+    status = Column(Enum(ExtractionJobStatus, native_enum=True, create_constraint=True, name='extractionjobstatus'),
+                    default=ExtractionJobStatus.PENDING, nullable=False)
+    result = Column(Text, nullable=True)  # JSON-encoded result once the job succeeded
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    def to_dict(self):
+        """Convert model to dictionary"""
+        return {
+            "job_id": self.id,
+            "session_id": self.session_id,
+            "filename": self.filename,
+            "status": self.status.value,
+            "result": json.loads(self.result) if self.result else None,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class LLMResponseCache(Base):
+    """Cached LLM completion, keyed by a hash of everything sent to the model"""
+
+    __tablename__ = "llm_response_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String(64), nullable=False, unique=True)  # SHA-256 of model, prompt, tools and input
+    model = Column(String(100), nullable=False)
+    response = Column(Text, nullable=False)  # JSON: {"message": ..., "tool_calls": [{"name", "arguments"}]}
+    hit_count = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_used_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)  # LRU eviction order
@@ -0,0 +1,120 @@
+"""
+Keyset (Cursor) Pagination
+Pages are located by (created_at, id) instead of OFFSET, so every page costs
+one index range scan no matter how deep into the history it is
+"""
+
+import base64
+import binascii
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import Select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Encode a row position as an opaque cursor"""
+    raw = f"{created_at.isoformat()}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a cursor from encode_cursor (400 if it is malformed)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
+
+
+async def keyset_page(
+    db: AsyncSession,
+    query: Select,
+    model: Any,
+    limit: int,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    newest_first: bool = True
+) -> Tuple[List[Any], Optional[str], bool]:
+    """
+    Fetch one page of `query` keyed on (model.created_at, model.id)
+
+    Without a cursor the page holds the newest rows; `before` continues towards
+    older rows and `after` towards newer ones. Items come back newest first or
+    oldest first depending on `newest_first`, whatever the direction.
+
+    Returns (items, next_cursor, has_more); next_cursor continues in the same
+    direction and is passed back as the same parameter (before or after).
+    """
+    _check_cursors(before, after)
+
+    key = tuple_(model.created_at, model.id)
+    if after:
+        query = query.where(key > tuple_(*decode_cursor(after))).order_by(model.created_at, model.id)
+    else:
+        if before:
+            query = query.where(key < tuple_(*decode_cursor(before)))
+        query = query.order_by(model.created_at.desc(), model.id.desc())
+
+    # One extra row tells whether another page exists without a COUNT
+    result = await db.execute(query.limit(limit + 1))
+    return _finish_page(list(result.scalars().all()), limit, after, newest_first)
+
+
+def page_loaded_rows(
+    rows: List[Any],
+    limit: int,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    newest_first: bool = True
+) -> Tuple[List[Any], Optional[str], bool]:
+    """
+    keyset_page over rows already in memory (e.g. an archived transcript)
+
+    Takes and returns the same cursors, so a client can page through archived
+    and hot sessions alike.
+    """
+    _check_cursors(before, after)
+
+    rows = sorted(rows, key=lambda row: (row.created_at, row.id))
+    if after:
+        position = decode_cursor(after)
+        walking = [row for row in rows if (row.created_at, row.id) > position]
+    else:
+        if before:
+            position = decode_cursor(before)
+            rows = [row for row in rows if (row.created_at, row.id) < position]
+        walking = rows[::-1]
+
+    return _finish_page(walking[:limit + 1], limit, after, newest_first)
+
+
+def _check_cursors(before: Optional[str], after: Optional[str]):
+    if before and after:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use either before or after, not both"
+        )
+
+
+def _finish_page(rows: List[Any], limit: int, after: Optional[str], newest_first: bool) -> Tuple[List[Any], Optional[str], bool]:
+    """Trim up to limit + 1 rows (in walking order) to a page and its next cursor"""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id) if has_more else None
+
+    # Rows were read in walking order (newer-to-older for before, older-to-newer for after)
+    walking_newest_first = not after
+    if walking_newest_first != newest_first:
+        rows.reverse()
+
+    return rows, next_cursor, has_more
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, List
 from datetime import datetime
 
 
@@ -80,6 +80,20 @@ class ChatSessionResponse(BaseModel):
         from_attributes = True
 
 
+class ChatSessionPage(BaseModel):
+    """Schema for one page of chat sessions (newest first)"""
+    items: List[ChatSessionResponse]
+    next_cursor: Optional[str] = Field(None, description="Pass as before/after (same as this request) for the next page")
+    has_more: bool
+
+
+class ChatMessagePage(BaseModel):
+    """Schema for one page of chat messages (oldest first)"""
+    items: List[ChatMessageResponse]
+    next_cursor: Optional[str] = Field(None, description="Pass as before/after (same as this request) for the next page")
+    has_more: bool
+
+
 class ProductData(BaseModel):
     """Schema for product data"""
     product_id: Optional[str] = None
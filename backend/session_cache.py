@@ -0,0 +1,171 @@
+"""
+Chat Session State Cache
+Write-through cache of what a chat turn loads: the session, its onboarding data
+and products, and the recent message window. A warm turn rebuilds the handler
+from the cache instead of reading the database
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple, Type
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+from cache import TTLCache
+from models import ChatSession, ChatMessage, CompanyOnboarding, Product
+from config import get_settings
+
+settings = get_settings()
+
+
+@dataclass
+class SessionState:
+    """Column snapshots of one session's turn state (plain values, never live instances)"""
+    user_id: int
+    session: Dict[str, Any]
+    onboarding: Optional[Dict[str, Any]]
+    products: List[Dict[str, Any]]
+    history: Optional[List[Dict[str, Any]]]  # Recent messages, oldest first (None if the turn never read them)
+    history_window: int  # Window the history was cut to (fewer messages means it is the whole session)
+
+
+# Keyed by session id; onboarding id -> session id lets product writes find their session
+_state_cache = TTLCache(maxsize=settings.session_cache_max_entries, ttl=settings.session_cache_ttl_seconds)
+_onboarding_sessions = TTLCache(maxsize=settings.session_cache_max_entries, ttl=settings.session_cache_ttl_seconds)
+
+
+def _snapshot(instance) -> Optional[Dict[str, Any]]:
+    """Column values of an instance, or None if any column is expired (would need SQL to read)"""
+    state = inspect(instance)
+    keys = [attr.key for attr in state.mapper.column_attrs]
+    if state.expired_attributes.intersection(keys):
+        return None
+    # Columns never set on a row inserted by this session are NULL, not unloaded
+    return {key: state.dict.get(key) for key in keys}
+
+
+def _detached(model: Type, snapshot: Dict[str, Any]):
+    """Rebuild a detached instance from a snapshot, as though it was just loaded"""
+    instance = model(**snapshot)
+    make_transient_to_detached(instance)
+    return instance
+
+
+def store_session_state(
+    session: ChatSession,
+    onboarding_data: Optional[CompanyOnboarding],
+    history: Optional[List[ChatMessage]],
+    history_window: int
+):
+    """Cache a session's state after a committed turn (skipped if anything is expired)"""
+    if not settings.session_cache_enabled:
+        return
+
+    session_snapshot = _snapshot(session)
+    onboarding_snapshot = _snapshot(onboarding_data) if onboarding_data is not None else None
+    product_snapshots = [_snapshot(product) for product in onboarding_data.products] if onboarding_data is not None else []
+    history_snapshots = [_snapshot(message) for message in history[-history_window:]] if history is not None else None
+
+    if (session_snapshot is None or (onboarding_data is not None and onboarding_snapshot is None)
+            or None in product_snapshots or (history_snapshots is not None and None in history_snapshots)):
+        _state_cache.pop(session.id)
+        return
+
+    _state_cache.set(session.id, SessionState(
+        user_id=session_snapshot["user_id"],
+        session=session_snapshot,
+        onboarding=onboarding_snapshot,
+        products=product_snapshots,
+        history=history_snapshots,
+        history_window=history_window
+    ))
+    if onboarding_snapshot is not None:
+        _onboarding_sessions.set(onboarding_snapshot["id"], session.id)
+
+
+async def restore_session_state(
+    db: AsyncSession,
+    session_id: int,
+    user_id: int,
+    history_window: int
+) -> Optional[Tuple[ChatSession, Optional[CompanyOnboarding], Optional[List[ChatMessage]]]]:
+    """
+    Rebuild (session, onboarding_data, history) from the cache without any SQL
+
+    The session and onboarding data (with its products) are merged into `db`, so
+    changes to them are flushed as usual. History is None if it was not cached or
+    the cached window is shorter than `history_window`.
+    """
+    if not settings.session_cache_enabled:
+        return None
+
+    state = _state_cache.get(session_id)
+    if state is None or state.user_id != user_id:
+        return None
+
+    # merge(load=False) attaches the rebuilt rows as persistent without a SELECT
+    session = await db.merge(_detached(ChatSession, state.session), load=False)
+
+    onboarding_data = None
+    if state.onboarding is not None:
+        onboarding = CompanyOnboarding(**state.onboarding)
+        onboarding.products = [Product(**snapshot) for snapshot in state.products]
+        for product in onboarding.products:
+            make_transient_to_detached(product)
+        make_transient_to_detached(onboarding)
+        onboarding_data = await db.merge(onboarding, load=False)
+
+    history = None
+    if state.history is not None and (state.history_window >= history_window
+                                      or len(state.history) < state.history_window):
+        history = [_detached(ChatMessage, snapshot) for snapshot in state.history]
+
+    return session, onboarding_data, history
+
+
+def invalidate_session_state(session_id: Optional[int] = None, user_id: Optional[int] = None) -> int:
+    """Drop one session's cached state, every session of a user, or everything; returns how many were dropped"""
+    if session_id is not None:
+        return 1 if _state_cache.pop(session_id) is not None else 0
+    if user_id is not None:
+        return _state_cache.pop_where(lambda _, state: state.user_id == user_id)
+    count = len(_state_cache)
+    _state_cache.clear()
+    _onboarding_sessions.clear()
+    return count
+
+
+def get_session_cache_stats() -> Dict[str, Any]:
+    """Get session state cache statistics"""
+    return _state_cache.get_stats()
+
+
+# Every ORM write to a session's rows drops its cached state when it is flushed;
+# a committed turn then writes the fresh state back (store_session_state)
+
+@event.listens_for(ChatSession, "after_update")
+@event.listens_for(ChatSession, "after_delete")
+def _invalidate_session(mapper, connection, target):
+    _state_cache.pop(target.id)
+
+
+@event.listens_for(ChatMessage, "after_insert")
+@event.listens_for(ChatMessage, "after_update")
+@event.listens_for(ChatMessage, "after_delete")
+def _invalidate_message_session(mapper, connection, target):
+    _state_cache.pop(target.session_id)
+
+
+@event.listens_for(CompanyOnboarding, "after_insert")
+@event.listens_for(CompanyOnboarding, "after_update")
+@event.listens_for(CompanyOnboarding, "after_delete")
+def _invalidate_onboarding_session(mapper, connection, target):
+    _state_cache.pop(target.chat_session_id)
+
+
+@event.listens_for(Product, "after_insert")
+@event.listens_for(Product, "after_update")
+@event.listens_for(Product, "after_delete")
+def _invalidate_product_session(mapper, connection, target):
+    session_id = _onboarding_sessions.get(target.onboarding_id)
+    if session_id is not None:
+        _state_cache.pop(session_id)
@@ -0,0 +1,97 @@
+"""
+Per-Session Turn Serialization
+Chat turns for the same session run one at a time, while turns for
+different sessions still run fully in parallel
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from database import lock_engine
+from config import get_settings
+from llm_limiter import LLMOverloadedError
+
+settings = get_settings()
+
+# First key of the two-key advisory lock form, so chat session locks don't
+# collide with advisory locks taken for other purposes
+ADVISORY_LOCK_NAMESPACE = 0x43484154  # "CHAT"
+
+
+class KeyedLock:
+    """asyncio locks created on demand per key and dropped once nobody holds or waits for them"""
+
+    def __init__(self):
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._users: Dict[Hashable, int] = {}
+
+    @asynccontextmanager
+    async def acquire(self, key: Hashable):
+        """Hold the lock for key for the duration of the block"""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._users[key] = self._users.get(key, 0) + 1
+
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if self._users[key] == 0:
+                del self._users[key]
+                del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+_session_locks = KeyedLock()
+
+
+@asynccontextmanager
+async def _advisory_lock(session_id: int):
+    """
+    Hold a Postgres session-level advisory lock on a dedicated connection
+
+    The connection comes from lock_engine's pool; when every one of them is held
+    by a turn in progress, the turn is shed like a full LLM queue.
+    """
+    try:
+        conn = await lock_engine.connect()
+    except PoolTimeoutError:
+        raise LLMOverloadedError(settings.llm_retry_after_seconds, "Too many chat turns in progress")
+
+    async with conn:
+        await conn.execute(
+            text("SELECT pg_advisory_lock(:namespace, :key)"),
+            {"namespace": ADVISORY_LOCK_NAMESPACE, "key": session_id}
+        )
+        try:
+            yield
+        finally:
+            await conn.execute(
+                text("SELECT pg_advisory_unlock(:namespace, :key)"),
+                {"namespace": ADVISORY_LOCK_NAMESPACE, "key": session_id}
+            )
+            await conn.commit()
+
+
+@asynccontextmanager
+async def session_turn_lock(session_id: int):
+    """
+    Serialize chat turns for one session
+
+    The in-process lock always applies. With SESSION_LOCK_BACKEND=postgres an
+    advisory lock is also taken, so turns are serialized across worker processes;
+    taking the local lock first means each worker holds at most one connection
+    per busy session while waiting.
+    """
+    async with _session_locks.acquire(session_id):
+        if settings.session_lock_backend == "postgres":
+            async with _advisory_lock(session_id):
+                yield
+        else:
+            yield
@@ -0,0 +1,105 @@
+"""
+Tests for the async OpenAI path in AIChatbotHandler
+
+Uses a fake AsyncOpenAI client, so no database or API key is needed.
+Run with: python -m pytest test_ai_chatbot_async.py
+"""
+
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+from ai_chatbot_handler import AIChatbotHandler
+
+
+LLM_DELAY = 0.2  # Simulated completion round trip (seconds)
+
+
+class FakeCompletions:
+    """Mimics client.chat.completions with an awaitable create()"""
+
+    def __init__(self, delay: float, content: str = "好的，已記錄。", tool_calls=None):
+        self.delay = delay
+        self.content = content
+        self.tool_calls = tool_calls
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+
+        message = SimpleNamespace(content=self.content, tool_calls=self.tool_calls)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def make_tool_call(name: str, arguments: dict):
+    return SimpleNamespace(function=SimpleNamespace(name=name, arguments=json.dumps(arguments)))
+
+
+def test_extract_data_with_ai_is_awaitable(install_llm_client):
+    completions = FakeCompletions(
+        delay=0,
+        tool_calls=[make_tool_call("update_company_data", {"industry": "食品業"})]
+    )
+    install_llm_client(completions)
+    handler = AIChatbotHandler(db=None, user_id=1)
+
+    result = asyncio.run(handler.extract_data_with_ai("我們是食品業", []))
+
+    assert result["message"] == "好的，已記錄。"
+    assert result["function_calls"] == [
+        {"name": "update_company_data", "arguments": {"industry": "食品業"}}
+    ]
+    assert completions.calls[0]["messages"][-1] == {"role": "user", "content": "我們是食品業"}
+
+
+def test_concurrent_chat_turns_overlap(install_llm_client):
+    completions = FakeCompletions(delay=LLM_DELAY)
+    install_llm_client(completions)
+    turns = 5
+
+    async def run_turns():
+        handlers = [AIChatbotHandler(db=None, user_id=i) for i in range(turns)]
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            handler.extract_data_with_ai(f"訊息 {i}", [])
+            for i, handler in enumerate(handlers)
+        ])
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(run_turns())
+
+    # Sequential (blocking) calls would take turns * LLM_DELAY
+    assert completions.max_in_flight == turns
+    assert elapsed < LLM_DELAY * 2
+
+
+def test_event_loop_stays_responsive_during_completion(install_llm_client):
+    completions = FakeCompletions(delay=LLM_DELAY)
+    install_llm_client(completions)
+    handler = AIChatbotHandler(db=None, user_id=1)
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(LLM_DELAY / 10)
+                ticks += 1
+
+        ticker_task = asyncio.create_task(ticker())
+        await handler.extract_data_with_ai("你好", [])
+        ticker_task.cancel()
+        return ticks
+
+    # Other coroutines keep running while the completion is awaited
+    assert asyncio.run(run()) >= 5
@@ -0,0 +1,153 @@
+"""
+Tests for archiving finished chat sessions
+
+Sessions are archived, read back and restored against an in-memory SQLite
+database (aiosqlite), so no Postgres server is needed.
+Run with: python -m pytest test_chat_archive.py
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func
+
+from ai_chatbot_handler import AIChatbotHandler
+from chat_archive import archive_session, load_session_messages
+from models import ChatMessage, ChatMessageArchive, ChatSession, ChatSessionStatus
+from pagination import page_loaded_rows, keyset_page
+from session_locks import session_turn_lock
+
+START = datetime(2026, 1, 1, 9, 0, 0)
+# A body over TEXT_COMPRESSION_MIN_BYTES is stored compressed in chat_messages
+LONG_REPLY = "我們的產品包含醬油、味噌與調味料。" * 80
+CONTENTS = ["歡迎", "食品業", "好的", LONG_REPLY, "謝謝"]
+
+
+async def create_archived_session(session_factory) -> int:
+    """A completed session with CONTENTS as its messages, then archived"""
+    async with session_factory() as db:
+        session = ChatSession(user_id=1, status=ChatSessionStatus.COMPLETED, completed_at=START)
+        db.add(session)
+        await db.flush()
+        # Messages 2 and 3 share a timestamp, so only their ids order them
+        offsets = [0, 1, 2, 2, 3]
+        db.add_all([
+            ChatMessage(session_id=session.id, role="assistant" if number % 2 == 0 else "user",
+                        content=content, created_at=START + timedelta(seconds=offset))
+            for number, (content, offset) in enumerate(zip(CONTENTS, offsets))
+        ])
+        await db.commit()
+
+        assert await archive_session(db, session.id) is not None
+        return session.id
+
+
+async def hot_message_count(session_factory, session_id: int) -> int:
+    async with session_factory() as db:
+        return await db.scalar(select(func.count()).select_from(ChatMessage).where(ChatMessage.session_id == session_id))
+
+
+async def locked_turn(session_factory, session_id: int, message: str):
+    """A chat turn as the routes run it: load under the session's turn lock, then write"""
+    async with session_turn_lock(session_id):
+        async with session_factory() as db:
+            handler = AIChatbotHandler(db, user_id=1, session_id=session_id)
+            await handler.load_session(restore_archived=True)
+            async with handler.turn():
+                await handler.add_message("user", message)
+                # Another turn may be waiting for the lock meanwhile
+                await asyncio.sleep(0.01)
+
+
+def test_archive_moves_messages_into_one_compressed_row(run_with_database):
+    async def test(session_factory):
+        session_id = await create_archived_session(session_factory)
+
+        async with session_factory() as db:
+            archive = await db.scalar(select(ChatMessageArchive).where(ChatMessageArchive.session_id == session_id))
+            session = await db.get(ChatSession, session_id)
+
+        assert await hot_message_count(session_factory, session_id) == 0
+        assert session.archived_at == archive.archived_at
+        assert archive.message_count == len(CONTENTS)
+        assert len(archive.transcript) < archive.raw_size
+
+        # Archiving twice does nothing
+        async with session_factory() as db:
+            assert await archive_session(db, session_id) is None
+
+    run_with_database(test)
+
+
+def test_archived_transcript_pages_like_the_hot_table(run_with_database):
+    async def test(session_factory):
+        session_id = await create_archived_session(session_factory)
+
+        async with session_factory() as db:
+            session = await db.get(ChatSession, session_id)
+            messages = await load_session_messages(db, session)
+        assert [message.content for message in messages] == CONTENTS
+
+        archived_pages = []
+        cursor = None
+        while True:
+            items, cursor, has_more = page_loaded_rows(messages, 2, before=cursor, newest_first=False)
+            archived_pages.append([(item.id, item.content) for item in items])
+            if not has_more:
+                break
+
+        # Restored to chat_messages, the same session pages the same way with the same ids
+        await locked_turn(session_factory, session_id, "再次開始")
+        hot_pages = []
+        cursor = None
+        async with session_factory() as db:
+            # Leaves out the message of the restoring turn
+            query = select(ChatMessage).where(ChatMessage.session_id == session_id, ChatMessage.created_at < START + timedelta(days=1))
+            while True:
+                items, cursor, has_more = await keyset_page(db, query, ChatMessage, 2, before=cursor, newest_first=False)
+                hot_pages.append([(item.id, item.content) for item in items])
+                if not has_more:
+                    break
+
+        assert [content for page in reversed(archived_pages) for _, content in page] == CONTENTS
+        assert hot_pages == archived_pages
+
+    run_with_database(test)
+
+
+def test_loading_without_the_turn_lock_leaves_the_archive(run_with_database):
+    async def test(session_factory):
+        session_id = await create_archived_session(session_factory)
+
+        # What the SSE pre-load and the WebSocket connect do: check the session exists
+        async with session_factory() as db:
+            handler = AIChatbotHandler(db, user_id=1, session_id=session_id)
+            assert await handler.load_session() is not None
+            await db.commit()
+
+        assert await hot_message_count(session_factory, session_id) == 0
+        async with session_factory() as db:
+            assert (await db.get(ChatSession, session_id)).archived_at is not None
+
+    run_with_database(test)
+
+
+def test_concurrent_turns_restore_once(run_with_database):
+    async def test(session_factory):
+        session_id = await create_archived_session(session_factory)
+
+        await asyncio.gather(*[locked_turn(session_factory, session_id, f"訊息 {i}") for i in range(3)])
+
+        async with session_factory() as db:
+            session = await db.get(ChatSession, session_id)
+            archives = await db.scalar(select(func.count()).select_from(ChatMessageArchive))
+            result = await db.execute(
+                select(ChatMessage).where(ChatMessage.session_id == session_id).order_by(ChatMessage.created_at, ChatMessage.id)
+            )
+            contents = [message.content for message in result.scalars()]
+
+        assert session.archived_at is None and archives == 0
+        assert contents[:len(CONTENTS)] == CONTENTS
+        assert sorted(contents[len(CONTENTS):]) == ["訊息 0", "訊息 1", "訊息 2"]
+
+    run_with_database(test)
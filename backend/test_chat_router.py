@@ -0,0 +1,132 @@
+"""
+Tests for the rule-first chat router
+
+Table-driven: each case is (last assistant message, user message, expected
+tool call or None for the LLM). No database or API key is needed.
+Run with: python -m pytest test_chat_router.py
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import chat_router
+from chat_router import route_turn, route_reply, record_route, get_router_stats, _QUESTIONS, _PRODUCTS_QUESTION
+from ai_chatbot_handler import AIChatbotHandler
+
+
+def make_onboarding(**filled):
+    """Onboarding row with the given fields filled in and the rest missing"""
+    data = dict(
+        industry=None, capital_amount=None, invention_patent_count=None,
+        utility_patent_count=None, certification_count=None,
+        esg_certification_count=None, esg_certification=None
+    )
+    data.update(filled)
+    return SimpleNamespace(**data)
+
+
+COMPLETE = dict(
+    industry="食品業", capital_amount=5_000_000, invention_patent_count=1,
+    utility_patent_count=2, certification_count=3,
+    esg_certification_count=1, esg_certification="ISO 14064"
+)
+UP_TO_CAPITAL = dict(industry="食品業")
+UP_TO_INVENTION = dict(UP_TO_CAPITAL, capital_amount=5_000_000)
+UP_TO_UTILITY = dict(UP_TO_INVENTION, invention_patent_count=1)
+UP_TO_CERTIFICATION = dict(UP_TO_UTILITY, utility_patent_count=2)
+UP_TO_ESG = dict(UP_TO_CERTIFICATION, certification_count=3)
+
+
+def update(**arguments):
+    return {"name": "update_company_data", "arguments": arguments}
+
+
+# (filled fields, last assistant message, user message, expected call or None)
+ROUTED_CASES = [
+    ({}, _QUESTIONS["industry"], "食品業", update(industry="食品業")),
+    ({}, _QUESTIONS["industry"], " 資訊服務業。", update(industry="資訊服務業")),
+    ({}, "請問您的公司是什麼產業？", "電子業", update(industry="電子業")),
+    (UP_TO_CAPITAL, _QUESTIONS["capital_amount"], "5000000", update(capital_amount=5_000_000)),
+    (UP_TO_CAPITAL, _QUESTIONS["capital_amount"], "NT$1,200萬元", update(capital_amount=12_000_000)),
+    (UP_TO_CAPITAL, _QUESTIONS["capital_amount"], "2億", update(capital_amount=200_000_000)),
+    (UP_TO_INVENTION, _QUESTIONS["invention_patent_count"], "3件", update(invention_patent_count=3)),
+    (UP_TO_INVENTION, _QUESTIONS["invention_patent_count"], "沒有", update(invention_patent_count=0)),
+    (UP_TO_UTILITY, _QUESTIONS["utility_patent_count"], "12", update(utility_patent_count=12)),
+    (UP_TO_CERTIFICATION, _QUESTIONS["certification_count"], "2份", update(certification_count=2)),
+    (UP_TO_ESG, _QUESTIONS["esg_certification"], "無",
+     update(esg_certification_count=0, esg_certification="無")),
+    (UP_TO_ESG, _QUESTIONS["esg_certification"], "ISO 14064, ISO 14067",
+     update(esg_certification_count=2, esg_certification="ISO 14064, ISO 14067")),
+    (UP_TO_ESG, _QUESTIONS["esg_certification"], "ISO 14064-1、GRI Standards",
+     update(esg_certification_count=2, esg_certification="ISO 14064-1, GRI STANDARDS")),
+    (COMPLETE, _PRODUCTS_QUESTION, "完成", {"name": "mark_completed", "arguments": {"completed": True}}),
+]
+
+# Turns the router must leave to the LLM
+LLM_CASES = [
+    # Negations and uncertain answers are not industries
+    ({}, _QUESTIONS["industry"], "我們是食品業", None),
+    ({}, _QUESTIONS["industry"], "不是食品業", None),
+    ({}, _QUESTIONS["industry"], "我們不做電子業", None),
+    ({}, _QUESTIONS["industry"], "還不確定是哪個業", None),
+    ({}, _QUESTIONS["industry"], "我們主要做食品加工", None),
+    # Non-ESG ISO standards are company certifications
+    (UP_TO_ESG, _QUESTIONS["esg_certification"], "ISO 9001, ISO 22000", None),
+    (UP_TO_ESG, _QUESTIONS["esg_certification"], "ISO 14064, ISO 9001", None),
+    (UP_TO_ESG, _QUESTIONS["esg_certification"], "ISO 140641", None),
+    # A question about several fields at once
+    (UP_TO_CAPITAL, "請問貴公司的資本總額和發明專利數量分別是多少？", "5", None),
+    (UP_TO_INVENTION, "請問發明專利和新型專利各有幾件？", "3", None),
+    # The last message asked something else
+    (UP_TO_CAPITAL, "請問還有其他需要補充的嗎？", "5000000", None),
+    (UP_TO_CAPITAL, _QUESTIONS["capital_amount"], "大約五百萬左右", None),
+    # 完成 only counts after the product question
+    (COMPLETE, "還有其他問題嗎？", "完成", None),
+    (UP_TO_ESG, _PRODUCTS_QUESTION, "完成", None),
+]
+
+
+def test_routed_turns():
+    for filled, last_question, message, expected in ROUTED_CASES:
+        route = route_turn(message, make_onboarding(**filled), last_question)
+        assert route is not None, message
+        assert route["call"] == expected, message
+
+
+def test_unparseable_turns_go_to_llm():
+    for filled, last_question, message, expected in LLM_CASES:
+        assert route_turn(message, make_onboarding(**filled), last_question) is expected, message
+
+
+def test_route_reply_asks_next_question():
+    onboarding = make_onboarding(**UP_TO_CAPITAL)
+    route = route_turn("5000000", onboarding, _QUESTIONS["capital_amount"])
+    onboarding.capital_amount = 5_000_000
+
+    reply = route_reply(route, onboarding)
+
+    assert reply.startswith("好的，已記錄資本總額：5000000 臺幣。")
+    # The router's own reply is templated, so the next answer routes again
+    assert route_turn("3", onboarding, reply)["call"] == update(invention_patent_count=3)
+
+
+def test_route_message_falls_through_to_llm():
+    chat_router._routed.clear()
+    chat_router._stats["llm"] = 0
+    handler = AIChatbotHandler(db=None, user_id=1)
+    handler.onboarding_data = make_onboarding()
+    history = [SimpleNamespace(role="assistant", content=_QUESTIONS["industry"])]
+
+    assert asyncio.run(handler.route_message("我們是食品業", history)) is None
+    assert handler.onboarding_data.industry is None
+    assert get_router_stats() == {"routed": 0, "llm": 1, "hit_rate": 0.0, "by_rule": {}}
+
+
+def test_router_stats_hit_rate_is_rounded():
+    chat_router._routed.clear()
+    chat_router._stats["llm"] = 0
+    record_route("industry")
+    record_route(None)
+    record_route(None)
+
+    assert get_router_stats()["hit_rate"] == 0.3333
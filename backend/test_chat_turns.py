@@ -0,0 +1,129 @@
+"""
+Tests for the chat turn unit of work in AIChatbotHandler
+
+Runs turns (and document extraction jobs) against an in-memory SQLite database
+(aiosqlite) with a fake AsyncOpenAI client, so no Postgres server or API key is needed.
+Run with: python -m pytest test_chat_turns.py
+"""
+
+import asyncio
+from types import SimpleNamespace
+from typing import List
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import extraction_jobs
+import llm_response_cache
+from ai_chatbot_handler import AIChatbotHandler
+from extraction_jobs import enqueue_extraction_job
+from llm_limiter import LLMOverloadedError
+from models import ChatMessage, ExtractionJob, ExtractionJobStatus
+
+
+class RecordingCompletions:
+    """client.chat.completions whose create() records whether any of the db sessions was in a transaction"""
+
+    def __init__(self, sessions: List[AsyncSession], error: Exception = None):
+        self.sessions = sessions
+        self.error = error
+        self.in_transaction = []
+
+    async def create(self, **kwargs):
+        self.in_transaction.append(any(db.in_transaction() for db in self.sessions))
+        if self.error:
+            raise self.error
+        message = SimpleNamespace(content="好的，已記錄。", tool_calls=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+async def create_session(session_factory) -> int:
+    async with session_factory() as db:
+        handler = AIChatbotHandler(db, user_id=1)
+        async with handler.turn():
+            session = await handler.create_session()
+            await handler.add_message("assistant", "歡迎")
+        return session.id
+
+
+async def message_roles(session_factory, session_id: int):
+    async with session_factory() as db:
+        result = await db.execute(
+            select(ChatMessage).where(ChatMessage.session_id == session_id).order_by(ChatMessage.created_at, ChatMessage.id)
+        )
+        return [(message.role, message.content) for message in result.scalars()]
+
+
+async def run_turn(session_factory, install_llm_client, session_id: int, error: Exception = None):
+    async with session_factory() as db:
+        completions = install_llm_client(RecordingCompletions([db], error))
+
+        handler = AIChatbotHandler(db, user_id=1, session_id=session_id)
+        await handler.load_session()
+        try:
+            async with handler.turn():
+                await handler.add_message("user", "你好")
+                bot_response, _ = await handler.process_message("你好")
+                await handler.add_message("assistant", bot_response)
+        except LLMOverloadedError:
+            pass
+        return completions
+
+
+def test_llm_call_runs_outside_a_transaction(run_with_database, install_llm_client):
+    async def test(session_factory):
+        session_id = await create_session(session_factory)
+        completions = await run_turn(session_factory, install_llm_client, session_id)
+
+        # The turn's reads were ended and its writes were still buffered during the call
+        assert completions.in_transaction == [False]
+        assert await message_roles(session_factory, session_id) == [
+            ("assistant", "歡迎"), ("user", "你好"), ("assistant", "好的，已記錄。")
+        ]
+
+    run_with_database(test)
+
+
+def test_failed_turn_leaves_no_user_message(run_with_database, install_llm_client):
+    async def test(session_factory):
+        session_id = await create_session(session_factory)
+        completions = await run_turn(session_factory, install_llm_client, session_id, error=LLMOverloadedError(5))
+
+        assert completions.in_transaction == [False]
+        assert await message_roles(session_factory, session_id) == [("assistant", "歡迎")]
+
+    run_with_database(test)
+
+
+def test_document_extraction_runs_outside_a_transaction(run_with_database, install_llm_client, monkeypatch):
+    async def test(session_factory):
+        sessions = []
+
+        def tracking_session_factory():
+            db = session_factory()
+            sessions.append(db)
+            return db
+
+        async def process_file(file_content, filename, content_type):
+            return {"success": True, "extracted_text": file_content.decode()}
+
+        monkeypatch.setattr(extraction_jobs, "AsyncSessionLocal", tracking_session_factory)
+        monkeypatch.setattr(llm_response_cache, "AsyncSessionLocal", tracking_session_factory)
+        monkeypatch.setattr(extraction_jobs, "process_file_in_pool", process_file)
+        monkeypatch.setattr(extraction_jobs.settings, "use_ai_chatbot", True)
+        completions = install_llm_client(RecordingCompletions(sessions))
+
+        session_id = await create_session(session_factory)
+        async with session_factory() as db:
+            job = await enqueue_extraction_job(db, 1, session_id, "資本額 500 萬".encode(), "company.txt", "text/plain")
+        await asyncio.gather(*extraction_jobs._running_jobs)
+
+        # Neither the job's session nor the response cache lookup held a transaction during the call
+        assert completions.in_transaction == [False]
+        async with session_factory() as db:
+            assert (await db.get(ExtractionJob, job.id)).status == ExtractionJobStatus.SUCCEEDED
+        assert await message_roles(session_factory, session_id) == [
+            ("assistant", "歡迎"), ("assistant", "📄 已處理文件：company.txt\n\n好的，已記錄。")
+        ]
+
+    run_with_database(test)
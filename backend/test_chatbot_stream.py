@@ -0,0 +1,158 @@
+"""
+Tests for the streamed chat reply (POST /api/chatbot/message/stream)
+
+Streams turns from a fake AsyncOpenAI client that sends content and tool call
+deltas like the real API, on a SQLite database, so no Postgres server or API
+key is needed.
+Run with: python -m pytest test_chatbot_stream.py
+"""
+
+import json
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+import ai_chatbot_handler
+import llm_context
+import main
+from ai_chatbot_handler import AIChatbotHandler
+from main import stream_chat_turn
+from models import CompanyOnboarding, Product
+
+
+def content_chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content, tool_calls=None))], usage=None)
+
+
+def tool_call_chunk(index, name=None, arguments=None):
+    tool_call = SimpleNamespace(index=index, function=SimpleNamespace(name=name, arguments=arguments))
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None, tool_calls=[tool_call]))], usage=None)
+
+
+# Two tool calls whose deltas interleave, between content deltas, then the usage chunk
+CHUNKS = [
+    content_chunk("好的，"),
+    tool_call_chunk(0, "update_company_data", '{"industry": "食'),
+    tool_call_chunk(1, "add_product", '{"product_name"'),
+    tool_call_chunk(0, arguments='品業", "capital_amount": "5,000,000"}'),
+    tool_call_chunk(1, arguments=': "醬油"}'),
+    content_chunk("已記錄。"),
+    SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=120, completion_tokens=30)),
+]
+
+
+class StreamingCompletions:
+    """client.chat.completions whose create(stream=True) streams CHUNKS"""
+
+    def __init__(self, sessions=()):
+        self.sessions = sessions
+        self.requests = []
+        self.in_transaction = []
+
+    async def create(self, **kwargs):
+        self.requests.append(kwargs)
+        self.in_transaction.append(any(db.in_transaction() for db in self.sessions))
+
+        async def stream():
+            for chunk in CHUNKS:
+                yield chunk
+        return stream()
+
+
+@pytest.fixture
+def llm_stream(install_llm_client, monkeypatch):
+    """Chat turns go to the LLM (no rule router); reported usage goes to throwaway totals"""
+    monkeypatch.setattr(ai_chatbot_handler.settings, "use_ai_chatbot", True)
+    monkeypatch.setattr(ai_chatbot_handler.settings, "rule_router_enabled", False)
+    monkeypatch.setattr(llm_context, "_usage", dict(llm_context._usage))
+    return lambda sessions=(): install_llm_client(StreamingCompletions(sessions))
+
+
+def parse_sse(body: str):
+    """[(event, data), ...] from a Server-Sent Events body"""
+    events = []
+    for frame in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in frame.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_stream_assembles_tool_calls_by_index(run_with_database, llm_stream):
+    async def test(session_factory):
+        completions = llm_stream()
+        async with session_factory() as db:
+            handler = AIChatbotHandler(db, user_id=1)
+            async with handler.turn():
+                session = await handler.create_session()
+                await handler.add_message("assistant", "歡迎")
+
+        async with session_factory() as db:
+            handler = AIChatbotHandler(db, user_id=1, session_id=session.id)
+            await handler.load_session()
+            events = [event async for event in stream_chat_turn(handler, "我們是食品業", use_ai=True)]
+
+        assert completions.requests[0]["stream"] is True
+        # Tokens as they arrive, then done once the tool calls are applied and saved
+        assert [(event["type"], event.get("content")) for event in events] == [
+            ("token", "好的，"), ("token", "已記錄。"), ("done", None)
+        ]
+        assert events[-1]["message"] == "好的，已記錄。"
+        assert events[-1]["progress"]["products_count"] == 1
+
+        async with session_factory() as db:
+            onboarding = await db.scalar(select(CompanyOnboarding).where(CompanyOnboarding.chat_session_id == session.id))
+            products = (await db.scalars(select(Product).where(Product.onboarding_id == onboarding.id))).all()
+        assert (onboarding.industry, onboarding.capital_amount) == ("食品業", 5000000)
+        assert [product.product_name for product in products] == ["醬油"]
+        assert llm_context._usage["completion_tokens"] == 30
+
+    run_with_database(test)
+
+
+def test_sse_endpoint_streams_tokens_then_done(api, llm_stream, monkeypatch):
+    sessions = []
+
+    def tracking_session_factory():
+        db = api.async_session_local()
+        sessions.append(db)
+        return db
+
+    monkeypatch.setattr(main, "AsyncSessionLocal", tracking_session_factory)
+    completions = llm_stream(sessions)
+    headers = {"Authorization": f"Bearer {api.token()}"}
+
+    # Without a session id the stream creates one and sends the welcome message
+    response = api.client.post("/api/chatbot/message/stream", json={"message": "你好"}, headers=headers)
+    welcome = parse_sse(response.text)
+    assert [event for event, _ in welcome] == ["token", "done"]
+    session_id = welcome[-1][1]["session_id"]
+
+    lock_waits = []
+    session_turn_lock = main.session_turn_lock
+
+    @asynccontextmanager
+    async def recording_turn_lock(session_id):
+        lock_waits.append([db.in_transaction() for db in sessions])
+        async with session_turn_lock(session_id):
+            yield
+
+    monkeypatch.setattr(main, "session_turn_lock", recording_turn_lock)
+    sessions.clear()
+
+    response = api.client.post(
+        "/api/chatbot/message/stream", json={"message": "我們是食品業", "session_id": session_id}, headers=headers
+    )
+    events = parse_sse(response.text)
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert events == [
+        ("token", {"content": "好的，"}),
+        ("token", {"content": "已記錄。"}),
+        ("done", events[-1][1]),
+    ]
+    assert (events[-1][1]["session_id"], events[-1][1]["message"]) == (session_id, "好的，已記錄。")
+    # Neither the wait for the turn lock nor the LLM call held a read transaction
+    assert lock_waits == [[False]]
+    assert completions.in_transaction == [False]
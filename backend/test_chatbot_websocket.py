@@ -0,0 +1,126 @@
+"""
+Tests for the WebSocket chat channel (/ws/chatbot/{session_id})
+
+Runs main.app in a TestClient on a SQLite database with the rule-based
+chatbot, so no Postgres server or API key is needed.
+Run with: python -m pytest test_chatbot_websocket.py
+"""
+
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+import main
+from main import WS_CLOSE_UNAUTHORIZED
+from models import ChatSession, CompanyOnboarding
+
+
+@pytest.fixture
+def chat(api, monkeypatch):
+    """The api fixture with the rule-based chatbot and a chat session of alice's"""
+    monkeypatch.setattr(main.get_settings(), "use_ai_chatbot", False)
+    with api.session_local() as db:
+        session = ChatSession(user_id=1)
+        db.add(session)
+        db.flush()
+        db.add(CompanyOnboarding(chat_session_id=session.id, user_id=1, is_current=True))
+        db.commit()
+        api.session_id = session.id
+    return api
+
+
+def assert_closed(websocket, code: int, reason: str = None):
+    with pytest.raises(WebSocketDisconnect) as closed:
+        websocket.receive_json()
+    assert closed.value.code == code
+    if reason is not None:
+        assert closed.value.reason == reason
+
+
+@contextmanager
+def connect(chat, token: str):
+    """Open the socket and authenticate; yields (websocket, ready frame)"""
+    with chat.client.websocket_connect(f"/ws/chatbot/{chat.session_id}") as websocket:
+        websocket.send_json({"type": "auth", "token": token})
+        yield websocket, websocket.receive_json()
+
+
+def chat_turn(connection, message: str):
+    """Send one message and collect frames up to its done frame"""
+    connection.send_json({"message": message})
+    frames = [connection.receive_json()]
+    while frames[-1]["type"] not in ("done", "error"):
+        frames.append(connection.receive_json())
+    return frames
+
+
+def test_first_frame_must_authenticate(chat):
+    with chat.client.websocket_connect(f"/ws/chatbot/{chat.session_id}") as websocket:
+        websocket.send_json({"message": "你好"})
+        assert_closed(websocket, WS_CLOSE_UNAUTHORIZED)
+
+    with chat.client.websocket_connect(f"/ws/chatbot/{chat.session_id}") as websocket:
+        websocket.send_json({"type": "auth", "token": chat.token() + "tampered"})
+        assert_closed(websocket, WS_CLOSE_UNAUTHORIZED, "Could not validate credentials")
+
+
+def test_authentication_times_out(chat, monkeypatch):
+    monkeypatch.setattr(main, "WS_AUTH_TIMEOUT_SECONDS", 0.05)
+
+    with chat.client.websocket_connect(f"/ws/chatbot/{chat.session_id}") as websocket:
+        assert_closed(websocket, WS_CLOSE_UNAUTHORIZED, "Authentication timed out")
+
+
+def test_other_users_session_is_refused(chat):
+    with chat.client.websocket_connect(f"/ws/chatbot/{chat.session_id}") as websocket:
+        websocket.send_json({"type": "auth", "token": chat.token("43")})
+        assert_closed(websocket, 1008, "Chat session not found")
+
+
+def test_authenticated_turn_and_idle_connection(chat, monkeypatch):
+    sessions = []
+
+    def tracking_session_factory():
+        db = chat.async_session_local()
+        sessions.append(db)
+        return db
+
+    monkeypatch.setattr(main, "AsyncSessionLocal", tracking_session_factory)
+
+    with connect(chat, chat.token(exp=int(time.time()) + 300)) as (websocket, ready):
+        assert (ready["type"], ready["session_id"]) == ("ready", chat.session_id)
+        # Waiting for the first message holds no read transaction (and so no pooled connection)
+        assert [db.in_transaction() for db in sessions] == [False]
+
+        frames = chat_turn(websocket, "1")
+        assert [frame["type"] for frame in frames] == ["token", "done"]
+        assert frames[-1]["message"] == frames[0]["content"]
+        assert [db.in_transaction() for db in sessions] == [False]
+
+
+def test_expired_token_closes_before_the_next_turn(chat, monkeypatch):
+    exp = int(time.time()) + 300
+    with connect(chat, chat.token(exp=exp)) as (websocket, ready):
+        assert chat_turn(websocket, "1")[-1]["type"] == "done"
+
+        monkeypatch.setattr(main, "time", SimpleNamespace(time=lambda: exp + 1))
+        websocket.send_json({"message": "2"})
+        assert_closed(websocket, WS_CLOSE_UNAUTHORIZED, "Token has expired")
+
+
+def test_refreshed_token_keeps_the_connection_open(chat, monkeypatch):
+    exp = int(time.time()) + 300
+    with connect(chat, chat.token(exp=exp)) as (websocket, ready):
+        websocket.send_json({"type": "auth", "token": chat.token(exp=exp + 3600)})
+        monkeypatch.setattr(main, "time", SimpleNamespace(time=lambda: exp + 1))
+
+        assert chat_turn(websocket, "1")[-1]["type"] == "done"
+
+
+def test_refreshed_token_must_be_the_same_user(chat):
+    with connect(chat, chat.token(exp=int(time.time()) + 300)) as (websocket, ready):
+        websocket.send_json({"type": "auth", "token": chat.token("43", exp=int(time.time()) + 300)})
+        assert_closed(websocket, 1008, "Token belongs to another user")
@@ -0,0 +1,72 @@
+"""
+Tests for text column and archive compression
+
+Run with: python -m pytest test_compression.py
+"""
+
+from contextlib import contextmanager
+
+import compression
+from compression import (
+    CODEC_ZSTD, CODEC_ZLIB, compress_text, decompress_text, compress_json, decompress_json
+)
+
+
+# Mixed CJK and ASCII, well above the default 1 KB threshold
+LONG_TEXT = "公司名稱：綠色科技股份有限公司。ESG 報告採用 GRI Standards 與 ISO 14064-1。\n" * 40
+
+
+@contextmanager
+def text_settings(**overrides):
+    """Temporarily override text compression settings"""
+    original = {name: getattr(compression.settings, name) for name in overrides}
+    for name, value in overrides.items():
+        setattr(compression.settings, name, value)
+    try:
+        yield
+    finally:
+        for name, value in original.items():
+            setattr(compression.settings, name, value)
+
+
+def test_round_trip_with_each_codec():
+    for configured in (CODEC_ZSTD, CODEC_ZLIB):
+        with text_settings(text_compression_codec=configured):
+            plain, codec, blob = compress_text(LONG_TEXT)
+
+        # Without zstandard installed, zstd falls back to zlib
+        expected = configured if compression.ZSTD_AVAILABLE else CODEC_ZLIB
+        assert (plain, codec) == (None, expected)
+        assert len(blob) < len(LONG_TEXT.encode("utf-8"))
+        assert decompress_text(codec, blob) == LONG_TEXT
+
+
+def test_short_or_incompressible_text_stays_plain():
+    assert compress_text(None) == (None, None, None)
+    assert compress_text("你好") == ("你好", None, None)
+
+    with text_settings(text_compression_min_bytes=16, text_compression_codec=CODEC_ZLIB):
+        assert compress_text("x" * 15) == ("x" * 15, None, None)
+        # Above the threshold but too short to shrink once the zlib header is added
+        assert compress_text("abcdefghijklmnopq") == ("abcdefghijklmnopq", None, None)
+        assert compress_text("x" * 64)[1] == CODEC_ZLIB
+
+    with text_settings(text_compression_enabled=False):
+        assert compress_text(LONG_TEXT) == (LONG_TEXT, None, None)
+
+
+def test_unknown_codec_is_rejected():
+    try:
+        decompress_text("lz4", b"\x00")
+        raise AssertionError("an unknown codec must be rejected")
+    except ValueError as e:
+        assert "lz4" in str(e)
+
+
+def test_json_archive_round_trip():
+    transcript = [{"role": "user", "content": "你好"}, {"role": "assistant", "content": LONG_TEXT}]
+
+    blob = compress_json(transcript)
+
+    assert decompress_json(blob) == transcript
+    assert len(blob) < len(LONG_TEXT.encode("utf-8"))
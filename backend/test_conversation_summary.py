@@ -0,0 +1,217 @@
+"""
+Tests for the rolling conversation summary
+
+Refreshes run against an in-memory SQLite database (aiosqlite) with a fake
+AsyncOpenAI client, so no Postgres server or API key is needed.
+Run with: python -m pytest test_conversation_summary.py
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+import conversation_summary
+from ai_chatbot_handler import AIChatbotHandler
+from conversation_summary import schedule_summary_refresh, refresh_session_summary
+from models import ChatMessage, ChatSession
+
+WINDOW = AIChatbotHandler.HISTORY_WINDOW
+
+
+class SummaryCompletions:
+    """client.chat.completions that returns a fixed summary and records each prompt"""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.prompts = []
+        self.in_transaction = []
+
+    async def create(self, **kwargs):
+        self.prompts.append(kwargs["messages"][-1]["content"])
+        self.in_transaction.append(any(db.in_transaction() for db in self.sessions))
+        message = SimpleNamespace(content=f"摘要 {len(self.prompts)}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def run_summaries(run_with_database, install_llm_client, monkeypatch):
+    """Like run_with_database, with refreshes on the test database; test(session_factory, completions)"""
+    monkeypatch.setattr(conversation_summary.settings, "summary_refresh_turns", 5)
+
+    def run(test):
+        async def with_summary_database(session_factory):
+            sessions = []
+
+            def tracking_session_factory():
+                db = session_factory()
+                sessions.append(db)
+                return db
+
+            monkeypatch.setattr(conversation_summary, "AsyncSessionLocal", tracking_session_factory)
+            await test(session_factory, install_llm_client(SummaryCompletions(sessions)))
+
+        run_with_database(with_summary_database)
+    return run
+
+
+async def create_session_with_messages(session_factory, count: int) -> ChatSession:
+    """A session with `count` alternating user/assistant messages numbered 1..count"""
+    start = datetime(2026, 1, 1, 9, 0, 0)
+    async with session_factory() as db:
+        session = ChatSession(user_id=1)
+        db.add(session)
+        await db.flush()
+        db.add_all([
+            ChatMessage(session_id=session.id, role="user" if number % 2 else "assistant",
+                        content=f"訊息 {number}", created_at=start + timedelta(seconds=number))
+            for number in range(1, count + 1)
+        ])
+        await db.commit()
+        return session
+
+
+async def message_id(session_factory, session_id: int, number: int) -> int:
+    async with session_factory() as db:
+        return await db.scalar(
+            select(ChatMessage.id).where(ChatMessage.session_id == session_id, ChatMessage.content == f"訊息 {number}")
+        )
+
+
+def test_refresh_folds_everything_but_the_recent_window(run_summaries):
+    async def test(session_factory, completions):
+        session = await create_session_with_messages(session_factory, WINDOW + 14)
+
+        summary, through_message_id = await refresh_session_summary(session.id)
+
+        # Messages 1-14 are folded; the newest WINDOW messages stay out of the summary
+        prompt = completions.prompts[0]
+        assert "訊息 1\n" in prompt and "訊息 14" in prompt
+        assert "訊息 15" not in prompt
+        assert summary == "摘要 1"
+        assert through_message_id == await message_id(session_factory, session.id, 14)
+        async with session_factory() as db:
+            stored = await db.get(ChatSession, session.id)
+            assert (stored.summary, stored.summary_through_message_id) == (summary, through_message_id)
+
+    run_summaries(test)
+
+
+def test_refresh_waits_for_enough_messages_past_the_window(run_summaries):
+    async def test(session_factory, completions):
+        # Folding needs SUMMARY_REFRESH_TURNS turns (2 messages each) beyond the window
+        session = await create_session_with_messages(session_factory, WINDOW + 9)
+        assert await refresh_session_summary(session.id) is None
+
+        async with session_factory() as db:
+            db.add(ChatMessage(session_id=session.id, role="assistant", content="訊息 30"))
+            await db.commit()
+        summary, through_message_id = await refresh_session_summary(session.id)
+        assert through_message_id == await message_id(session_factory, session.id, 10)
+
+        # Only messages after the summary count towards the next refresh
+        assert await refresh_session_summary(session.id, through_message_id) is None
+        assert len(completions.prompts) == 1
+        assert completions.prompts[0].startswith("先前摘要：\n（無）")
+
+    run_summaries(test)
+
+
+def test_llm_call_runs_outside_a_transaction(run_summaries):
+    async def test(session_factory, completions):
+        session = await create_session_with_messages(session_factory, WINDOW + 10)
+
+        assert await refresh_session_summary(session.id) is not None
+        assert completions.in_transaction == [False]
+
+    run_summaries(test)
+
+
+def test_summary_moved_on_during_the_call_is_kept(run_summaries):
+    async def test(session_factory, completions):
+        session = await create_session_with_messages(session_factory, WINDOW + 10)
+
+        original_create = completions.create
+
+        async def create_after_another_refresh(**kwargs):
+            async with session_factory() as db:
+                stored = await db.get(ChatSession, session.id)
+                stored.summary, stored.summary_through_message_id = "另一個摘要", 3
+                await db.commit()
+            return await original_create(**kwargs)
+
+        completions.create = create_after_another_refresh
+        assert await refresh_session_summary(session.id) is None
+        async with session_factory() as db:
+            assert (await db.get(ChatSession, session.id)).summary == "另一個摘要"
+
+    run_summaries(test)
+
+
+def test_refresh_is_scheduled_every_few_turns(monkeypatch):
+    monkeypatch.setattr(conversation_summary.settings, "summary_refresh_turns", 3)
+    conversation_summary._turns_since_check.clear()
+    refreshes = []
+
+    async def refresh(session_id, summary_through_message_id=None):
+        refreshes.append((session_id, summary_through_message_id))
+        return "摘要", 12
+
+    monkeypatch.setattr(conversation_summary, "refresh_session_summary", refresh)
+
+    async def run():
+        session = ChatSession(id=1, summary_through_message_id=4)
+        other = ChatSession(id=2)
+        started = []
+        for _ in range(7):
+            started.append(schedule_summary_refresh(session) is not None)
+            # Let a started refresh finish, including its done callback
+            await asyncio.gather(*conversation_summary._running_refreshes)
+            await asyncio.sleep(0)
+        # Turns are counted per session
+        assert schedule_summary_refresh(other) is None
+        return session, started
+
+    session, started = asyncio.run(run())
+
+    assert started == [False, False, True, False, False, True, False]
+    assert refreshes == [(1, 4), (1, 12)]
+    # The finished refresh is applied to the caller's session object
+    assert (session.summary, session.summary_through_message_id) == ("摘要", 12)
+
+
+def test_one_refresh_per_session_at_a_time(monkeypatch):
+    monkeypatch.setattr(conversation_summary.settings, "summary_refresh_turns", 1)
+    conversation_summary._turns_since_check.clear()
+    release = None
+
+    async def refresh(session_id, summary_through_message_id=None):
+        await release.wait()
+        return None
+
+    monkeypatch.setattr(conversation_summary, "refresh_session_summary", refresh)
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        session = ChatSession(id=1)
+        first = schedule_summary_refresh(session)
+        second = schedule_summary_refresh(session)
+        release.set()
+        await first
+        await asyncio.sleep(0)
+        return first, second, schedule_summary_refresh(session)
+
+    first, second, after = asyncio.run(run())
+
+    assert first is not None and second is None
+    assert after is not None
+
+
+def test_disabled_summary_schedules_nothing(monkeypatch):
+    monkeypatch.setattr(conversation_summary.settings, "summary_enabled", False)
+    monkeypatch.setattr(conversation_summary.settings, "summary_refresh_turns", 1)
+
+    assert schedule_summary_refresh(ChatSession(id=1)) is None
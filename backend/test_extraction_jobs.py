@@ -0,0 +1,137 @@
+"""
+Tests for background document extraction jobs
+
+Jobs run against an in-memory SQLite database (aiosqlite) with file extraction
+replaced by a coroutine, so no Postgres server, worker pool or API key is needed.
+Run with: python -m pytest test_extraction_jobs.py
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import extraction_jobs
+from extraction_jobs import enqueue_extraction_job, fail_interrupted_jobs, fail_if_stale, INTERRUPTED_ERROR
+from models import ExtractionJob, ExtractionJobStatus
+
+
+@pytest.fixture
+def run_jobs(run_with_database, monkeypatch):
+    """Like run_with_database, with extraction_jobs opening its sessions on the test database"""
+    def run(test):
+        async def with_jobs_database(session_factory):
+            monkeypatch.setattr(extraction_jobs, "AsyncSessionLocal", session_factory)
+            await test(session_factory)
+
+        run_with_database(with_jobs_database)
+    return run
+
+
+async def job_status(session_factory, job_id: int) -> ExtractionJob:
+    async with session_factory() as db:
+        return await db.get(ExtractionJob, job_id)
+
+
+@pytest.fixture
+def run_without_ai(run_jobs, monkeypatch):
+    """Like run_jobs, with the AI disabled; test(session_factory, process_file) installs the file processor"""
+    monkeypatch.setattr(extraction_jobs.settings, "use_ai_chatbot", False)
+
+    def run(test):
+        def install(process_file):
+            monkeypatch.setattr(extraction_jobs, "process_file_in_pool", process_file)
+
+        run_jobs(lambda session_factory: test(session_factory, install))
+    return run
+
+
+def test_job_lifecycle_succeeds(run_without_ai):
+    seen_statuses = []
+
+    async def test(session_factory, install_file_processor):
+        async def process_file(file_content, filename, content_type):
+            seen_statuses.append((await job_status(session_factory, job.id)).status)
+            return {"success": True, "extracted_text": file_content.decode()}
+        install_file_processor(process_file)
+
+        async with session_factory() as db:
+            job = await enqueue_extraction_job(db, 1, 1, "資本額 500 萬".encode(), "company.txt", "text/plain")
+        assert job.status == ExtractionJobStatus.PENDING
+
+        await asyncio.gather(*extraction_jobs._running_jobs)
+        finished = await job_status(session_factory, job.id)
+
+        assert seen_statuses == [ExtractionJobStatus.RUNNING]
+        assert finished.status == ExtractionJobStatus.SUCCEEDED
+        assert finished.to_dict()["result"]["extracted_text"] == "資本額 500 萬"
+        assert finished.started_at is not None and finished.finished_at is not None
+
+    run_without_ai(test)
+
+
+def test_job_lifecycle_fails(run_without_ai):
+    async def test(session_factory, install_file_processor):
+        async def process_file(file_content, filename, content_type):
+            return {"success": False, "error": "No text could be extracted from the file"}
+        install_file_processor(process_file)
+
+        async with session_factory() as db:
+            job = await enqueue_extraction_job(db, 1, 1, b"", "empty.pdf", "application/pdf")
+        await asyncio.gather(*extraction_jobs._running_jobs)
+        finished = await job_status(session_factory, job.id)
+
+        assert finished.status == ExtractionJobStatus.FAILED
+        assert finished.error == "No text could be extracted from the file"
+        assert finished.result is None
+
+    run_without_ai(test)
+
+
+async def add_job(session_factory, status: ExtractionJobStatus, age: timedelta) -> int:
+    async with session_factory() as db:
+        job = ExtractionJob(user_id=1, filename="lost.pdf", status=status, created_at=datetime.utcnow() - age)
+        db.add(job)
+        await db.commit()
+        return job.id
+
+
+def test_startup_fails_jobs_left_by_a_dead_process(run_jobs):
+    async def test(session_factory):
+        pending = await add_job(session_factory, ExtractionJobStatus.PENDING, timedelta(seconds=5))
+        running = await add_job(session_factory, ExtractionJobStatus.RUNNING, timedelta(seconds=5))
+        succeeded = await add_job(session_factory, ExtractionJobStatus.SUCCEEDED, timedelta(seconds=5))
+
+        assert await fail_interrupted_jobs() == 2
+        for job_id in (pending, running):
+            job = await job_status(session_factory, job_id)
+            assert (job.status, job.error) == (ExtractionJobStatus.FAILED, INTERRUPTED_ERROR)
+        assert (await job_status(session_factory, succeeded)).status == ExtractionJobStatus.SUCCEEDED
+
+    run_jobs(test)
+
+
+def test_multiple_workers_only_fail_stale_jobs(run_jobs, monkeypatch):
+    monkeypatch.setattr(extraction_jobs.settings, "session_lock_backend", "postgres")
+
+    async def test(session_factory):
+        max_age = timedelta(seconds=extraction_jobs.settings.extraction_job_max_seconds)
+        recent = await add_job(session_factory, ExtractionJobStatus.RUNNING, timedelta(seconds=5))
+        stale = await add_job(session_factory, ExtractionJobStatus.RUNNING, max_age + timedelta(seconds=5))
+        polled = await add_job(session_factory, ExtractionJobStatus.RUNNING, timedelta(seconds=5))
+
+        # Another worker may still be running the recent job
+        assert await fail_interrupted_jobs() == 1
+        assert (await job_status(session_factory, recent)).status == ExtractionJobStatus.RUNNING
+        assert (await job_status(session_factory, stale)).status == ExtractionJobStatus.FAILED
+
+        # Polling ends once an unfinished job is older than any job can run
+        async with session_factory() as db:
+            job = await db.get(ExtractionJob, polled)
+            await fail_if_stale(db, job)
+            assert job.status == ExtractionJobStatus.RUNNING
+            job.created_at -= max_age
+            await fail_if_stale(db, job)
+        assert (await job_status(session_factory, polled)).status == ExtractionJobStatus.FAILED
+
+    run_jobs(test)
@@ -0,0 +1,68 @@
+"""
+Tests for the file extraction process pool
+
+Worker jobs are replaced by a function that sleeps for as many seconds as the
+file content says, so no PDF/OCR libraries are needed.
+Run with: python -m pytest test_file_processor.py
+"""
+
+import asyncio
+import os
+import runpy
+import time
+
+import file_processor
+from file_processor import process_file_in_pool, shutdown_extraction_pool
+
+
+JOB_TIMEOUT = 5.0  # Leaves time for a spawned worker to start up
+
+
+def sleeping_worker(file_content: bytes, filename: str, content_type: str):
+    """Stand-in for _process_file_in_worker (must be importable by spawned workers)"""
+    time.sleep(float(file_content))
+    return {"success": True, "filename": filename}
+
+
+def test_timed_out_job_is_terminated_and_pool_replaced():
+    original_worker = file_processor._process_file_in_worker
+    original_timeout = file_processor.settings.file_job_timeout_seconds
+    file_processor._process_file_in_worker = sleeping_worker
+    file_processor.settings.file_job_timeout_seconds = JOB_TIMEOUT
+
+    async def run():
+        hung_job = asyncio.create_task(process_file_in_pool(b"600", "hung.pdf", "application/pdf"))
+        await asyncio.sleep(JOB_TIMEOUT / 2)
+        hung_pool_processes = list(hung_pool._processes.values())
+        hung = await hung_job
+        # The next job gets a fresh pool and its whole timeout
+        return hung, hung_pool_processes, await process_file_in_pool(b"0", "next.pdf", "application/pdf")
+
+    try:
+        hung_pool = file_processor.get_extraction_pool()
+        hung, hung_pool_processes, next_result = asyncio.run(run())
+
+        assert hung == {
+            "success": False,
+            "error": f"File processing timed out after {JOB_TIMEOUT:g} seconds"
+        }
+        assert next_result == {"success": True, "filename": "next.pdf"}
+        assert file_processor._extraction_pool is not hung_pool
+
+        # The hung worker was killed rather than left sleeping
+        for process in hung_pool_processes:
+            process.join(timeout=5)
+            assert not process.is_alive()
+    finally:
+        shutdown_extraction_pool()
+        file_processor._extraction_slots = None
+        file_processor._process_file_in_worker = original_worker
+        file_processor.settings.file_job_timeout_seconds = original_timeout
+
+
+def test_worker_import_of_main_does_no_startup_work(capsys):
+    # What a spawned worker runs: the DATABASE_URL test server does not exist, so
+    # connecting to create tables would raise
+    runpy.run_path(os.path.join(os.path.dirname(__file__), "main.py"), run_name="__mp_main__")
+
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,104 @@
+"""
+Tests for the Idempotency-Key replay store
+
+Run with: python -m pytest test_idempotency.py
+"""
+
+import asyncio
+
+from fastapi import HTTPException
+from idempotency import IdempotencyStore, request_fingerprint
+
+
+KEY = (1, "chatbot_message", "key-1")
+
+
+class CountingTurn:
+    """Stands in for a chat turn; counts how often it actually runs"""
+
+    def __init__(self, delay: float = 0, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return {"session_id": 1, "message": f"reply {self.calls}"}
+
+
+def test_repeat_replays_first_response():
+    store = IdempotencyStore(maxsize=10, ttl=60)
+    turn = CountingTurn()
+    fingerprint = request_fingerprint("你好", 1)
+
+    async def run():
+        return [await store.run(KEY, fingerprint, turn) for _ in range(2)]
+
+    first, second = asyncio.run(run())
+
+    assert first == ({"session_id": 1, "message": "reply 1"}, False)
+    assert second == ({"session_id": 1, "message": "reply 1"}, True)
+    assert turn.calls == 1
+
+
+def test_concurrent_duplicates_run_once():
+    store = IdempotencyStore(maxsize=10, ttl=60)
+    turn = CountingTurn(delay=0.05)
+    fingerprint = request_fingerprint("你好", 1)
+
+    async def run():
+        return await asyncio.gather(*[store.run(KEY, fingerprint, turn) for _ in range(3)])
+
+    results = asyncio.run(run())
+
+    assert turn.calls == 1
+    assert [replayed for _, replayed in results] == [False, True, True]
+    assert len({body["message"] for body, _ in results}) == 1
+
+
+def test_key_reused_for_a_different_request_conflicts():
+    store = IdempotencyStore(maxsize=10, ttl=60)
+    turn = CountingTurn()
+
+    async def run():
+        await store.run(KEY, request_fingerprint("你好", 1), turn)
+        await store.run(KEY, request_fingerprint("再見", 1), turn)
+
+    try:
+        asyncio.run(run())
+        raise AssertionError("a different request with the same key must be rejected")
+    except HTTPException as e:
+        assert e.status_code == 422
+    assert turn.calls == 1
+
+
+def test_failed_request_is_not_stored():
+    store = IdempotencyStore(maxsize=10, ttl=60)
+    fingerprint = request_fingerprint("你好", 1)
+
+    async def run():
+        try:
+            await store.run(KEY, fingerprint, CountingTurn(error=RuntimeError("LLM failed")))
+        except RuntimeError:
+            pass
+        # The client may retry a failed request with the same key
+        return await store.run(KEY, fingerprint, CountingTurn())
+
+    assert asyncio.run(run()) == ({"session_id": 1, "message": "reply 1"}, False)
+
+
+def test_keys_are_scoped_per_user_and_route():
+    store = IdempotencyStore(maxsize=10, ttl=60)
+    turn = CountingTurn()
+    fingerprint = request_fingerprint("你好", 1)
+
+    async def run():
+        await store.run((1, "chatbot_message", "key-1"), fingerprint, turn)
+        await store.run((2, "chatbot_message", "key-1"), fingerprint, turn)
+        await store.run((1, "upload_file", "key-1"), fingerprint, turn)
+
+    asyncio.run(run())
+    assert turn.calls == 3
@@ -0,0 +1,75 @@
+"""
+Tests for the verified JWT payload cache
+
+Tokens are signed with the test secret; no database is needed.
+Run with: python -m pytest test_jwt_cache.py
+"""
+
+import time
+
+from fastapi import HTTPException
+from jose import jwt
+
+import auth
+from auth import decode_external_jwt, ALGORITHM
+
+
+def make_token(**claims) -> str:
+    return jwt.encode({"user_id": 42, "username": "alice", **claims}, auth.EXTERNAL_JWT_SECRET, algorithm=ALGORITHM)
+
+
+def cache_counts():
+    stats = auth.get_jwt_cache_stats()
+    return stats["hits"], stats["misses"]
+
+
+def test_verified_token_is_served_from_cache():
+    auth._jwt_cache.clear()
+    token = make_token(exp=int(time.time()) + 300)
+
+    first = decode_external_jwt(token)
+    hits_before, _ = cache_counts()
+    second = decode_external_jwt(token)
+
+    assert first == second and first["user_id"] == 42
+    assert cache_counts()[0] == hits_before + 1
+
+
+def test_cached_token_expires_at_exp():
+    auth._jwt_cache.clear()
+    exp = int(time.time()) + 1
+    token = make_token(exp=exp)
+
+    assert decode_external_jwt(token)["exp"] == exp
+    assert len(auth._jwt_cache) == 1
+
+    # Just past exp the entry is gone: the token is verified again instead of served from the cache
+    time.sleep(max(exp - time.time(), 0) + 0.05)
+    hits, misses = cache_counts()
+    try:
+        decode_external_jwt(token)
+    except HTTPException:
+        pass  # python-jose compares exp with whole seconds, so it may still accept the token
+    assert cache_counts() == (hits, misses + 1)
+
+    # Once the signature check rejects it, it is never cached again
+    time.sleep(max(exp + 1 - time.time(), 0) + 0.05)
+    try:
+        decode_external_jwt(token)
+        raise AssertionError("an expired token must be rejected")
+    except HTTPException as e:
+        assert e.status_code == 401
+    assert auth._jwt_cache.get(auth.hashlib.sha256(token.encode("utf-8")).digest()) is None
+
+
+def test_invalid_and_expired_tokens_are_not_cached():
+    auth._jwt_cache.clear()
+
+    for token in (make_token(exp=int(time.time()) - 10), make_token() + "tampered"):
+        try:
+            decode_external_jwt(token)
+            raise AssertionError("the token must be rejected")
+        except HTTPException as e:
+            assert e.status_code == 401
+
+    assert len(auth._jwt_cache) == 0
@@ -0,0 +1,74 @@
+"""
+Tests for token-budgeted context packing
+
+Run with: python -m pytest test_llm_context.py
+"""
+
+
+from llm_context import build_context, estimate_tokens, MESSAGE_OVERHEAD_TOKENS
+
+
+def message(role: str, tokens: int, tag: str) -> dict:
+    """A message whose estimate is `tokens` plus the per-message overhead"""
+    return {"role": role, "content": tag + "x" * (tokens - 1) * 4}
+
+
+PREFIX = [message("system", 10, "s")]
+USER = message("user", 10, "u")
+# Oldest first, 10 tokens + overhead each
+HISTORY = [message("user" if i % 2 == 0 else "assistant", 10, str(i)) for i in range(6)]
+COST = 10 + MESSAGE_OVERHEAD_TOKENS
+BASE = 2 * COST  # Prefix and user message
+
+
+def contents(messages):
+    return [m["content"][0] for m in messages]
+
+
+def test_estimates_cjk_per_character_and_ascii_per_four():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("公司名稱") == 4
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("ESG 報告") == 1 + 2
+
+
+def test_everything_fits():
+    messages, used = build_context(PREFIX, HISTORY, USER, budget=1000)
+
+    assert messages == PREFIX + HISTORY + [USER]
+    assert used == BASE + len(HISTORY) * COST
+
+
+def test_newest_history_is_kept_in_chronological_order():
+    # Room for exactly three history messages
+    messages, used = build_context(PREFIX, HISTORY, USER, budget=BASE + 3 * COST + COST - 1)
+
+    assert contents(messages) == ["s", "3", "4", "5", "u"]
+    assert used == BASE + 3 * COST
+
+
+def test_packing_stops_at_the_first_message_that_does_not_fit():
+    # A long message in the middle cuts off everything older, so history stays contiguous
+    history = HISTORY[:2] + [message("assistant", 200, "L")] + HISTORY[2:]
+
+    messages, _ = build_context(PREFIX, history, USER, budget=BASE + 6 * COST)
+
+    assert contents(messages) == ["s", "2", "3", "4", "5", "u"]
+
+
+def test_prefix_and_user_message_are_always_sent():
+    messages, used = build_context(PREFIX, HISTORY, USER, budget=1)
+
+    assert messages == PREFIX + [USER]
+    assert used == BASE
+
+
+def test_reserved_tokens_count_against_the_budget():
+    budget = BASE + 3 * COST
+
+    without_tools, _ = build_context(PREFIX, HISTORY, USER, budget=budget)
+    with_tools, used = build_context(PREFIX, HISTORY, USER, budget=budget, reserved=COST)
+
+    assert contents(without_tools) == ["s", "3", "4", "5", "u"]
+    assert contents(with_tools) == ["s", "4", "5", "u"]
+    assert used == COST + BASE + 2 * COST
@@ -0,0 +1,103 @@
+"""
+Tests for LLM admission control
+
+No OpenAI calls are made: slots are held by plain coroutines.
+Run with: python -m pytest test_llm_limiter.py
+"""
+
+import asyncio
+import json
+
+import llm_limiter
+from llm_limiter import LLMAdmissionController, LLMOverloadedError, get_llm_limiter, llm_overloaded_handler
+
+
+async def hold_slot(limiter: LLMAdmissionController, release: asyncio.Event):
+    async with limiter.slot():
+        await release.wait()
+
+
+def test_full_queue_is_shed_with_503_and_retry_after():
+    async def run():
+        limiter = LLMAdmissionController(max_concurrency=1, max_queue=1, queue_timeout=5, retry_after=7)
+        release = asyncio.Event()
+        holders = [asyncio.create_task(hold_slot(limiter, release)) for _ in range(2)]
+        await asyncio.sleep(0)  # One call in flight, one waiting
+
+        assert (limiter.in_flight, limiter.waiting) == (1, 1)
+        try:
+            async with limiter.slot():
+                raise AssertionError("a call beyond the queue must not be admitted")
+        except LLMOverloadedError as e:
+            error = e
+
+        release.set()
+        await asyncio.gather(*holders)
+        return limiter, error
+
+    limiter, error = asyncio.run(run())
+    response = asyncio.run(llm_overloaded_handler(None, error))
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
+    assert json.loads(response.body) == {"detail": "AI service is busy: LLM wait queue is full. Please retry later."}
+    assert limiter.get_stats()["admitted_total"] == 2
+    assert limiter.get_stats()["rejected_total"] == 1
+
+
+def test_queue_wait_times_out():
+    async def run():
+        limiter = LLMAdmissionController(max_concurrency=1, max_queue=5, queue_timeout=0.05, retry_after=3)
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold_slot(limiter, release))
+        await asyncio.sleep(0)
+
+        try:
+            async with limiter.slot():
+                raise AssertionError("the slot is held for longer than the queue timeout")
+        except LLMOverloadedError as e:
+            error = e
+
+        release.set()
+        await holder
+        return limiter, error
+
+    limiter, error = asyncio.run(run())
+
+    assert (error.retry_after, error.reason) == (3, "Timed out waiting for an LLM slot")
+    assert limiter.waiting == 0 and limiter.in_flight == 0
+
+
+def test_queued_call_runs_when_a_slot_frees():
+    async def run():
+        limiter = LLMAdmissionController(max_concurrency=1, max_queue=1, queue_timeout=5, retry_after=1)
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold_slot(limiter, release))
+        queued = asyncio.create_task(hold_slot(limiter, asyncio.Event()))
+        await asyncio.sleep(0)
+
+        assert limiter.is_overloaded()
+        release.set()
+        await holder
+        await asyncio.sleep(0)
+        queued.cancel()
+        return limiter
+
+    limiter = asyncio.run(run())
+
+    assert limiter.get_stats()["admitted_total"] == 2
+    assert not limiter.is_overloaded()
+
+
+def test_advisory_locks_count_towards_the_pool_cap(monkeypatch):
+    monkeypatch.setattr(llm_limiter.settings, "llm_max_concurrency", 8)
+    monkeypatch.setattr(llm_limiter.settings, "llm_max_queue", 22)
+    monkeypatch.setattr(llm_limiter, "SESSION_LOCK_POOL_SIZE", 12)
+    monkeypatch.setattr(llm_limiter, "_limiter", None)
+
+    assert (get_llm_limiter().max_concurrency, get_llm_limiter().max_queue) == (8, 22)
+
+    # Every admitted or queued turn also holds one of the lock pool's connections
+    monkeypatch.setattr(llm_limiter.settings, "session_lock_backend", "postgres")
+    monkeypatch.setattr(llm_limiter, "_limiter", None)
+    assert (get_llm_limiter().max_concurrency, get_llm_limiter().max_queue) == (8, 4)
@@ -0,0 +1,171 @@
+"""
+Tests for the document extraction response cache (llm_response_cache table)
+
+Runs against an in-memory SQLite database (aiosqlite) with a fake AsyncOpenAI
+client, so no Postgres server or API key is needed.
+Run with: python -m pytest test_llm_response_cache.py
+"""
+
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event, insert, select, update
+
+import llm_response_cache
+from ai_chatbot_handler import AIChatbotHandler
+from extraction_jobs import apply_document_extraction
+from llm_response_cache import get_cached_response, store_response
+from models import CompanyOnboarding, LLMResponseCache, Product
+
+DOCUMENT = "本公司為食品業，資本額 500 萬元，主要產品為醬油。"
+
+
+class ExtractionCompletions:
+    """client.chat.completions that extracts the company data and one product from DOCUMENT"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        tool_calls = [
+            SimpleNamespace(function=SimpleNamespace(name="update_company_data", arguments='{"industry": "食品業", "capital_amount": "5,000,000"}')),
+            SimpleNamespace(function=SimpleNamespace(name="add_product", arguments='{"product_name": "醬油"}')),
+        ]
+        message = SimpleNamespace(content="已填入公司資料。", tool_calls=tool_calls)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+@pytest.fixture
+def run_cache(run_with_database, monkeypatch):
+    """Like run_with_database, with the cache on the test database and fresh counters"""
+    monkeypatch.setattr(llm_response_cache, "_stats", {"hits": 0, "misses": 0, "stores": 0, "evictions": 0})
+
+    def run(test):
+        async def with_cache_database(session_factory):
+            monkeypatch.setattr(llm_response_cache, "AsyncSessionLocal", session_factory)
+            await test(session_factory)
+
+        run_with_database(with_cache_database)
+    return run
+
+
+async def cached_keys(session_factory):
+    async with session_factory() as db:
+        return set((await db.scalars(select(LLMResponseCache.cache_key))).all())
+
+
+async def extract_into_new_session(session_factory, user_id: int):
+    """Run apply_document_extraction on DOCUMENT in a new session; returns (result, onboarding, product names)"""
+    async with session_factory() as db:
+        handler = AIChatbotHandler(db, user_id=user_id)
+        async with handler.turn():
+            await handler.create_session()
+        async with handler.turn():
+            result = await apply_document_extraction(handler, "company.txt", DOCUMENT)
+
+    async with session_factory() as db:
+        onboarding = await db.scalar(select(CompanyOnboarding).where(CompanyOnboarding.chat_session_id == result["session_id"]))
+        products = (await db.scalars(select(Product.product_name).where(Product.onboarding_id == onboarding.id))).all()
+    return result, onboarding, products
+
+
+def test_same_document_replays_the_stored_tool_calls(run_cache, install_llm_client):
+    completions = install_llm_client(ExtractionCompletions())
+
+    async def test(session_factory):
+        first, _, _ = await extract_into_new_session(session_factory, user_id=1)
+        second, onboarding, products = await extract_into_new_session(session_factory, user_id=2)
+
+        assert completions.calls == 1
+        assert (first["cached"], second["cached"]) == (False, True)
+        # The replayed tool calls went through update_onboarding_data and add_product again
+        assert (second["data_updated"], second["products_added"], second["message"]) == (True, 1, "已填入公司資料。")
+        assert (onboarding.industry, onboarding.capital_amount) == ("食品業", 5000000)
+        assert products == ["醬油"]
+
+        async with session_factory() as db:
+            entry = await db.scalar(select(LLMResponseCache))
+        assert entry.hit_count == 1
+        assert json.loads(entry.response)["tool_calls"][1] == {"name": "add_product", "arguments": '{"product_name": "醬油"}'}
+
+    run_cache(test)
+    assert llm_response_cache.get_response_cache_stats()["hit_rate"] == 0.5
+
+
+def test_expired_entry_is_a_miss_and_is_replaced(run_cache, monkeypatch):
+    monkeypatch.setattr(llm_response_cache.settings, "llm_cache_ttl_seconds", 60)
+
+    async def test(session_factory):
+        await store_response("a", "gpt-test", {"message": "舊", "tool_calls": []})
+        async with session_factory() as db:
+            await db.execute(update(LLMResponseCache).values(created_at=datetime.utcnow() - timedelta(seconds=61)))
+            await db.commit()
+
+        assert await get_cached_response("a") is None
+
+        await store_response("a", "gpt-test", {"message": "新", "tool_calls": []})
+        assert (await get_cached_response("a"))["message"] == "新"
+        assert await cached_keys(session_factory) == {"a"}
+
+    run_cache(test)
+    assert llm_response_cache._stats == {"hits": 1, "misses": 1, "stores": 2, "evictions": 0}
+
+
+def test_store_that_loses_the_race_is_dropped(run_cache, monkeypatch):
+    async def test(session_factory):
+        def racing_session_factory():
+            db = session_factory()
+
+            # Another worker commits the same key between the delete and the insert. SQLite
+            # has one writer, so here its row lands in the same transaction and is rolled back too
+            @event.listens_for(db.sync_session, "before_flush", once=True)
+            def store_first(session, flush_context, instances):
+                now = datetime.utcnow()
+                session.execute(insert(LLMResponseCache).values(
+                    cache_key="a", model="gpt-test", response="{}", created_at=now, last_used_at=now
+                ))
+            return db
+
+        monkeypatch.setattr(llm_response_cache, "AsyncSessionLocal", racing_session_factory)
+        await store_response("a", "gpt-test", {"message": "重複", "tool_calls": []})
+
+        assert await cached_keys(session_factory) == set()
+
+    run_cache(test)
+    assert llm_response_cache._stats["stores"] == 0
+
+
+def test_least_recently_used_entries_are_evicted(run_cache, monkeypatch):
+    monkeypatch.setattr(llm_response_cache.settings, "llm_cache_max_entries", 2)
+
+    async def test(session_factory):
+        await store_response("a", "gpt-test", {"message": "a", "tool_calls": []})
+        await store_response("b", "gpt-test", {"message": "b", "tool_calls": []})
+        async with session_factory() as db:
+            hour_ago = datetime.utcnow() - timedelta(hours=1)
+            await db.execute(update(LLMResponseCache).where(LLMResponseCache.cache_key == "a").values(last_used_at=hour_ago))
+            await db.execute(update(LLMResponseCache).where(LLMResponseCache.cache_key == "b").values(last_used_at=hour_ago + timedelta(minutes=1)))
+            await db.commit()
+
+        # A hit makes "a" the most recently used, so "b" is the one past max entries
+        assert await get_cached_response("a") is not None
+        await store_response("c", "gpt-test", {"message": "c", "tool_calls": []})
+
+        assert await cached_keys(session_factory) == {"a", "c"}
+
+    run_cache(test)
+    assert llm_response_cache._stats["evictions"] == 1
+
+
+def test_disabled_cache_neither_stores_nor_hits(run_cache, monkeypatch):
+    monkeypatch.setattr(llm_response_cache.settings, "llm_cache_enabled", False)
+
+    async def test(session_factory):
+        await store_response("a", "gpt-test", {"message": "a", "tool_calls": []})
+        assert await get_cached_response("a") is None
+        assert await cached_keys(session_factory) == set()
+
+    run_cache(test)
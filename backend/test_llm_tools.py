@@ -0,0 +1,95 @@
+"""
+Tests for tool call argument validation and dispatch
+
+No OpenAI calls are made: tool calls are parsed from the argument strings the
+model would send and dispatched to a recording handler.
+Run with: python -m pytest test_llm_tools.py
+"""
+
+import asyncio
+import json
+
+from llm_tools import CHAT_TOOLS, TOOLS, dispatch_tool_call, parse_tool_call
+
+
+def arguments(name: str, **values):
+    call = parse_tool_call(name, json.dumps(values, ensure_ascii=False))
+    return None if call is None else call["arguments"]
+
+
+def test_integers_are_coerced_from_model_output():
+    assert arguments(
+        "update_company_data", capital_amount="1,000", invention_patent_count=" 3 ", utility_patent_count=2.0
+    ) == {"capital_amount": 1000, "invention_patent_count": 3, "utility_patent_count": 2}
+
+
+def test_values_that_are_not_integers_are_dropped():
+    assert arguments(
+        "update_company_data", industry="食品業", capital_amount=1.5, certification_count=True, esg_certification_count="幾個"
+    ) == {"industry": "食品業"}
+
+
+def test_unknown_keys_and_nulls_are_dropped():
+    assert arguments("update_company_data", industry="電子業", employees=120, esg_certification=None) == {"industry": "電子業"}
+
+
+def test_strings_and_booleans_are_coerced():
+    assert arguments("add_product", product_name="醬油", price=120) == {"product_name": "醬油", "price": "120"}
+    assert arguments("mark_completed", completed="True") == {"completed": True}
+    assert arguments("mark_completed", completed="yes") is None
+
+
+def test_missing_required_argument_rejects_the_call():
+    assert arguments("add_product", price="100") is None
+    assert arguments("add_product", product_name="") is None
+    # Dropped as invalid counts as missing too
+    assert arguments("add_product", product_name={"zh": "醬油"}) is None
+
+
+def test_unknown_tools_and_unparseable_arguments_are_ignored():
+    assert parse_tool_call("delete_company", "{}") is None
+    assert parse_tool_call("update_company_data", '{"industry": "食') is None
+    assert parse_tool_call("update_company_data", '["食品業"]') is None
+    assert parse_tool_call("update_company_data", None) == {"name": "update_company_data", "arguments": {}}
+
+
+def test_chat_tools_cover_every_handler_method():
+    assert [schema["function"]["name"] for schema in CHAT_TOOLS] == list(TOOLS)
+
+
+class RecordingHandler:
+    """Records the handler method each tool call is dispatched to"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def update_onboarding_data(self, data):
+        self.calls.append(("update_onboarding_data", data))
+        return True
+
+    async def add_product(self, data):
+        self.calls.append(("add_product", data))
+        return data["product_name"]
+
+    async def mark_completed(self, data):
+        self.calls.append(("mark_completed", data))
+        return data["completed"]
+
+
+def test_dispatch_calls_the_tools_handler_method():
+    handler = RecordingHandler()
+    calls = [
+        parse_tool_call("update_company_data", '{"capital_amount": "5,000,000"}'),
+        parse_tool_call("add_product", '{"product_name": "味噌", "unknown": 1}'),
+        parse_tool_call("mark_completed", '{"completed": false}'),
+    ]
+
+    async def run():
+        return [await dispatch_tool_call(handler, call) for call in calls]
+
+    assert asyncio.run(run()) == [True, "味噌", False]
+    assert handler.calls == [
+        ("update_onboarding_data", {"capital_amount": 5000000}),
+        ("add_product", {"product_name": "味噌"}),
+        ("mark_completed", {"completed": False}),
+    ]
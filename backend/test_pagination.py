@@ -0,0 +1,105 @@
+"""
+Tests for keyset (cursor) pagination
+
+keyset_page runs against an in-memory SQLite database (aiosqlite);
+page_loaded_rows needs no database.
+Run with: python -m pytest test_pagination.py
+"""
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from models import ChatMessage
+from pagination import encode_cursor, decode_cursor, keyset_page, page_loaded_rows
+
+
+START = datetime(2026, 1, 1, 9, 0, 0, 123456)
+# Ids 1-7; 3, 4 and 5 share a timestamp, so only the id orders them
+CREATED_AT = {1: START, 2: START + timedelta(seconds=1), 3: START + timedelta(seconds=2),
+              4: START + timedelta(seconds=2), 5: START + timedelta(seconds=2),
+              6: START + timedelta(seconds=3), 7: START + timedelta(seconds=4)}
+
+
+def walk(fetch_page, limit: int, direction: str, **page_kwargs):
+    """Follow next_cursor from the first page to the last; returns the ids of every page"""
+    pages = []
+    cursor = None
+    while True:
+        items, cursor, has_more = fetch_page(limit, **{direction: cursor}, **page_kwargs)
+        pages.append([item.id for item in items])
+        if not has_more:
+            assert cursor is None
+            return pages
+
+
+def test_cursor_round_trip():
+    for created_at, row_id in [(START, 1), (datetime(2026, 12, 31, 23, 59, 59), 2 ** 40), (datetime(2026, 1, 1), 0)]:
+        cursor = encode_cursor(created_at, row_id)
+        assert "=" not in cursor
+        assert decode_cursor(cursor) == (created_at, row_id)
+
+
+def test_malformed_cursor_is_rejected():
+    for cursor in ["not a cursor!", encode_cursor(START, 1)[:-4], "MjAyNi0wMS0wMQ"]:
+        try:
+            decode_cursor(cursor)
+            raise AssertionError(f"{cursor!r} must be rejected")
+        except HTTPException as e:
+            assert e.status_code == 400
+
+
+def test_loaded_rows_break_timestamp_ties_by_id():
+    rows = [SimpleNamespace(id=row_id, created_at=created_at) for row_id, created_at in CREATED_AT.items()]
+
+    def fetch_page(limit, **kwargs):
+        return page_loaded_rows(rows, limit, **kwargs)
+
+    # Pages split inside the run of equal timestamps without skipping or repeating a row
+    assert walk(fetch_page, 2, "before", newest_first=False) == [[6, 7], [4, 5], [2, 3], [1]]
+    assert walk(fetch_page, 2, "before") == [[7, 6], [5, 4], [3, 2], [1]]
+
+
+def test_keyset_page_breaks_timestamp_ties_by_id(run_with_database):
+    async def test(session_factory):
+        async with session_factory() as db:
+            db.add_all([
+                ChatMessage(id=row_id, session_id=1, role="user", content=str(row_id), created_at=created_at)
+                for row_id, created_at in CREATED_AT.items()
+            ])
+            await db.commit()
+
+            query = select(ChatMessage).where(ChatMessage.session_id == 1)
+
+            async def walk_from(direction: str, cursor: str = None):
+                pages = []
+                while True:
+                    items, cursor, has_more = await keyset_page(
+                        db, query, ChatMessage, 2, **{direction: cursor}, newest_first=False
+                    )
+                    pages.append([item.id for item in items])
+                    if not has_more:
+                        assert cursor is None
+                        return pages
+
+            older = await walk_from("before")
+            # Page forwards again from the oldest message and from the middle of the tie
+            newer = await walk_from("after", encode_cursor(CREATED_AT[1], 1))
+            newer_than_4 = await walk_from("after", encode_cursor(CREATED_AT[4], 4))
+            return older, newer, newer_than_4
+
+    older, newer, newer_than_4 = run_with_database(test)
+
+    assert older == [[6, 7], [4, 5], [2, 3], [1]]
+    assert newer == [[2, 3], [4, 5], [6, 7]]
+    assert newer_than_4 == [[5, 6], [7]]
+
+
+def test_before_and_after_together_are_rejected():
+    try:
+        page_loaded_rows([], 10, before=encode_cursor(START, 1), after=encode_cursor(START, 2))
+        raise AssertionError("before and after together must be rejected")
+    except HTTPException as e:
+        assert e.status_code == 400
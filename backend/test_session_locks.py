@@ -0,0 +1,97 @@
+"""
+Tests for per-session turn serialization (local lock backend, and the advisory
+lock connection pool)
+
+Run with: python -m pytest test_session_locks.py
+"""
+
+import asyncio
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+import session_locks
+from llm_limiter import LLMOverloadedError
+from session_locks import session_turn_lock
+
+
+TURN_DELAY = 0.05
+
+
+async def run_turns(session_ids):
+    """Run one simulated turn per session id; returns (max turns in flight per session, overall)"""
+    in_flight = {}
+    max_per_session = {}
+    max_overall = 0
+
+    async def turn(session_id):
+        nonlocal max_overall
+        async with session_turn_lock(session_id):
+            in_flight[session_id] = in_flight.get(session_id, 0) + 1
+            max_per_session[session_id] = max(max_per_session.get(session_id, 0), in_flight[session_id])
+            max_overall = max(max_overall, sum(in_flight.values()))
+            await asyncio.sleep(TURN_DELAY)
+            in_flight[session_id] -= 1
+
+    await asyncio.gather(*[turn(session_id) for session_id in session_ids])
+    return max_per_session, max_overall
+
+
+def test_turns_on_one_session_are_serialized():
+    max_per_session, _ = asyncio.run(run_turns([1, 1, 1]))
+
+    assert max_per_session == {1: 1}
+
+
+def test_turns_on_different_sessions_run_in_parallel():
+    max_per_session, max_overall = asyncio.run(run_turns([1, 2, 3, 1]))
+
+    assert max_per_session == {1: 1, 2: 1, 3: 1}
+    assert max_overall == 3
+
+
+def test_locks_are_dropped_once_unused():
+    asyncio.run(run_turns([1, 2, 1]))
+
+    assert len(session_locks._session_locks) == 0
+
+
+def test_lock_is_released_when_a_turn_fails():
+    async def run():
+        try:
+            async with session_turn_lock(1):
+                raise RuntimeError("turn failed")
+        except RuntimeError:
+            pass
+        # Would wait forever if the failed turn kept the lock
+        await asyncio.wait_for(run_turns([1]), timeout=1)
+
+    asyncio.run(run())
+    assert len(session_locks._session_locks) == 0
+
+
+def test_advisory_lock_is_shed_when_the_lock_pool_is_exhausted(tmp_path, monkeypatch):
+    # Exhausting the pool fails before any advisory lock SQL runs, so SQLite stands in for Postgres
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'locks.db'}",
+        poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.05
+    )
+    monkeypatch.setattr(session_locks, "lock_engine", engine)
+    monkeypatch.setattr(session_locks.settings, "session_lock_backend", "postgres")
+    monkeypatch.setattr(session_locks.settings, "llm_retry_after_seconds", 3)
+
+    async def run():
+        try:
+            # A turn in progress on another session holds the only lock connection
+            async with engine.connect():
+                async with session_turn_lock(1):
+                    raise AssertionError("no lock connection was free")
+        except LLMOverloadedError as e:
+            return e
+        finally:
+            await engine.dispose()
+
+    error = asyncio.run(run())
+
+    assert (error.retry_after, error.reason) == (3, "Too many chat turns in progress")
+    assert len(session_locks._session_locks) == 0
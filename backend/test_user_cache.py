@@ -0,0 +1,156 @@
+"""
+Tests for synced user provisioning and the user snapshot cache
+
+Runs against a SQLite database; the Postgres-only upsert is checked by
+compiling it with the PostgreSQL dialect, so no Postgres server is needed.
+Run with: python -m pytest test_user_cache.py
+"""
+
+import asyncio
+import threading
+from datetime import datetime
+
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+
+import auth
+from auth import Principal, get_current_principal, sync_user_from_jwt
+from cache import TTLCache
+from models import User, UserRole
+
+
+def snapshot_of(user: User):
+    return {field: getattr(user, field) for field in auth.USER_SNAPSHOT_FIELDS}
+
+
+def recorded_statements(session_local):
+    """List that collects the SQL the session factory's engine runs"""
+    statements = []
+    event.listen(session_local.kw["bind"], "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
+
+
+def test_cached_user_is_attached_without_a_query(api):
+    statements = recorded_statements(api.session_local)
+
+    with api.session_local() as db:
+        user = sync_user_from_jwt(db, "42", "alice")
+
+        assert user in db
+        assert (user.id, user.username, user.role, user.is_active) == (1, "alice", UserRole.USER, True)
+        assert statements == []
+
+
+def test_orm_update_invalidates_the_snapshot(api):
+    with api.session_local() as db:
+        user = sync_user_from_jwt(db, "42", "alice")
+        user.role = UserRole.ADMIN
+        db.commit()
+
+    assert auth._user_cache.get("42") is None
+    # Other users' snapshots stay
+    assert auth._user_cache.get("43")["username"] == "bob"
+
+
+def test_admin_invalidation_endpoints(api):
+    with api.session_local() as db:
+        bob = db.get(User, 2)
+        bob.role = UserRole.ADMIN
+        db.commit()
+        auth._user_cache.set("43", snapshot_of(bob))
+
+    alice = {"Authorization": f"Bearer {api.token('42')}"}
+    admin = {"Authorization": f"Bearer {api.token('43')}"}
+
+    assert api.client.delete("/api/admin/user-cache/43", headers=alice).status_code == 403
+
+    assert api.client.delete("/api/admin/user-cache/42", headers=admin).json() == {"invalidated": 1}
+    assert api.client.delete("/api/admin/user-cache/42", headers=admin).json() == {"invalidated": 0}
+    assert auth._user_cache.get("42") is None
+
+    # Only bob's own snapshot is left to clear
+    assert api.client.delete("/api/admin/user-cache", headers=admin).json() == {"invalidated": 1}
+    assert len(auth._user_cache) == 0
+
+
+class UpsertSession:
+    """Session stand-in that captures the upsert and returns the row Postgres would"""
+
+    def __init__(self, inserted: bool):
+        now = datetime(2026, 1, 1)
+        self.row = User(id=7, external_user_id="44", username="carol", role=UserRole.USER,
+                        is_active=True, created_at=now, updated_at=now)
+        self.inserted = inserted
+        self.statements = []
+        self.committed = False
+
+    def execute(self, statement):
+        self.statements.append(statement)
+        return self
+
+    def one(self):
+        return self.row, self.inserted
+
+    def commit(self):
+        self.committed = True
+
+    def merge(self, user, load=True):
+        assert load is False
+        return user
+
+
+def test_cache_miss_upserts_in_one_statement(monkeypatch):
+    monkeypatch.setattr(auth, "_user_cache", TTLCache(maxsize=10, ttl=60))
+    db = UpsertSession(inserted=True)
+
+    user = sync_user_from_jwt(db, "44", "carol")
+
+    assert (user.id, user.username) == (7, "carol") and db.committed
+    assert auth._user_cache.get("44") == snapshot_of(db.row)
+
+    [statement] = db.statements
+    sql = " ".join(str(statement.compile(dialect=postgresql.dialect())).split())
+    assert sql.startswith("INSERT INTO users (")
+    assert ("ON CONFLICT (external_user_id) DO UPDATE SET username = excluded.username, "
+            "updated_at = CASE WHEN (users.username != excluded.username) THEN excluded.updated_at "
+            "ELSE users.updated_at END") in sql
+    assert sql.endswith("xmax = 0 AS inserted")
+    assert "RETURNING users.id," in sql
+
+    # A username change misses the snapshot and upserts again
+    db = UpsertSession(inserted=False)
+    db.row.username = "carol2"
+    assert sync_user_from_jwt(db, "44", "carol2").username == "carol2"
+    assert auth._user_cache.get("44")["username"] == "carol2"
+
+
+def test_principal_provisions_on_a_miss_in_the_threadpool(api, monkeypatch):
+    provisioned = []
+
+    def sync_user(db, external_user_id, username):
+        # What the upsert does, without its Postgres-only SQL
+        user = db.query(User).filter(User.external_user_id == external_user_id).one()
+        user.username = username
+        db.commit()
+        provisioned.append((external_user_id, threading.get_ident()))
+        auth._user_cache.set(external_user_id, snapshot_of(user))
+        return user
+
+    monkeypatch.setattr(auth, "SessionLocal", api.session_local)
+    monkeypatch.setattr(auth, "sync_user_from_jwt", sync_user)
+    auth.invalidate_user_cache("42")
+
+    def principal(token):
+        return asyncio.run(get_current_principal(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)))
+
+    expected = Principal(id=1, external_user_id="42", role=UserRole.USER, is_active=True)
+    assert principal(api.token("42")) == expected
+    # Warm: served from the snapshot
+    assert principal(api.token("42", exp=4102444800)) == expected
+    # A username change re-syncs
+    assert principal(api.token("42", username="alice2")) == expected
+
+    assert [external_user_id for external_user_id, _ in provisioned] == ["42", "42"]
+    assert all(thread != threading.get_ident() for _, thread in provisioned)
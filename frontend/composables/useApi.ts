@@ -231,20 +231,29 @@ export const useApi = () => {
 
   // ============== Chatbot ==============
 
-  const sendChatMessage = async (message: string, sessionId: number | null = null) => {
+  // With an idempotency key the backend replays the first response for repeats,
+  // so the request can be retried safely on network errors
+  const sendChatMessage = async (message: string, sessionId: number | null = null, idempotencyKey?: string) => {
     const response = await $fetch('/api/chatbot/message', {
       method: 'POST',
       baseURL,
       body: { message, session_id: sessionId },
-      headers: getAuthHeaders()
+      headers: {
+        ...getAuthHeaders(),
+        ...(idempotencyKey && { 'Idempotency-Key': idempotencyKey })
+      },
+      retry: idempotencyKey ? 2 : 0,
+      retryDelay: 1000
     })
     return response
   }
 
-  const getChatSessions = async () => {
+  // Paginated: returns { items, next_cursor, has_more }; pass next_cursor as `before` for older sessions
+  const getChatSessions = async (params: { limit?: number, before?: string, after?: string } = {}) => {
     const response = await $fetch('/api/chatbot/sessions', {
       method: 'GET',
       baseURL,
+      query: params,
       headers: getAuthHeaders()
     })
     return response
@@ -268,10 +277,13 @@ export const useApi = () => {
     return response
   }
 
-  const getChatMessages = async (sessionId: number) => {
+  // Paginated: returns the most recent messages as { items, next_cursor, has_more };
+  // pass next_cursor as `before` for earlier messages
+  const getChatMessages = async (sessionId: number, params: { limit?: number, before?: string, after?: string } = {}) => {
     const response = await $fetch(`/api/chatbot/sessions/${sessionId}/messages`, {
       method: 'GET',
       baseURL,
+      query: params,
       headers: getAuthHeaders()
     })
     return response